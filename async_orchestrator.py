@@ -0,0 +1,253 @@
+"""asyncio orchestrator for batch downloads and ffmpeg post-processing.
+
+YoutubeDL is blocking, so extraction and downloads run in a dedicated thread
+pool, while ffmpeg runs as asyncio subprocesses that cost no thread at all.
+Jobs run as tasks in one TaskGroup; semaphores bound how many download or
+transcode at once, so hundreds of jobs can be in flight. A cancelled or
+timed-out download is aborted at its next progress update through a cancel
+hook; ffmpeg is killed. Leaving the orchestrator cancels whatever is still
+running and waits for the threads to exit.
+"""
+
+import asyncio
+import os
+import shutil
+import threading
+import time
+from collections.abc import Sized
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Iterable
+
+from yt_dlp.utils import DownloadCancelled
+
+from download_archive import DownloadArchive, archive_kind
+from format_selector import WindowBudget
+from stream_transcode import is_mp3
+from transcode_pipeline import run_transcode_async
+from youtube_downloader import (
+    DEFAULT_BATCH_RETRIES,
+    DEFAULT_BATCH_WORKERS,
+    BatchResult,
+    current_bandwidth_mbps,
+    download_batch_item,
+    extract_info_with_ytdlp_api,
+    log_line,
+    make_transcode_job,
+)
+
+# How many URL tasks exist at once; more URLs are read only as tasks finish.
+DEFAULT_MAX_IN_FLIGHT = 256
+
+
+class AsyncOrchestrator:
+    """Runs download jobs (and their transcodes) as asyncio tasks.
+
+    Use as an async context manager so threads and subprocesses are cleaned
+    up on exit, including on Ctrl+C.
+    """
+
+    def __init__(
+        self,
+        max_downloads: int = DEFAULT_BATCH_WORKERS,
+        max_transcodes: int | None = None,
+        download_timeout: float | None = None,
+    ) -> None:
+        self.max_downloads = max(1, max_downloads)
+        self.max_transcodes = max(1, max_transcodes or os.cpu_count() or 1)
+        self.download_timeout = download_timeout
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_downloads, thread_name_prefix="async-download"
+        )
+        self._download_slots = asyncio.Semaphore(self.max_downloads)
+        self._transcode_slots = asyncio.Semaphore(self.max_transcodes)
+        self._cancel_events: set[threading.Event] = set()
+
+    async def __aenter__(self) -> "AsyncOrchestrator":
+        return self
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        for event in list(self._cancel_events):
+            event.set()
+        # Worker threads notice the cancel flag at their next progress update.
+        await asyncio.to_thread(self._executor.shutdown, wait=True)
+
+    async def extract(self, url: str) -> dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, extract_info_with_ytdlp_api, url
+        )
+
+    async def download(self, index: int, url: str, **options: Any) -> BatchResult:
+        """Run download_batch_item in the pool, with timeout and cancellation."""
+        cancel = threading.Event()
+        self._cancel_events.add(cancel)
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        try:
+            async with self._download_slots:
+                async with asyncio.timeout(self.download_timeout):
+                    return await loop.run_in_executor(
+                        self._executor,
+                        lambda: download_batch_item(
+                            index, url, cancel=cancel, **options
+                        ),
+                    )
+        except TimeoutError:
+            cancel.set()
+            return BatchResult(
+                index=index,
+                url=url,
+                error=f"timed out after {self.download_timeout:.0f}s",
+                elapsed=time.perf_counter() - start,
+            )
+        except asyncio.CancelledError:
+            cancel.set()
+            raise
+        except DownloadCancelled as exc:
+            return BatchResult(index=index, url=url, error=str(exc))
+        finally:
+            self._cancel_events.discard(cancel)
+
+    async def transcode(
+        self, result: BatchResult, transcode: str, keep_source: bool
+    ) -> None:
+        """Post-process a finished download in place on result."""
+        job = await asyncio.to_thread(
+            make_transcode_job, result.file_path, transcode, keep_source
+        )
+        if job is None:
+            return
+        async with self._transcode_slots:
+            outcome = await run_transcode_async(job)
+        result.transcode_seconds = outcome.run_seconds
+        if outcome.ok:
+            result.file_path = outcome.output_path
+            log_line(f"[{result.index}] Transcoded to {outcome.output_path}")
+        else:
+            result.transcode_error = outcome.error
+            log_line(f"[{result.index}] Transcode failed: {outcome.error}")
+
+
+async def run_batch_async(
+    urls: Iterable[str],
+    format_selector: str = "best",
+    output_dir: str = "downloads",
+    workers: int = DEFAULT_BATCH_WORKERS,
+    retries: int = DEFAULT_BATCH_RETRIES,
+    transcode: str | None = None,
+    transcode_workers: int | None = None,
+    keep_source: bool = False,
+    connections: int = 1,
+    download_type: str = "video",
+    archive: DownloadArchive | None = None,
+    timeout: float | None = None,
+    max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+    stream_mp3: bool = False,
+    window_seconds: float | None = None,
+    max_bytes: int | None = None,
+    speed_mbps: float | None = None,
+) -> list[BatchResult]:
+    """asyncio counterpart of run_batch: one task per URL in a TaskGroup.
+
+    timeout bounds each URL's download (all retries included). urls may be
+    lazy (e.g. PlaylistEntries); it is read off the event loop, and only
+    while fewer than max_in_flight tasks exist. If the caller is cancelled,
+    every download and ffmpeg process is stopped. stream_mp3, window_seconds,
+    max_bytes and speed_mbps work as in run_batch.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    budget = None
+    if window_seconds:
+        if isinstance(urls, Sized):
+            budget = WindowBudget(window_seconds, len(urls))
+        else:
+            log_line("The window needs a known URL count; ignoring it.")
+    if budget and not (speed_mbps or current_bandwidth_mbps()):
+        log_line("No bandwidth estimate yet; the window can't limit format choice.")
+    if transcode and not shutil.which("ffmpeg"):
+        log_line("ffmpeg not found; skipping transcoding.")
+        transcode = None
+    kind = archive_kind(download_type, transcode)
+    stream_mp3_ffmpeg = None
+    if stream_mp3 and transcode == "mp3" and not keep_source:
+        stream_mp3_ffmpeg = shutil.which("ffmpeg")
+    results: list[BatchResult] = []
+
+    admission = asyncio.Semaphore(max(1, max_in_flight))
+
+    async def run_one(orchestrator: AsyncOrchestrator, index: int, url: str) -> None:
+        try:
+            await process_one(orchestrator, index, url)
+        finally:
+            admission.release()
+
+    async def process_one(
+        orchestrator: AsyncOrchestrator, index: int, url: str
+    ) -> None:
+        # The archive is checked in the worker, once the selector is known.
+        result = await orchestrator.download(
+            index,
+            url,
+            format_selector=format_selector,
+            output_dir=output_dir,
+            retries=retries,
+            aac=transcode == "aac",
+            connections=connections,
+            download_type=download_type,
+            stream_mp3_ffmpeg=stream_mp3_ffmpeg,
+            archive=archive,
+            kind=kind,
+            budget=budget,
+            max_bytes=max_bytes,
+            speed_mbps=speed_mbps,
+        )
+        if budget:
+            budget.job_done()
+        results.append(result)
+        if result.skipped:
+            return
+        if not result.ok:
+            log_line(f"[{index}] Failed: {result.error}")
+            return
+        log_line(f"[{index}] Saved {result.file_path} ({result.elapsed:.1f}s)")
+        if (transcode == "mp3" and not is_mp3(result.file_path)) or (
+            transcode == "aac" and result.postprocess == "probe"
+        ):
+            await orchestrator.transcode(result, transcode, keep_source)
+        if archive and result.ok:
+            try:
+                await asyncio.to_thread(
+                    archive.record,
+                    url,
+                    kind,
+                    result.selected_format or "",
+                    result.file_path,
+                )
+            except Exception as exc:
+                log_line(f"[{index}] Could not archive {result.file_path}: {exc}")
+
+    start = time.perf_counter()
+    async with AsyncOrchestrator(workers, transcode_workers, timeout) as orchestrator:
+        async with asyncio.TaskGroup() as group:
+            iterator = iter(urls)
+            index = 0
+            while True:
+                await admission.acquire()
+                try:
+                    url = await asyncio.to_thread(next, iterator, None)
+                except Exception as exc:
+                    # Keep what was already started when enumeration fails.
+                    log_line(f"Stopped reading URLs: {exc}")
+                    url = None
+                if url is None:
+                    admission.release()
+                    break
+                index += 1
+                group.create_task(run_one(orchestrator, index, url))
+    results.sort(key=lambda item: item.index)
+    succeeded = sum(1 for result in results if result.ok)
+    log_line(
+        f"Batch complete: {succeeded}/{len(results)} succeeded in "
+        f"{time.perf_counter() - start:.1f}s"
+    )
+    return results
@@ -0,0 +1,213 @@
+"""Process-wide bandwidth scheduling across concurrent downloads.
+
+Every download registers a job with the shared scheduler and pays for the
+bytes it receives (from its progress hook, or per chunk in the segmented
+downloader) before it reads more; blocking there is what slows it down, as
+the socket isn't read while the worker waits. Tokens refill at the total
+limit, and when downloads queue for them interactive jobs are served before
+bulk ones. A single download started by a user therefore stays fast, while
+batch jobs take whatever it leaves unused. Each job can also be capped on
+its own.
+"""
+
+import heapq
+import itertools
+import threading
+import time
+from typing import Any
+
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_BULK = "bulk"
+# Lower is served first.
+PRIORITY_RANKS = {PRIORITY_INTERACTIVE: 0, PRIORITY_BULK: 1}
+# Bucket depth, in seconds at the refill rate: how much a job that was idle
+# may burst.
+BURST_SECONDS = 0.25
+# Longest single wait, so limit changes and cancellation are noticed quickly.
+MAX_WAIT_SECONDS = 0.5
+
+
+def mbps_to_bytes(mbps: float | None) -> float | None:
+    """Bytes per second for a limit in Mbps; None or 0 means unlimited."""
+    return mbps * 1e6 / 8 if mbps else None
+
+
+class TokenBucket:
+    """Token bucket that may go into debt.
+
+    A request is granted whenever the balance is positive, even if it is
+    larger than the balance, and the debt is paid back by the refill. Callers
+    can then charge for bytes they already received without splitting them.
+    """
+
+    def __init__(self, rate_bytes: float | None) -> None:
+        self.rate_bytes = rate_bytes
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+
+    @property
+    def capacity(self) -> float:
+        return (self.rate_bytes or 0) * BURST_SECONDS
+
+    def set_rate(self, rate_bytes: float | None) -> None:
+        self.refill()
+        self.rate_bytes = rate_bytes
+        self.tokens = min(self.tokens, self.capacity)
+
+    def refill(self) -> None:
+        now = time.monotonic()
+        if self.rate_bytes:
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self._updated) * self.rate_bytes
+            )
+        self._updated = now
+
+    def wait_seconds(self) -> float:
+        """Time until the balance is positive again (0 if it already is)."""
+        self.refill()
+        if not self.rate_bytes or self.tokens > 0:
+            return 0.0
+        return -self.tokens / self.rate_bytes + 1e-3
+
+    def take(self, nbytes: int) -> None:
+        if self.rate_bytes:
+            self.tokens -= nbytes
+
+
+class BandwidthJob:
+    """One download's handle on the scheduler; close it when done."""
+
+    def __init__(
+        self,
+        scheduler: "BandwidthScheduler",
+        priority: str,
+        limit_bytes: float | None,
+    ) -> None:
+        if priority not in PRIORITY_RANKS:
+            raise ValueError(f"Unknown priority: {priority}")
+        self.scheduler = scheduler
+        self.priority = priority
+        self.bucket = TokenBucket(limit_bytes)
+        self.transferred = 0
+        self.waited_seconds = 0.0
+        self._seen: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def progress_hook(self, data: dict[str, Any]) -> None:
+        """yt-dlp progress hook: charge the bytes received since the last call."""
+        if data.get("status") not in ("downloading", "finished"):
+            return
+        downloaded = data.get("downloaded_bytes") or 0
+        filename = data.get("filename") or ""
+        with self._lock:
+            previous = self._seen.get(filename, 0)
+            # A restarted transfer reports fewer bytes than before.
+            delta = downloaded - previous if downloaded >= previous else downloaded
+            if data.get("status") == "finished":
+                self._seen.pop(filename, None)
+            else:
+                self._seen[filename] = downloaded
+        self.consume(delta)
+
+    def consume(self, nbytes: int) -> None:
+        """Block until nbytes fit this job's limit and the shared one."""
+        if nbytes <= 0:
+            return
+        start = time.monotonic()
+        while True:
+            with self._lock:
+                wait = self.bucket.wait_seconds()
+                if not wait:
+                    self.bucket.take(nbytes)
+                    break
+            time.sleep(min(wait, MAX_WAIT_SECONDS))
+        self.scheduler.acquire(self, nbytes)
+        with self._lock:
+            self.transferred += nbytes
+            self.waited_seconds += time.monotonic() - start
+
+    def close(self) -> None:
+        self.scheduler.release(self)
+
+    def __enter__(self) -> "BandwidthJob":
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+
+class BandwidthScheduler:
+    """Shares a total bandwidth limit between jobs by priority.
+
+    Jobs queue for the shared bucket in (priority, arrival) order; with no
+    total limit only the per-job limits apply.
+    """
+
+    def __init__(
+        self, total_mbps: float | None = None, job_mbps: float | None = None
+    ) -> None:
+        self.total_mbps = total_mbps
+        self.job_mbps = job_mbps
+        self._bucket = TokenBucket(mbps_to_bytes(total_mbps))
+        self._cond = threading.Condition()
+        self._waiting: list[tuple[int, int]] = []
+        self._sequence = itertools.count()
+        self._jobs: set[BandwidthJob] = set()
+
+    def configure(
+        self, total_mbps: float | None = None, job_mbps: float | None = None
+    ) -> None:
+        """Set the total and default per-job limits in Mbps (None or 0: none)."""
+        with self._cond:
+            self.total_mbps = total_mbps or None
+            self.job_mbps = job_mbps or None
+            self._bucket.set_rate(mbps_to_bytes(self.total_mbps))
+            self._cond.notify_all()
+
+    def job(
+        self, priority: str = PRIORITY_INTERACTIVE, limit_mbps: float | None = None
+    ) -> BandwidthJob:
+        """Register a download; limit_mbps overrides the default per-job limit."""
+        job = BandwidthJob(self, priority, mbps_to_bytes(limit_mbps or self.job_mbps))
+        with self._cond:
+            self._jobs.add(job)
+        return job
+
+    def release(self, job: BandwidthJob) -> None:
+        with self._cond:
+            self._jobs.discard(job)
+
+    def acquire(self, job: BandwidthJob, nbytes: int) -> None:
+        with self._cond:
+            if not self._bucket.rate_bytes:
+                return
+            ticket = (PRIORITY_RANKS[job.priority], next(self._sequence))
+            heapq.heappush(self._waiting, ticket)
+            try:
+                while True:
+                    wait = self._bucket.wait_seconds()
+                    if self._waiting[0] == ticket and not wait:
+                        self._bucket.take(nbytes)
+                        return
+                    self._cond.wait(min(wait or MAX_WAIT_SECONDS, MAX_WAIT_SECONDS))
+            finally:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._cond.notify_all()
+
+    def snapshot(self) -> dict[str, dict[str, Any]]:
+        """Active jobs, bytes and time spent waiting, per priority."""
+        with self._cond:
+            jobs = list(self._jobs)
+        stats: dict[str, dict[str, Any]] = {}
+        for job in jobs:
+            item = stats.setdefault(
+                job.priority, {"jobs": 0, "bytes": 0, "waited_seconds": 0.0}
+            )
+            item["jobs"] += 1
+            item["bytes"] += job.transferred
+            item["waited_seconds"] += job.waited_seconds
+        return stats
+
+
+SCHEDULER = BandwidthScheduler()
@@ -0,0 +1,363 @@
+"""SQLite archive of finished downloads, so repeat runs skip what is on disk.
+
+Rows are keyed by the same key as the info cache (the video id parsed from
+the URL), so checking a URL is one indexed lookup with no network round-trip.
+Each row records the kind of download (e.g. "video" or "audio+mp3"), the
+format selector it was fetched with, the output path, its size and SHA-256.
+Lookups match the selector too, so each format of a video is its own entry.
+A row only counts while its file still exists with the recorded size.
+
+The archive also runs the download directory as a cache. Every hit updates
+the entry's last access time and hit count, and hits and misses are counted
+in the database. With a byte budget, recording a new file evicts the least
+recently used (or least frequently used) files until the budget holds. Only
+files inside the archive's own directory are counted or evicted, so
+downloads saved elsewhere are never deleted.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any
+
+from info_cache import cache_key
+
+ARCHIVE_PATH = os.path.join("downloads", ".archive.sqlite3")
+HASH_CHUNK_SIZE = 1024 * 1024
+EVICT_LRU = "lru"
+EVICT_LFU = "lfu"
+EVICTION_POLICIES = (EVICT_LRU, EVICT_LFU)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS downloads (
+    video_key TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    format TEXT NOT NULL,
+    url TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    downloaded_at REAL NOT NULL,
+    PRIMARY KEY (video_key, kind, format)
+)
+"""
+# Columns added after the first release; older databases gain them on open.
+_ADDED_COLUMNS = {
+    "last_access": "REAL NOT NULL DEFAULT 0",
+    "hits": "INTEGER NOT NULL DEFAULT 0",
+}
+_STATS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache_stats (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+)
+"""
+_COLUMNS = (
+    "video_key, kind, format, url, path, size, sha256, downloaded_at, last_access, hits"
+)
+
+
+@dataclass
+class ArchiveEntry:
+    video_key: str
+    kind: str
+    format: str
+    url: str
+    path: str
+    size: int
+    sha256: str
+    downloaded_at: float
+    last_access: float = 0.0
+    hits: int = 0
+
+
+def archive_kind(download_type: str, transcode: str | None = None) -> str:
+    """Archive kind such as "video", "audio" or "audio+mp3"."""
+    return f"{download_type}+{transcode}" if transcode else download_type
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for chunk in iter(lambda: handle.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DownloadArchive:
+    """Thread-safe wrapper around one SQLite connection in WAL mode.
+
+    The database is opened on first use, so creating an archive is free.
+    max_bytes (None: unlimited) and policy set the cache budget.
+    """
+
+    def __init__(
+        self,
+        path: str = ARCHIVE_PATH,
+        max_bytes: int | None = None,
+        policy: str = EVICT_LRU,
+    ) -> None:
+        self.path = path
+        self.cache_dir = os.path.dirname(os.path.abspath(path))
+        self.max_bytes: int | None = None
+        self.policy = EVICT_LRU
+        self._lock = threading.Lock()
+        self._conn: sqlite3.Connection | None = None
+        self.configure(max_bytes, policy, evict=False)
+
+    def configure(
+        self, max_bytes: int | None = None, policy: str = EVICT_LRU, evict: bool = True
+    ) -> list[str]:
+        """Set the cache budget (None or 0: unlimited) and eviction policy.
+
+        Evicts down to the new budget right away unless evict is False, and
+        returns what was evicted.
+        """
+        if policy not in EVICTION_POLICIES:
+            raise ValueError(f"Unknown eviction policy: {policy}")
+        self.max_bytes = max_bytes or None
+        self.policy = policy
+        return self.evict() if evict else []
+
+    def _connection(self) -> sqlite3.Connection:
+        # Called with self._lock held.
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            # The CLI and the Streamlit app may share the file; wait on locks.
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(_SCHEMA)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(downloads)")}
+            for name, definition in _ADDED_COLUMNS.items():
+                if name not in columns:
+                    conn.execute(
+                        f"ALTER TABLE downloads ADD COLUMN {name} {definition}"
+                    )
+            conn.execute(_STATS_SCHEMA)
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def find(self, url: str, kind: str, format_selector: str) -> ArchiveEntry | None:
+        """Entry for url, kind and format selector, if its file is still on disk.
+
+        format_selector must be the one the file would be recorded under, so
+        a 360p file is never returned for a 1080p request. Counts as a cache
+        hit (refreshing the entry's access time) or a miss.
+        """
+        with self._lock:
+            rows = (
+                self._connection()
+                .execute(
+                    f"SELECT {_COLUMNS} FROM downloads "
+                    "WHERE video_key = ? AND kind = ? AND format = ? "
+                    "ORDER BY downloaded_at DESC",
+                    (cache_key(url), kind, format_selector),
+                )
+                .fetchall()
+            )
+        for row in rows:
+            entry = ArchiveEntry(*row)
+            try:
+                if os.path.getsize(entry.path) == entry.size:
+                    self._touch(entry)
+                    return entry
+            except OSError:
+                pass
+            self._delete(entry)
+        self._count("misses")
+        return None
+
+    def _touch(self, entry: ArchiveEntry) -> None:
+        entry.last_access = time.time()
+        entry.hits += 1
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "UPDATE downloads SET last_access = ?, hits = hits + 1 "
+                "WHERE video_key = ? AND kind = ? AND format = ?",
+                (entry.last_access, entry.video_key, entry.kind, entry.format),
+            )
+            self._increment(conn, "hits", 1)
+            conn.commit()
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            conn = self._connection()
+            self._increment(conn, name, amount)
+            conn.commit()
+
+    @staticmethod
+    def _increment(conn: sqlite3.Connection, name: str, amount: int) -> None:
+        conn.execute(
+            "INSERT INTO cache_stats VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            (name, amount),
+        )
+
+    def record(
+        self, url: str, kind: str, format_selector: str, path: str
+    ) -> ArchiveEntry:
+        """Hash path and store it as the download of url for kind.
+
+        Then evicts other files if the cache is over its budget.
+        """
+        now = time.time()
+        entry = ArchiveEntry(
+            cache_key(url),
+            kind,
+            format_selector,
+            url,
+            os.path.abspath(path),
+            os.path.getsize(path),
+            file_sha256(path),
+            now,
+            now,
+        )
+        with self._lock:
+            conn = self._connection()
+            # Another format saved under the same name was overwritten.
+            conn.execute(
+                "DELETE FROM downloads WHERE path = ? "
+                "AND NOT (video_key = ? AND kind = ? AND format = ?)",
+                (entry.path, entry.video_key, entry.kind, entry.format),
+            )
+            conn.execute(
+                f"INSERT OR REPLACE INTO downloads ({_COLUMNS}) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    entry.video_key,
+                    entry.kind,
+                    entry.format,
+                    entry.url,
+                    entry.path,
+                    entry.size,
+                    entry.sha256,
+                    entry.downloaded_at,
+                    entry.last_access,
+                    entry.hits,
+                ),
+            )
+            conn.commit()
+        self.evict(keep=entry.path)
+        return entry
+
+    def _in_cache_dir(self, path: str) -> bool:
+        return os.path.commonpath([self.cache_dir, path]) == self.cache_dir
+
+    def _cached_files(self) -> list[tuple[str, int, float, int]]:
+        """(path, size, last access, hits) per file in the cache directory.
+
+        Rows whose file is gone (deleted by hand, or by another process) are
+        dropped, so they count neither as cached nor as evicted bytes.
+        """
+        with self._lock:
+            rows = (
+                self._connection()
+                .execute(
+                    "SELECT path, MAX(size), MAX(MAX(last_access, downloaded_at)), "
+                    "SUM(hits) FROM downloads GROUP BY path"
+                )
+                .fetchall()
+            )
+        rows = [row for row in rows if self._in_cache_dir(row[0])]
+        missing = [row[0] for row in rows if not os.path.isfile(row[0])]
+        if missing:
+            with self._lock:
+                conn = self._connection()
+                conn.executemany(
+                    "DELETE FROM downloads WHERE path = ?",
+                    [(path,) for path in missing],
+                )
+                conn.commit()
+        return [row for row in rows if row[0] not in missing]
+
+    def evict(self, keep: str | None = None) -> list[str]:
+        """Delete cached files, coldest first, until the budget holds.
+
+        keep (e.g. the file just recorded) is never evicted. Returns the
+        paths removed.
+        """
+        if not self.max_bytes:
+            return []
+        files = self._cached_files()
+        total = sum(size for _, size, _, _ in files)
+        if total <= self.max_bytes:
+            return []
+        if self.policy == EVICT_LFU:
+            files.sort(key=lambda item: (item[3], item[2]))
+        else:
+            files.sort(key=lambda item: item[2])
+        evicted = []
+        for path, size, _, _ in files:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+                removed = True
+            except FileNotFoundError:
+                # Gone since _cached_files looked: not an eviction.
+                removed = False
+            except OSError:
+                continue
+            with self._lock:
+                conn = self._connection()
+                conn.execute("DELETE FROM downloads WHERE path = ?", (path,))
+                if removed:
+                    self._increment(conn, "evictions", 1)
+                    self._increment(conn, "evicted_bytes", size)
+                conn.commit()
+            total -= size
+            if removed:
+                evicted.append(path)
+        return evicted
+
+    def stats(self) -> dict[str, Any]:
+        """Cache size, budget and hit/miss/eviction counts."""
+        files = self._cached_files()
+        with self._lock:
+            counts = dict(
+                self._connection()
+                .execute("SELECT name, value FROM cache_stats")
+                .fetchall()
+            )
+        hits = counts.get("hits", 0)
+        misses = counts.get("misses", 0)
+        return {
+            "files": len(files),
+            "bytes": sum(size for _, size, _, _ in files),
+            "max_bytes": self.max_bytes,
+            "policy": self.policy,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else None,
+            "evictions": counts.get("evictions", 0),
+            "evicted_bytes": counts.get("evicted_bytes", 0),
+        }
+
+    def verify(self, entry: ArchiveEntry) -> bool:
+        """Re-hash the file and compare it with the recorded checksum."""
+        try:
+            return file_sha256(entry.path) == entry.sha256
+        except OSError:
+            return False
+
+    def _delete(self, entry: ArchiveEntry) -> None:
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "DELETE FROM downloads WHERE video_key = ? AND kind = ? AND format = ?",
+                (entry.video_key, entry.kind, entry.format),
+            )
+            conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
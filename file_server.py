@@ -0,0 +1,277 @@
+"""Serve finished downloads over HTTP with constant memory per request.
+
+Handing a file to st.download_button reads all of it into the Streamlit
+process, once per click, which doesn't work for multi-gigabyte videos. The
+FileServer here serves the download directory instead, and the app links
+to it. Bodies go out with socket.sendfile, so the kernel copies the file
+straight to the socket (os.sendfile); Python never holds more than a
+header. Single byte ranges are honoured, so browsers can seek in a video
+and interrupted downloads resume. ETag and Last-Modified validators come
+from the file's size and mtime, so repeat requests get a 304.
+
+Only regular files inside the root are served. Hidden names (the archive
+and queue databases, .segments- work directories) and partial outputs
+return 404: yt-dlp's "video.mp4.part" and its "video.mp4.part-Frag3"
+fragments, the segmented downloader's "video.mp4.seg.part", and the
+"video.part.mp3" a transcode writes into.
+
+Where it listens and how links are built come from the environment:
+
+- YTDL_FILE_SERVER_HOST: bind address (default 127.0.0.1; 0.0.0.0 to serve
+  other machines)
+- YTDL_FILE_SERVER_PORT: port (default 0, any free port)
+- YTDL_FILE_SERVER_URL: base URL browsers reach the server at, e.g. behind
+  a reverse proxy (default: built from the host and the bound port)
+"""
+
+import email.utils
+import mimetypes
+import os
+import re
+import socket
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+
+FILE_SERVER_HOST = os.environ.get("YTDL_FILE_SERVER_HOST") or "127.0.0.1"
+FILE_SERVER_PORT = int(os.environ.get("YTDL_FILE_SERVER_PORT") or 0)
+FILE_SERVER_URL = os.environ.get("YTDL_FILE_SERVER_URL") or None
+# Idle keep-alive connections are closed after this long.
+CONNECTION_TIMEOUT_SECONDS = 60
+
+_RANGE_RE = re.compile(r"bytes=(\d*)-(\d*)$")
+
+
+def is_partial_name(name: str) -> bool:
+    """True for a file some download or transcode is still writing."""
+    stem, ext = os.path.splitext(name)
+    return ext.startswith(".part") or os.path.splitext(stem)[1] == ".part"
+
+
+def file_etag(stat: os.stat_result) -> str:
+    """Strong validator: changes whenever the file is replaced or rewritten."""
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def parse_range(header: str, size: int) -> tuple[int, int] | None:
+    """(start, end) of a single "bytes=" range, inclusive; None if unsatisfiable.
+
+    Raises ValueError for a header this server doesn't handle (multiple
+    ranges, other units), which callers answer with the whole file.
+    """
+    match = _RANGE_RE.match(header.strip())
+    if not match or not (match.group(1) or match.group(2)):
+        raise ValueError(header)
+    if match.group(1):
+        start = int(match.group(1))
+        end = int(match.group(2)) if match.group(2) else size - 1
+        if match.group(2) and end < start:
+            raise ValueError(header)
+        end = min(end, size - 1)
+    else:
+        suffix = int(match.group(2))
+        if not suffix:
+            return None
+        start, end = max(size - suffix, 0), size - 1
+    if start >= size:
+        return None
+    return start, end
+
+
+class FileServer(ThreadingHTTPServer):
+    """Range- and ETag-aware HTTP server for the files under root."""
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        root: str,
+        host: str = FILE_SERVER_HOST,
+        port: int = FILE_SERVER_PORT,
+        public_url: str | None = FILE_SERVER_URL,
+    ) -> None:
+        super().__init__((host, port), _FileHandler)
+        self.root = os.path.realpath(root)
+        self.public_url = public_url.rstrip("/") if public_url else None
+        self._thread: threading.Thread | None = None
+
+    @property
+    def base_url(self) -> str:
+        """Where links point: public_url, else the address actually bound."""
+        if self.public_url:
+            return self.public_url
+        host, port = self.server_address[:2]
+        if host in ("0.0.0.0", "::"):
+            # Bound to every interface; name this machine instead.
+            host = socket.getfqdn()
+        return f"http://{host}:{port}"
+
+    def resolve(self, url_path: str) -> str | None:
+        """Filesystem path for a request path, or None if it isn't servable."""
+        relative = urllib.parse.unquote(url_path.split("?", 1)[0]).lstrip("/")
+        parts = relative.split("/")
+        if not relative or any(part.startswith(".") for part in parts):
+            return None
+        if is_partial_name(parts[-1]):
+            return None
+        path = os.path.realpath(os.path.join(self.root, *parts))
+        if os.path.commonpath([self.root, path]) != self.root:
+            return None
+        return path if os.path.isfile(path) else None
+
+    def url_for(self, path: str, download: bool = False) -> str | None:
+        """Link to path, or None when it lies outside root.
+
+        download=True asks the browser to save the file instead of playing it.
+        """
+        real_path = os.path.realpath(path)
+        if os.path.commonpath([self.root, real_path]) != self.root:
+            return None
+        relative = os.path.relpath(real_path, self.root).replace(os.sep, "/")
+        url = f"{self.base_url}/{urllib.parse.quote(relative)}"
+        return url + "?download=1" if download else url
+
+    def start(self) -> "FileServer":
+        """Serve from a daemon thread; returns self."""
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self.serve_forever, name="file-server", daemon=True
+            )
+            self._thread.start()
+        return self
+
+    def __enter__(self) -> "FileServer":
+        return self.start()
+
+    def close(self) -> None:
+        """Stop serving and release the port."""
+        if self._thread is not None:
+            self.shutdown()
+            self._thread = None
+        self.server_close()
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+
+_shared_lock = threading.Lock()
+_shared: dict[str, FileServer] = {}
+
+
+def shared_file_server(root: str) -> FileServer:
+    """The process-wide server for root, started on first use.
+
+    It lives as long as the process, so links already handed out keep
+    working (e.g. across Streamlit cache clears). Raises OSError when the
+    configured port is taken.
+    """
+    key = os.path.realpath(root)
+    with _shared_lock:
+        if key not in _shared:
+            os.makedirs(key, exist_ok=True)
+            _shared[key] = FileServer(key).start()
+        return _shared[key]
+
+
+class _FileHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    timeout = CONNECTION_TIMEOUT_SECONDS
+    server: FileServer
+
+    def do_HEAD(self) -> None:
+        self._serve(send_body=False)
+
+    def do_GET(self) -> None:
+        self._serve(send_body=True)
+
+    def _serve(self, send_body: bool) -> None:
+        path = self.server.resolve(self.path)
+        if path is None:
+            self.send_error(404)
+            return
+        try:
+            handle = open(path, "rb")
+        except OSError:
+            self.send_error(404)
+            return
+        with handle:
+            stat = os.fstat(handle.fileno())
+            size = stat.st_size
+            etag = file_etag(stat)
+            last_modified = email.utils.formatdate(stat.st_mtime, usegmt=True)
+
+            if self._not_modified(etag, stat.st_mtime):
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Last-Modified", last_modified)
+                self.end_headers()
+                return
+
+            start, end, status = 0, size - 1, 200
+            range_header = self.headers.get("Range")
+            if range_header and size and self._range_applies(etag, last_modified):
+                try:
+                    byte_range = parse_range(range_header, size)
+                except ValueError:
+                    # Multiple or malformed ranges: the whole file (a 200) is
+                    # a valid answer.
+                    byte_range = ()
+                if byte_range is None:
+                    self.send_response(416)
+                    self.send_header("Content-Range", f"bytes */{size}")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                if byte_range:
+                    (start, end), status = byte_range, 206
+
+            self.send_response(status)
+            content_type, _ = mimetypes.guess_type(path)
+            self.send_header("Content-Type", content_type or "application/octet-stream")
+            self.send_header("Content-Length", str(end - start + 1))
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("ETag", etag)
+            self.send_header("Last-Modified", last_modified)
+            # Cached copies are revalidated, which costs a 304 at most.
+            self.send_header("Cache-Control", "no-cache")
+            if "download=1" in urllib.parse.urlsplit(self.path).query:
+                filename = urllib.parse.quote(os.path.basename(path))
+                self.send_header(
+                    "Content-Disposition", f"attachment; filename*=UTF-8''{filename}"
+                )
+            if status == 206:
+                self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+            self.end_headers()
+            if not send_body or end < start:
+                return
+            try:
+                # Uses os.sendfile where available, so the bytes never pass
+                # through Python.
+                self.connection.sendfile(handle, start, end - start + 1)
+            except (BrokenPipeError, ConnectionResetError):
+                # The player seeked elsewhere or the user cancelled.
+                self.close_connection = True
+
+    def _not_modified(self, etag: str, mtime: float) -> bool:
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(",")]
+            return "*" in tags or etag in tags or f"W/{etag}" in tags
+        since = self.headers.get("If-Modified-Since")
+        if since:
+            try:
+                return (
+                    int(mtime) <= email.utils.parsedate_to_datetime(since).timestamp()
+                )
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def _range_applies(self, etag: str, last_modified: str) -> bool:
+        # If-Range: only resume when the client still has this version.
+        if_range = self.headers.get("If-Range")
+        return if_range is None or if_range.strip() in (etag, last_modified)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
@@ -0,0 +1,223 @@
+"""Pick the best format combination that fits a time or byte budget.
+
+Candidates are every combined (video+audio) format plus every video-only
+format paired with an audio-only one. Sizes come from filesize, then
+filesize_approx, then bitrate x duration, and finally a per-height bitrate
+model for formats that report nothing. The best-quality candidate whose size
+fits the budget wins; if none fits, the smallest one is returned.
+"""
+
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any
+
+# Typical bitrates (kbps) by video height, for formats with no size or bitrate.
+FALLBACK_VIDEO_KBPS = {
+    144: 100,
+    240: 250,
+    360: 500,
+    480: 1000,
+    720: 2500,
+    1080: 4500,
+    1440: 9000,
+    2160: 18000,
+}
+FALLBACK_AUDIO_KBPS = 128
+# Leave headroom for bandwidth dips and the size model's error.
+BUDGET_SAFETY_FACTOR = 0.9
+
+
+@dataclass
+class FormatPlan:
+    format_selector: str
+    label: str
+    size_bytes: int | None
+    size_is_estimate: bool
+    height: int
+    abr: float
+    fits: bool = True
+    estimated_seconds: float | None = None
+
+
+def _fallback_video_kbps(height: int) -> int:
+    for limit in sorted(FALLBACK_VIDEO_KBPS):
+        if height <= limit:
+            return FALLBACK_VIDEO_KBPS[limit]
+    return FALLBACK_VIDEO_KBPS[max(FALLBACK_VIDEO_KBPS)]
+
+
+def estimate_format_size(
+    fmt: dict[str, Any], duration: float | None
+) -> tuple[int | None, bool]:
+    """Return (size in bytes, whether it is an estimate) for one format."""
+    if fmt.get("filesize"):
+        return int(fmt["filesize"]), False
+    if fmt.get("filesize_approx"):
+        return int(fmt["filesize_approx"]), True
+    if not duration:
+        return None, True
+    kbps = fmt.get("tbr") or (fmt.get("vbr") or 0) + (fmt.get("abr") or 0)
+    if not kbps:
+        kbps = 0
+        if fmt.get("vcodec") != "none":
+            kbps += _fallback_video_kbps(fmt.get("height") or 0)
+        if fmt.get("acodec") != "none":
+            kbps += FALLBACK_AUDIO_KBPS
+    return int(kbps * 1000 / 8 * duration), True
+
+
+def _quality_key(plan: FormatPlan, mp4: bool, video_kbps: float) -> tuple:
+    # At equal height prefer MP4/M4A, which merge into MP4 without surprises.
+    return (plan.height, mp4, video_kbps, plan.abr)
+
+
+def candidate_plans(info: dict[str, Any], mode: str = "video") -> list[FormatPlan]:
+    """All downloadable combinations for mode, best quality first."""
+    duration = info.get("duration")
+    formats = info.get("formats") or []
+    audio_only = [
+        fmt
+        for fmt in formats
+        if fmt.get("vcodec") == "none" and fmt.get("acodec") not in (None, "none")
+    ]
+    ranked: list[tuple[tuple, FormatPlan]] = []
+
+    if mode == "audio":
+        for fmt in audio_only:
+            size, estimated = estimate_format_size(fmt, duration)
+            abr = fmt.get("abr") or fmt.get("tbr") or 0
+            plan = FormatPlan(
+                fmt["format_id"],
+                f"{abr:.0f} kbps {fmt.get('ext')}",
+                size,
+                estimated,
+                0,
+                abr,
+            )
+            ranked.append(((abr,), plan))
+    else:
+        for fmt in formats:
+            if fmt.get("vcodec") in (None, "none"):
+                continue
+            height = fmt.get("height") or 0
+            video_kbps = fmt.get("vbr") or fmt.get("tbr") or 0
+            size, estimated = estimate_format_size(fmt, duration)
+            if fmt.get("acodec") not in (None, "none"):
+                abr = fmt.get("abr") or 0
+                plan = FormatPlan(
+                    fmt["format_id"],
+                    f"{height}p with audio",
+                    size,
+                    estimated,
+                    height,
+                    abr,
+                )
+                ranked.append(
+                    (_quality_key(plan, fmt.get("ext") == "mp4", video_kbps), plan)
+                )
+                continue
+            for audio in audio_only:
+                audio_size, audio_estimated = estimate_format_size(audio, duration)
+                abr = audio.get("abr") or audio.get("tbr") or 0
+                total = (
+                    None if size is None or audio_size is None else size + audio_size
+                )
+                plan = FormatPlan(
+                    f"{fmt['format_id']}+{audio['format_id']}",
+                    f"{height}p + {abr:.0f} kbps audio (merged)",
+                    total,
+                    estimated or audio_estimated,
+                    height,
+                    abr,
+                )
+                mp4 = fmt.get("ext") == "mp4" and audio.get("ext") == "m4a"
+                ranked.append((_quality_key(plan, mp4, video_kbps), plan))
+
+    ranked.sort(key=lambda item: item[0], reverse=True)
+    return [plan for _, plan in ranked]
+
+
+def byte_budget(
+    bandwidth_mbps: float | None,
+    deadline_seconds: float | None,
+    max_bytes: int | None,
+) -> int | None:
+    """Bytes that fit both the byte cap and bandwidth x deadline (if given)."""
+    budgets = []
+    if max_bytes:
+        budgets.append(max_bytes)
+    if bandwidth_mbps and deadline_seconds is not None:
+        budgets.append(
+            int(bandwidth_mbps * 1e6 / 8 * deadline_seconds * BUDGET_SAFETY_FACTOR)
+        )
+    return min(budgets) if budgets else None
+
+
+def select_format(
+    info: dict[str, Any],
+    mode: str = "video",
+    bandwidth_mbps: float | None = None,
+    deadline_seconds: float | None = None,
+    max_bytes: int | None = None,
+) -> FormatPlan | None:
+    """Best candidate that fits the budget, or the smallest if none does."""
+    plans = candidate_plans(info, mode)
+    if not plans:
+        return None
+    budget = byte_budget(bandwidth_mbps, deadline_seconds, max_bytes)
+
+    chosen = None
+    if budget is None:
+        chosen = plans[0]
+    else:
+        for plan in plans:
+            if plan.size_bytes is not None and plan.size_bytes <= budget:
+                chosen = plan
+                break
+    if chosen is None:
+        sized = [plan for plan in plans if plan.size_bytes is not None]
+        chosen = min(sized, key=lambda plan: plan.size_bytes) if sized else plans[-1]
+        chosen.fits = False
+
+    if bandwidth_mbps and chosen.size_bytes:
+        chosen.estimated_seconds = chosen.size_bytes * 8 / (bandwidth_mbps * 1e6)
+    return chosen
+
+
+def describe_plan(plan: FormatPlan) -> str:
+    size = "unknown size"
+    if plan.size_bytes:
+        prefix = "~" if plan.size_is_estimate else ""
+        size = f"{prefix}{plan.size_bytes / (1024 * 1024):.1f} MB"
+    text = f"{plan.label} [{plan.format_selector}] - {size}"
+    if plan.estimated_seconds is not None:
+        text += f" - about {plan.estimated_seconds:.0f}s"
+    if not plan.fits:
+        text += " (nothing fits the budget; using the smallest)"
+    return text
+
+
+class WindowBudget:
+    """Shares a batch's maintenance window across the jobs still to finish.
+
+    Each job gets remaining_time / jobs_left as its deadline at the full link
+    rate, which is the same byte share as running `workers` jobs at once on a
+    1/workers slice of the link. Jobs that finish early or late shift the
+    share of the ones after them.
+    """
+
+    def __init__(self, window_seconds: float, jobs: int) -> None:
+        self.window_seconds = window_seconds
+        self.jobs_left = max(1, jobs)
+        self._start = time.monotonic()
+        self._lock = threading.Lock()
+
+    def job_deadline(self) -> float:
+        with self._lock:
+            remaining = self.window_seconds - (time.monotonic() - self._start)
+            return max(remaining, 0.0) / max(self.jobs_left, 1)
+
+    def job_done(self) -> None:
+        with self._lock:
+            self.jobs_left -= 1
@@ -0,0 +1,167 @@
+"""On-disk cache for yt-dlp info dicts, shared by the downloader entry points.
+
+Entries are keyed by video id (parsed from the URL, so a lookup never needs a
+network round-trip), expire after a TTL and are evicted least-recently-used
+once the cache grows past its entry or byte limits.
+"""
+
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from typing import Any
+
+INFO_CACHE_DIR = os.path.join("downloads", ".info_cache")
+# Stream URLs inside an info dict expire after a few hours, so keep this short.
+DEFAULT_TTL_SECONDS = 60 * 60
+DEFAULT_MAX_ENTRIES = 500
+DEFAULT_MAX_BYTES = 200 * 1024 * 1024
+
+_YOUTUBE_ID_RE = re.compile(
+    r"(?:[?&]v=|youtu\.be/|/shorts/|/embed/|/live/)([A-Za-z0-9_-]{11})"
+)
+
+
+def video_id_from_url(url: str) -> str | None:
+    """Return the YouTube video id in url, or None if it has none."""
+    match = _YOUTUBE_ID_RE.search(url)
+    return match.group(1) if match else None
+
+
+def cache_key(url: str) -> str:
+    """Video id when the URL has one, otherwise a hash of the URL."""
+    video_id = video_id_from_url(url)
+    if video_id:
+        return video_id
+    return "url-" + hashlib.sha1(url.strip().encode("utf-8")).hexdigest()
+
+
+class InfoCache:
+    """A directory of JSON files, one per video, with TTL and LRU eviction."""
+
+    def __init__(
+        self,
+        cache_dir: str = INFO_CACHE_DIR,
+        ttl_seconds: float = DEFAULT_TTL_SECONDS,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+    ) -> None:
+        self.cache_dir = cache_dir
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def _path(self, url: str) -> str:
+        return os.path.join(self.cache_dir, f"{cache_key(url)}.json")
+
+    def get(self, url: str) -> dict[str, Any] | None:
+        path = self._path(url)
+        try:
+            with open(path, "r", encoding="utf-8") as handle:
+                entry = json.load(handle)
+            fetched_at = float(entry["fetched_at"])
+            info = entry["info"]
+        except (OSError, KeyError, ValueError, TypeError):
+            return None
+        if time.time() - fetched_at > self.ttl_seconds:
+            self._remove(path)
+            return None
+        try:
+            # mtime doubles as the last-access time for LRU eviction.
+            os.utime(path)
+        except OSError:
+            pass
+        return info
+
+    def put(self, url: str, info: dict[str, Any]) -> None:
+        if not info:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        entry = {"url": url, "fetched_at": time.time(), "info": info}
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as handle:
+                json.dump(entry, handle)
+            os.replace(tmp_path, self._path(url))
+        except (OSError, TypeError, ValueError):
+            return
+        self._evict()
+
+    def invalidate(self, url: str) -> None:
+        self._remove(self._path(url))
+
+    def clear(self) -> None:
+        for path, _, _ in self._entries():
+            self._remove(path)
+
+    def _entries(self) -> list[tuple[str, float, int]]:
+        entries = []
+        try:
+            names = os.listdir(self.cache_dir)
+        except OSError:
+            return entries
+        for name in names:
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((path, stat.st_mtime, stat.st_size))
+        return entries
+
+    def _evict(self) -> None:
+        with self._lock:
+            entries = sorted(self._entries(), key=lambda entry: entry[1])
+            total_bytes = sum(size for _, _, size in entries)
+            while entries and (
+                len(entries) > self.max_entries or total_bytes > self.max_bytes
+            ):
+                path, _, size = entries.pop(0)
+                self._remove(path)
+                total_bytes -= size
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def extract_info_cached(
+    ydl: Any, url: str, cache: InfoCache, download: bool = False
+) -> dict[str, Any]:
+    """Extract (and optionally download) url, reusing cached info if present.
+
+    Only the extractor's result is cached, before any format is selected, so
+    each caller's format selector runs on it afresh. Cached info is fed
+    straight to ydl.process_ie_result, the same path yt-dlp uses for
+    --load-info-json. If that fails (e.g. the stream URLs expired),
+    the entry is dropped and the video is extracted again.
+    """
+    # Imported here to keep this module cheap to import; ydl means yt_dlp is
+    # already loaded.
+    from yt_dlp.utils import DownloadError
+
+    info = cache.get(url)
+    if info is not None:
+        try:
+            return ydl.process_ie_result(info, download=download)
+        except DownloadError:
+            cache.invalidate(url)
+
+    # Cache the extractor's result before format selection: a processed dict
+    # keeps the requested_formats of whichever selector processed it.
+    result = ydl.extract_info(url, download=False, process=False)
+    if not result:
+        return result
+    # A playlist's entries may be a generator, which can't be stored.
+    if result.get("_type", "video") == "video":
+        cache.put(url, ydl.sanitize_info(result))
+    return ydl.process_ie_result(result, download=download)
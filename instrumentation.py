@@ -0,0 +1,315 @@
+"""Per-stage timing for the download pipeline.
+
+Every job is broken into stages, each recorded with its duration, bytes and
+outcome:
+
+- extract:    extract_info (or a cached info dict re-processed)
+- transfer:   one file's network transfer, from its first progress update
+- merge:      yt-dlp's merge of separate video and audio downloads
+- postprocess: any other yt-dlp postprocessor (e.g. a remux)
+- transcode / probe: our own ffmpeg and ffprobe runs
+
+Records are kept as running totals in memory. The JSON lines log, which
+grows with every record, is opt-in: set YTDL_STAGE_LOG to its path (or pass
+--stage-log). Optionally, the running totals are also written as a
+Prometheus text-format file (for the node_exporter textfile collector)
+after every record.
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Any, Iterator
+
+STAGE_LOG_PATH = os.environ.get("YTDL_STAGE_LOG") or None
+# Upper bounds (seconds) of the Prometheus duration histogram buckets.
+DURATION_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+METRIC_PREFIX = "ytdl_stage"
+# Bookkeeping steps yt-dlp runs for every download; not worth a record.
+IGNORED_POSTPROCESSORS = {"MoveFiles"}
+
+
+@dataclass
+class StageRecord:
+    stage: str
+    seconds: float
+    ok: bool
+    bytes: int = 0
+    job: str | None = None
+    url: str | None = None
+    detail: str | None = None
+    error: str | None = None
+    timestamp: float = field(default_factory=time.time)
+
+
+@dataclass
+class _StageTotals:
+    runs: int = 0
+    failures: int = 0
+    seconds: float = 0.0
+    bytes: int = 0
+    buckets: list[int] = field(default_factory=lambda: [0] * len(DURATION_BUCKETS))
+
+
+class StageSpan:
+    """Handed out by StageRecorder.stage(); set bytes or detail before exit."""
+
+    def __init__(self) -> None:
+        self.bytes = 0
+        self.detail: str | None = None
+        self.ok = True
+        self.error: str | None = None
+
+    def fail(self, error: str) -> None:
+        self.ok = False
+        self.error = error
+
+
+class StageRecorder:
+    """Collects StageRecords; thread-safe, shared process-wide."""
+
+    def __init__(
+        self,
+        jsonl_path: str | None = STAGE_LOG_PATH,
+        prometheus_path: str | None = None,
+    ) -> None:
+        self.jsonl_path = jsonl_path
+        self.prometheus_path = prometheus_path
+        self._lock = threading.Lock()
+        self._totals: dict[str, _StageTotals] = {}
+
+    def configure(
+        self, jsonl_path: str | None = None, prometheus_path: str | None = None
+    ) -> None:
+        with self._lock:
+            if jsonl_path is not None:
+                self.jsonl_path = jsonl_path or None
+            if prometheus_path is not None:
+                self.prometheus_path = prometheus_path or None
+
+    @contextmanager
+    def stage(
+        self,
+        name: str,
+        job: str | None = None,
+        url: str | None = None,
+        detail: str | None = None,
+    ) -> Iterator[StageSpan]:
+        """Time the with-block as one stage; exceptions mark it failed."""
+        span = StageSpan()
+        span.detail = detail
+        start = time.perf_counter()
+        try:
+            yield span
+        except BaseException as exc:
+            span.fail(str(exc) or type(exc).__name__)
+            raise
+        finally:
+            self.record(
+                StageRecord(
+                    stage=name,
+                    seconds=time.perf_counter() - start,
+                    ok=span.ok,
+                    bytes=span.bytes,
+                    job=job,
+                    url=url,
+                    detail=span.detail,
+                    error=span.error,
+                )
+            )
+
+    def record(self, record: StageRecord) -> None:
+        with self._lock:
+            totals = self._totals.setdefault(record.stage, _StageTotals())
+            totals.runs += 1
+            totals.failures += 0 if record.ok else 1
+            totals.seconds += record.seconds
+            totals.bytes += record.bytes
+            for index, bound in enumerate(DURATION_BUCKETS):
+                if record.seconds <= bound:
+                    totals.buckets[index] += 1
+            try:
+                if self.jsonl_path:
+                    directory = os.path.dirname(os.path.abspath(self.jsonl_path))
+                    os.makedirs(directory, exist_ok=True)
+                    with open(self.jsonl_path, "a", encoding="utf-8") as handle:
+                        handle.write(json.dumps(asdict(record)) + "\n")
+                if self.prometheus_path:
+                    self._write_prometheus()
+            except OSError:
+                # Instrumentation must never fail a download.
+                pass
+
+    def summary(self) -> dict[str, dict[str, Any]]:
+        """Per stage: runs, failures, total and average seconds, bytes."""
+        with self._lock:
+            return {
+                stage: {
+                    "runs": totals.runs,
+                    "failures": totals.failures,
+                    "seconds": totals.seconds,
+                    "avg_seconds": totals.seconds / totals.runs if totals.runs else 0,
+                    "bytes": totals.bytes,
+                }
+                for stage, totals in self._totals.items()
+            }
+
+    def summary_lines(self) -> list[str]:
+        lines = []
+        for stage, item in sorted(self.summary().items()):
+            lines.append(
+                f"{stage}: {item['runs']} runs ({item['failures']} failed), "
+                f"avg {item['avg_seconds']:.2f}s, total {item['seconds']:.1f}s, "
+                f"{item['bytes'] / (1024 * 1024):.1f} MB"
+            )
+        return lines
+
+    def prometheus_text(self) -> str:
+        with self._lock:
+            return self._prometheus_text()
+
+    def _prometheus_text(self) -> str:
+        name = METRIC_PREFIX
+        lines = [
+            f"# HELP {name}_duration_seconds Time spent per pipeline stage.",
+            f"# TYPE {name}_duration_seconds histogram",
+        ]
+        for stage, totals in sorted(self._totals.items()):
+            for bound, count in zip(DURATION_BUCKETS, totals.buckets):
+                lines.append(
+                    f'{name}_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} '
+                    f"{count}"
+                )
+            lines.append(
+                f'{name}_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} '
+                f"{totals.runs}"
+            )
+            lines.append(
+                f'{name}_duration_seconds_sum{{stage="{stage}"}} {totals.seconds}'
+            )
+            lines.append(
+                f'{name}_duration_seconds_count{{stage="{stage}"}} {totals.runs}'
+            )
+        lines += [
+            f"# HELP {name}_bytes_total Bytes handled per pipeline stage.",
+            f"# TYPE {name}_bytes_total counter",
+        ]
+        for stage, totals in sorted(self._totals.items()):
+            lines.append(f'{name}_bytes_total{{stage="{stage}"}} {totals.bytes}')
+        lines += [
+            f"# HELP {name}_runs_total Stage runs by outcome.",
+            f"# TYPE {name}_runs_total counter",
+        ]
+        for stage, totals in sorted(self._totals.items()):
+            ok = totals.runs - totals.failures
+            lines.append(f'{name}_runs_total{{stage="{stage}",outcome="ok"}} {ok}')
+            lines.append(
+                f'{name}_runs_total{{stage="{stage}",outcome="error"}} '
+                f"{totals.failures}"
+            )
+        return "\n".join(lines) + "\n"
+
+    def _write_prometheus(self) -> None:
+        # Called with self._lock held. Written atomically so a scraper never
+        # reads half a file.
+        directory = os.path.dirname(os.path.abspath(self.prometheus_path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as handle:
+                handle.write(self._prometheus_text())
+            os.replace(tmp_path, self.prometheus_path)
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+
+STAGES = StageRecorder()
+
+
+def new_job_id() -> str:
+    return os.urandom(6).hex()
+
+
+class StageHooks:
+    """yt-dlp progress and postprocessor hooks that record transfer and merge.
+
+    Add `progress_hook` to progress_hooks and `postprocessor_hook` to
+    postprocessor_hooks of the YoutubeDL running the job.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        job: str | None = None,
+        recorder: StageRecorder = STAGES,
+    ) -> None:
+        self.url = url
+        self.job = job or new_job_id()
+        self.recorder = recorder
+        self._transfers: dict[str, float] = {}
+        self._postprocessors: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def progress_hook(self, data: dict[str, Any]) -> None:
+        filename = data.get("filename") or ""
+        status = data.get("status")
+        now = time.perf_counter()
+        with self._lock:
+            if status == "downloading" and filename not in self._transfers:
+                self._transfers[filename] = now
+                return
+            if status not in ("finished", "error") or filename not in self._transfers:
+                return
+            started = self._transfers.pop(filename)
+        self.recorder.record(
+            StageRecord(
+                stage="transfer",
+                seconds=now - started,
+                ok=status == "finished",
+                bytes=data.get("total_bytes") or data.get("downloaded_bytes") or 0,
+                job=self.job,
+                url=self.url,
+                detail=os.path.basename(filename),
+            )
+        )
+
+    def postprocessor_hook(self, data: dict[str, Any]) -> None:
+        name = data.get("postprocessor") or "unknown"
+        if name in IGNORED_POSTPROCESSORS:
+            return
+        status = data.get("status")
+        now = time.perf_counter()
+        if status == "started":
+            with self._lock:
+                self._postprocessors[name] = now
+            return
+        if status != "finished":
+            return
+        with self._lock:
+            started = self._postprocessors.pop(name, None)
+        if started is None:
+            return
+        output = (data.get("info_dict") or {}).get("filepath")
+        try:
+            size = os.path.getsize(output) if output else 0
+        except OSError:
+            size = 0
+        self.recorder.record(
+            StageRecord(
+                stage="merge" if name == "Merger" else "postprocess",
+                seconds=now - started,
+                ok=True,
+                bytes=size,
+                job=self.job,
+                url=self.url,
+                detail=name,
+            )
+        )
@@ -0,0 +1,440 @@
+"""Shared SQLite job queue, so concurrent sessions don't repeat downloads.
+
+Every request is submitted under a coalescing key built from whatever
+determines its output (URL, format, kind, output template...). While a job
+with the same key is queued or running, a new submission returns that job
+instead of adding another, so two users asking for the same video share one
+download. A fixed pool of worker threads serves the queue, which bounds the
+server's load however many sessions are open. Jobs, their progress and
+their results live in SQLite, so any session can poll a job by id.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Any, Callable
+
+JOB_QUEUE_PATH = os.path.join("downloads", ".jobs.sqlite3")
+DEFAULT_QUEUE_WORKERS = 2
+# Progress is written at most this often per job (status changes always are).
+PROGRESS_INTERVAL_SECONDS = 0.5
+# How often idle workers look for jobs submitted by another process.
+POLL_SECONDS = 1.0
+# Finished jobs older than this are deleted when the queue starts.
+FINISHED_JOB_TTL_SECONDS = 24 * 60 * 60
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY,
+        coalesce_key TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        status TEXT NOT NULL,
+        subscribers INTEGER NOT NULL,
+        owner_pid INTEGER,
+        downloaded_bytes INTEGER NOT NULL,
+        total_bytes INTEGER,
+        message TEXT NOT NULL,
+        result TEXT,
+        error TEXT,
+        created_at REAL NOT NULL,
+        started_at REAL,
+        finished_at REAL
+    )
+    """,
+    # At most one job per key is in flight; this is what makes coalescing
+    # safe when several processes share the file.
+    """
+    CREATE UNIQUE INDEX IF NOT EXISTS jobs_in_flight ON jobs (coalesce_key)
+    WHERE status IN ('queued', 'running')
+    """,
+    "CREATE INDEX IF NOT EXISTS jobs_by_status ON jobs (status, created_at)",
+)
+_COLUMNS = (
+    "id, coalesce_key, payload, status, subscribers, owner_pid, "
+    "downloaded_bytes, total_bytes, message, result, error, "
+    "created_at, started_at, finished_at"
+)
+
+
+@dataclass
+class QueuedJob:
+    id: str
+    coalesce_key: str
+    payload: dict[str, Any]
+    status: str
+    subscribers: int
+    owner_pid: int | None
+    downloaded_bytes: int
+    total_bytes: int | None
+    message: str
+    result: dict[str, Any] | None
+    error: str | None
+    created_at: float
+    started_at: float | None
+    finished_at: float | None
+
+    @classmethod
+    def from_row(cls, row: tuple) -> "QueuedJob":
+        values = list(row)
+        values[2] = json.loads(values[2])
+        values[9] = json.loads(values[9]) if values[9] else None
+        return cls(*values)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (JOB_DONE, JOB_FAILED)
+
+    @property
+    def ok(self) -> bool:
+        return self.status == JOB_DONE
+
+    @property
+    def fraction(self) -> float | None:
+        """Share of the download done, when the size is known."""
+        if not self.total_bytes:
+            return None
+        return min(self.downloaded_bytes / self.total_bytes, 1.0)
+
+
+# A runner gets the job's payload and a report(message, downloaded, total)
+# callback, and returns a JSON-serialisable result; raising fails the job.
+# It may instead return a Future of that result (e.g. a transcode still
+# running elsewhere): the worker moves on to the next job, and the job
+# stays running until the future resolves.
+ProgressReport = Callable[[str | None, int | None, int | None], None]
+JobRunner = Callable[
+    [dict[str, Any], ProgressReport], dict[str, Any] | Future[dict[str, Any]]
+]
+
+
+def coalesce_key(payload: dict[str, Any], ignore: tuple[str, ...] = ()) -> str:
+    """Stable key for payload, leaving out fields that don't change the output."""
+    relevant = {name: value for name, value in payload.items() if name not in ignore}
+    encoded = json.dumps(relevant, sort_keys=True, default=repr)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def _pid_alive(pid: int | None) -> bool:
+    if not pid:
+        return False
+    if sys.platform == "win32":
+        return _windows_pid_alive(pid)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # Exists but belongs to someone else.
+        return True
+    return True
+
+
+def _windows_pid_alive(pid: int) -> bool:
+    # os.kill(pid, 0) on Windows sends CTRL_C_EVENT rather than checking.
+    import ctypes
+
+    kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+    kernel32.OpenProcess.argtypes = [ctypes.c_ulong, ctypes.c_int, ctypes.c_ulong]
+    kernel32.OpenProcess.restype = ctypes.c_void_p
+    kernel32.GetExitCodeProcess.argtypes = [
+        ctypes.c_void_p,
+        ctypes.POINTER(ctypes.c_ulong),
+    ]
+    kernel32.CloseHandle.argtypes = [ctypes.c_void_p]
+    process_query_limited_information = 0x1000
+    still_active = 259
+    error_access_denied = 5
+    handle = kernel32.OpenProcess(process_query_limited_information, False, pid)
+    if not handle:
+        # Access is denied only to a process that exists.
+        return ctypes.get_last_error() == error_access_denied
+    try:
+        exit_code = ctypes.c_ulong()
+        if not kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code)):
+            return True
+        return exit_code.value == still_active
+    finally:
+        kernel32.CloseHandle(handle)
+
+
+class JobQueue:
+    """Coalescing job queue in SQLite, served by a fixed pool of threads."""
+
+    def __init__(
+        self,
+        runner: JobRunner,
+        path: str = JOB_QUEUE_PATH,
+        workers: int = DEFAULT_QUEUE_WORKERS,
+    ) -> None:
+        self.runner = runner
+        self.path = path
+        self.workers = max(1, workers)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition()
+        self._stopping = threading.Event()
+        self._conn: sqlite3.Connection | None = None
+        with self._lock:
+            self._recover()
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"job-{index}", daemon=True)
+            for index in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def _connection(self) -> sqlite3.Connection:
+        # Called with self._lock held.
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            # Transactions are explicit (BEGIN IMMEDIATE) so a check-then-write
+            # can't interleave with another process.
+            conn = sqlite3.connect(
+                self.path, timeout=30, check_same_thread=False, isolation_level=None
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            for statement in _SCHEMA:
+                conn.execute(statement)
+            self._conn = conn
+        return self._conn
+
+    def _recover(self) -> None:
+        """Fail jobs whose worker process died and drop old finished jobs."""
+        conn = self._connection()
+        rows = conn.execute(
+            "SELECT id, owner_pid FROM jobs WHERE status = ?", (JOB_RUNNING,)
+        ).fetchall()
+        now = time.time()
+        for job_id, owner_pid in rows:
+            if not _pid_alive(owner_pid):
+                conn.execute(
+                    "UPDATE jobs SET status = ?, error = ?, finished_at = ? "
+                    "WHERE id = ? AND status = ?",
+                    (JOB_FAILED, "Interrupted by a restart", now, job_id, JOB_RUNNING),
+                )
+        conn.execute(
+            "DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+            (JOB_DONE, JOB_FAILED, now - FINISHED_JOB_TTL_SECONDS),
+        )
+
+    def submit(self, key: str, payload: dict[str, Any]) -> tuple[QueuedJob, bool]:
+        """Queue payload under key, or join the job already in flight for it.
+
+        Returns the job and whether it was an existing one.
+        """
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    f"SELECT {_COLUMNS} FROM jobs "
+                    "WHERE coalesce_key = ? AND status IN (?, ?)",
+                    (key, JOB_QUEUED, JOB_RUNNING),
+                ).fetchone()
+                if row:
+                    conn.execute(
+                        "UPDATE jobs SET subscribers = subscribers + 1 WHERE id = ?",
+                        (row[0],),
+                    )
+                else:
+                    job_id = uuid.uuid4().hex
+                    conn.execute(
+                        f"INSERT INTO jobs ({_COLUMNS}) VALUES "
+                        "(?, ?, ?, ?, 1, NULL, 0, NULL, '', NULL, NULL, ?, NULL, NULL)",
+                        (job_id, key, json.dumps(payload), JOB_QUEUED, time.time()),
+                    )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        job = self.get(row[0] if row else job_id)
+        if not row:
+            with self._wakeup:
+                self._wakeup.notify()
+        return job, bool(row)
+
+    def get(self, job_id: str) -> QueuedJob | None:
+        with self._lock:
+            row = (
+                self._connection()
+                .execute(f"SELECT {_COLUMNS} FROM jobs WHERE id = ?", (job_id,))
+                .fetchone()
+            )
+        return QueuedJob.from_row(row) if row else None
+
+    def get_many(self, job_ids: list[str]) -> list[QueuedJob]:
+        """The jobs that still exist among job_ids, in the same order."""
+        if not job_ids:
+            return []
+        placeholders = ", ".join("?" for _ in job_ids)
+        with self._lock:
+            rows = (
+                self._connection()
+                .execute(
+                    f"SELECT {_COLUMNS} FROM jobs WHERE id IN ({placeholders})",
+                    job_ids,
+                )
+                .fetchall()
+            )
+        jobs = {row[0]: QueuedJob.from_row(row) for row in rows}
+        return [jobs[job_id] for job_id in job_ids if job_id in jobs]
+
+    def wait(
+        self, job_id: str, timeout: float | None = None, poll: float = 0.25
+    ) -> QueuedJob | None:
+        """Poll until the job finishes or timeout passes; return its last state."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            if job is None or job.finished:
+                return job
+            if deadline is not None and time.monotonic() >= deadline:
+                return job
+            time.sleep(poll)
+
+    def active(self) -> list[QueuedJob]:
+        """Queued and running jobs, oldest first."""
+        with self._lock:
+            rows = (
+                self._connection()
+                .execute(
+                    f"SELECT {_COLUMNS} FROM jobs WHERE status IN (?, ?) "
+                    "ORDER BY created_at",
+                    (JOB_QUEUED, JOB_RUNNING),
+                )
+                .fetchall()
+            )
+        return [QueuedJob.from_row(row) for row in rows]
+
+    def stats(self) -> dict[str, int]:
+        """Job counts by status."""
+        with self._lock:
+            rows = (
+                self._connection()
+                .execute("SELECT status, COUNT(*) FROM jobs GROUP BY status")
+                .fetchall()
+            )
+        return dict(rows)
+
+    def shutdown(self) -> None:
+        """Stop the workers once their current jobs finish.
+
+        Jobs still queued stay in the database for the next queue to run.
+        """
+        self._stopping.set()
+        with self._wakeup:
+            self._wakeup.notify_all()
+
+    def _worker(self) -> None:
+        while not self._stopping.is_set():
+            job = self._claim()
+            if job is None:
+                with self._wakeup:
+                    self._wakeup.wait(POLL_SECONDS)
+                continue
+            try:
+                self._run(job)
+            except Exception:
+                # _run already tried to fail the job; the database itself is
+                # failing, so keep the worker alive and try the next one.
+                pass
+
+    def _claim(self) -> QueuedJob | None:
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT id FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1",
+                    (JOB_QUEUED,),
+                ).fetchone()
+                if row:
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, owner_pid = ?, started_at = ? "
+                        "WHERE id = ?",
+                        (JOB_RUNNING, os.getpid(), time.time(), row[0]),
+                    )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return self.get(row[0]) if row else None
+
+    def _run(self, job: QueuedJob) -> None:
+        last_write = 0.0
+
+        def report(
+            message: str | None = None,
+            downloaded_bytes: int | None = None,
+            total_bytes: int | None = None,
+        ) -> None:
+            nonlocal last_write
+            now = time.monotonic()
+            if message is None and now - last_write < PROGRESS_INTERVAL_SECONDS:
+                return
+            last_write = now
+            self._update(
+                job.id,
+                message=message,
+                downloaded_bytes=downloaded_bytes,
+                total_bytes=total_bytes,
+            )
+
+        try:
+            result = self.runner(job.payload, report)
+        except Exception as exc:
+            self._fail(job.id, exc)
+            return
+        if isinstance(result, Future):
+            result.add_done_callback(lambda done: self._resolve(job.id, done))
+            return
+        self._finish(job.id, result)
+
+    def _resolve(self, job_id: str, future: Future[dict[str, Any]]) -> None:
+        # Runs on whichever thread completed the future.
+        try:
+            self._finish(job_id, future.result())
+        except Exception as exc:
+            try:
+                self._fail(job_id, exc)
+            except Exception:
+                # The database itself is failing; nothing left to mark.
+                pass
+
+    def _finish(self, job_id: str, result: dict[str, Any]) -> None:
+        try:
+            # A result that can't be stored fails the job like a runner error.
+            self._update(
+                job_id,
+                status=JOB_DONE,
+                result=json.dumps(result),
+                finished_at=time.time(),
+            )
+        except Exception as exc:
+            self._fail(job_id, exc)
+
+    def _fail(self, job_id: str, exc: BaseException) -> None:
+        self._update(job_id, status=JOB_FAILED, error=str(exc), finished_at=time.time())
+
+    def _update(self, job_id: str, **fields: Any) -> None:
+        fields = {name: value for name, value in fields.items() if value is not None}
+        if not fields:
+            return
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            self._connection().execute(
+                f"UPDATE jobs SET {assignments} WHERE id = ?",
+                (*fields.values(), job_id),
+            )
@@ -0,0 +1,200 @@
+"""Lazy playlist and channel enumeration for batch downloads.
+
+Entries are read with flat extraction, straight from the extractor's own
+page generator (never through process_ie_result or yt-dlp's PlaylistEntries,
+which keep every resolved entry in memory), and yielded as URLs as soon as
+each page arrives. playliststart, playlistend and playlist_items are applied
+by index as entries go past, so nothing is cached for them. A background
+thread reads ahead by at most `prefetch` entries, so the next page is
+fetched while workers download, and memory stays flat however long the
+playlist is.
+"""
+
+import itertools
+import queue
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Iterable, Iterator
+
+DEFAULT_PREFETCH = 8
+# Redirects followed from a URL result (e.g. a channel to its videos tab).
+MAX_URL_RESOLVES = 3
+# How many recent video ids are remembered to skip duplicates.
+DUPLICATE_WINDOW = 1000
+
+_DONE = object()
+
+
+def _entry_url(entry: dict[str, Any]) -> str | None:
+    url = entry.get("webpage_url") or entry.get("url")
+    if url and "://" in url:
+        return url
+    if entry.get("ie_key") == "Youtube" and entry.get("id"):
+        return f"https://www.youtube.com/watch?v={entry['id']}"
+    return url
+
+
+def _iter_entries(entries: Any) -> Iterable[Any]:
+    """A playlist's entries in order, without keeping the ones already read."""
+    from yt_dlp.utils import PagedList
+
+    if isinstance(entries, PagedList):
+        # getslice() would build a list of every entry, and the page cache
+        # would keep them all; read the pages through the generator behind
+        # it with caching off (the constructor's use_cache flag).
+        entries._use_cache = False
+        return entries._getslice(0, None)
+    return entries or ()
+
+
+def requested_index(params: dict[str, Any]) -> tuple[Callable[[int], bool], float]:
+    """Which 1-based entry indices params select, and the last one that can be.
+
+    Understands playlist_items ("1-3,7,10:20:2") and playliststart /
+    playlistend. Entries come out in playlist order, not the order the items
+    are listed in. Indices counted from the end (negative) need the whole
+    playlist up front, so they raise ValueError.
+    """
+    from yt_dlp.utils import PlaylistEntries as YtdlpPlaylistEntries
+
+    items = params.get("playlist_items")
+    if not items:
+        end = params.get("playlistend")
+        items = f"{params.get('playliststart') or 1}:{'' if end in (-1, None) else end}"
+    specs = list(YtdlpPlaylistEntries.parse_playlist_items(items))
+    ranges = []
+    for spec in specs:
+        if isinstance(spec, int):
+            spec = slice(spec, spec, 1)
+        first = spec.start if spec.start is not None else 1
+        last = spec.stop if spec.stop is not None else float("inf")
+        step = spec.step or 1
+        if first < 1 or last < 0 or step < 0:
+            raise ValueError(
+                f"playlist items {items!r} count from the end, which a lazily "
+                "read playlist can't do"
+            )
+        ranges.append((first, last, step))
+
+    def wanted(index: int) -> bool:
+        return any(
+            first <= index <= last and (index - first) % step == 0
+            for first, last, step in ranges
+        )
+
+    return wanted, max((last for _, last, _ in ranges), default=float("inf"))
+
+
+def iter_entry_urls(
+    url: str, extra_opts: dict[str, Any] | None = None
+) -> Iterator[str]:
+    """Yield the video URLs of a playlist or channel page by page.
+
+    A URL that isn't a playlist yields itself. Nested playlists are walked
+    depth first, each with the requested item selection. A video id seen
+    among the last DUPLICATE_WINDOW entries is skipped.
+    """
+    from yt_dlp import YoutubeDL
+
+    ydl_opts = {"extract_flat": "in_playlist", "quiet": True, **(extra_opts or {})}
+    with YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(url, download=False, process=False)
+        for _ in range(MAX_URL_RESOLVES):
+            if not info or info.get("_type") not in ("url", "url_transparent"):
+                break
+            info = ydl.extract_info(
+                info["url"], download=False, process=False, ie_key=info.get("ie_key")
+            )
+        if not info:
+            return
+        if info.get("_type") not in ("playlist", "multi_video"):
+            yield info.get("webpage_url") or url
+            return
+        yield from playlist_entry_urls(info, ydl.params)
+
+
+def playlist_entry_urls(
+    playlist: dict[str, Any],
+    params: dict[str, Any],
+    seen: OrderedDict[str, None] | None = None,
+) -> Iterator[str]:
+    """URLs of the selected entries of a flat-extracted playlist info dict."""
+    wanted, last = requested_index(params)
+    if seen is None:
+        seen = OrderedDict()
+    indexed = enumerate(_iter_entries(playlist.get("entries")), start=1)
+    if last != float("inf"):
+        # Stop reading (and fetching pages) at the last selectable entry.
+        indexed = itertools.islice(indexed, int(last))
+    for index, entry in indexed:
+        if not entry or not wanted(index):
+            continue
+        if entry.get("_type") in ("playlist", "multi_video"):
+            yield from playlist_entry_urls(entry, params, seen)
+            continue
+        entry_id = entry.get("id")
+        if entry_id:
+            if entry_id in seen:
+                continue
+            seen[entry_id] = None
+            if len(seen) > DUPLICATE_WINDOW:
+                seen.popitem(last=False)
+        entry_url = _entry_url(entry)
+        if entry_url:
+            yield entry_url
+
+
+class PlaylistEntries:
+    """Iterable of a playlist's entry URLs, read ahead by a bounded window.
+
+    Errors raised while enumerating are re-raised from the iterator.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        prefetch: int = DEFAULT_PREFETCH,
+        extra_opts: dict[str, Any] | None = None,
+    ) -> None:
+        self.url = url
+        self.prefetch = max(1, prefetch)
+        self.extra_opts = extra_opts
+        self.discovered = 0
+
+    def __iter__(self) -> Iterator[str]:
+        buffer: queue.Queue = queue.Queue(maxsize=self.prefetch)
+        stop = threading.Event()
+
+        def put(item: object) -> bool:
+            # Poll so an abandoned iterator doesn't leave the thread blocked.
+            while not stop.is_set():
+                try:
+                    buffer.put(item, timeout=0.5)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def produce() -> None:
+            try:
+                for entry_url in iter_entry_urls(self.url, self.extra_opts):
+                    if not put(entry_url):
+                        return
+            except Exception as exc:
+                put(exc)
+                return
+            put(_DONE)
+
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+        try:
+            while True:
+                item = buffer.get()
+                if item is _DONE:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                self.discovered += 1
+                yield item
+        finally:
+            stop.set()
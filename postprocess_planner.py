@@ -0,0 +1,156 @@
+"""Plan the AAC audio post-processing step so it costs at most one ffmpeg pass.
+
+The old path probed the file with `ffmpeg -i`, re-encoded the whole file into
+an `_aac` sibling and swapped it in, even when the audio was already AAC. The
+planner looks at the formats yt-dlp selected (or probes the file once with
+ffprobe's JSON output when the codec is unknown) and picks one of:
+
+- skip:     the audio is already AAC (or there is none); nothing to do.
+- copy:     the formats are merged and the audio is AAC, so the merge's own
+            stream copy produces the final file.
+- reencode: AAC encoding is folded into yt-dlp's postprocessor chain, either
+            into the merge pass or into a single stream-copy pass.
+- probe:    the codec isn't known up front; probe the file after download.
+"""
+
+import json
+import shutil
+import subprocess
+from dataclasses import dataclass, field
+from typing import Any
+
+from instrumentation import STAGES
+
+AAC_ARGS = ["-c:a", "aac", "-b:a", "192k"]
+# Containers yt-dlp can stream-copy into that also accept AAC audio.
+AAC_CONTAINERS = {"mp4", "m4v", "mov", "mkv"}
+
+
+@dataclass
+class PostprocessPlan:
+    action: str
+    reason: str
+    ydl_opts: dict[str, Any] = field(default_factory=dict)
+
+
+def is_aac(codec: str | None) -> bool:
+    return bool(codec) and (codec == "aac" or codec.startswith("mp4a"))
+
+
+def probe_media(file_path: str, ffprobe_path: str | None = None) -> dict | None:
+    """Return ffprobe's JSON description of file_path, or None if it fails."""
+    ffprobe_path = ffprobe_path or shutil.which("ffprobe")
+    if not ffprobe_path:
+        return None
+    with STAGES.stage("probe", detail=file_path) as span:
+        probe = _run_ffprobe(ffprobe_path, file_path)
+        if probe is None:
+            span.fail("ffprobe failed")
+        return probe
+
+
+def _run_ffprobe(ffprobe_path: str, file_path: str) -> dict | None:
+    try:
+        result = subprocess.run(
+            [
+                ffprobe_path,
+                "-v",
+                "error",
+                "-print_format",
+                "json",
+                "-show_format",
+                "-show_streams",
+                file_path,
+            ],
+            capture_output=True,
+            text=True,
+            timeout=60,
+        )
+        if result.returncode != 0:
+            return None
+        return json.loads(result.stdout)
+    except (OSError, subprocess.TimeoutExpired, json.JSONDecodeError):
+        return None
+
+
+def probe_audio_codec(probe: dict | None) -> str | None:
+    """Codec name of the first audio stream, "none" if there is none."""
+    if not probe:
+        return None
+    for stream in probe.get("streams", []):
+        if stream.get("codec_type") == "audio":
+            return stream.get("codec_name")
+    return "none"
+
+
+def plan_from_probe(probe: dict | None) -> PostprocessPlan:
+    """Decide on a downloaded file's audio from one ffprobe run."""
+    codec = probe_audio_codec(probe)
+    if codec is None:
+        # Unknown is not "already AAC": re-encoding is the safe answer.
+        return PostprocessPlan("reencode", "could not probe the file")
+    if codec == "none":
+        return PostprocessPlan("skip", "no audio stream")
+    if is_aac(codec):
+        return PostprocessPlan("skip", f"audio is already AAC ({codec})")
+    return PostprocessPlan("reencode", f"audio is {codec}")
+
+
+def plan_aac_postprocessing(
+    selected_info: dict[str, Any], ffmpeg_path: str | None
+) -> PostprocessPlan:
+    """Plan AAC post-processing for info already processed with the final format.
+
+    The returned ydl_opts are merged into the download's YoutubeDL options so
+    any work happens inside yt-dlp's own postprocessor pass.
+    """
+    if not ffmpeg_path:
+        return PostprocessPlan("skip", "ffmpeg not found")
+    plan = _plan_aac(selected_info)
+    if plan.ydl_opts:
+        plan.ydl_opts["ffmpeg_location"] = ffmpeg_path
+    return plan
+
+
+def _plan_aac(selected_info: dict[str, Any]) -> PostprocessPlan:
+    requested = selected_info.get("requested_formats") or []
+    if len(requested) > 1:
+        audio_codecs = [
+            fmt.get("acodec") for fmt in requested if fmt.get("acodec") != "none"
+        ]
+        if audio_codecs and all(is_aac(codec) for codec in audio_codecs):
+            return PostprocessPlan("copy", "merged audio is already AAC")
+        if not audio_codecs or any(codec is None for codec in audio_codecs):
+            return PostprocessPlan("probe", "merged audio codec unknown")
+        return PostprocessPlan(
+            "reencode",
+            f"merged audio is {audio_codecs[0]}; encoding AAC in the merge pass",
+            {"postprocessor_args": {"merger+ffmpeg_o": list(AAC_ARGS)}},
+        )
+
+    codec = selected_info.get("acodec")
+    if codec == "none":
+        return PostprocessPlan("skip", "no audio stream")
+    if not codec:
+        return PostprocessPlan("probe", "audio codec unknown")
+    if is_aac(codec):
+        return PostprocessPlan("skip", f"audio is already AAC ({codec})")
+
+    if selected_info.get("ext") in AAC_CONTAINERS:
+        return PostprocessPlan(
+            "reencode",
+            f"audio is {codec}; encoding AAC in one stream-copy pass",
+            {
+                "postprocessors": [{"key": "FFmpegCopyStream"}],
+                "postprocessor_args": {"copystream+ffmpeg_o": list(AAC_ARGS)},
+            },
+        )
+    # e.g. webm can't hold AAC, so remux to mp4 and encode in the same pass.
+    return PostprocessPlan(
+        "reencode",
+        f"audio is {codec}; remuxing to mp4 with AAC in one pass",
+        {
+            "postprocessors": [{"key": "FFmpegVideoRemuxer", "preferedformat": "mp4"}],
+            "postprocessor_args": {"videoremuxer+ffmpeg_o": list(AAC_ARGS)},
+        },
+    )
@@ -0,0 +1,70 @@
+"""Coalesce yt-dlp progress callbacks into a few updates per second.
+
+yt-dlp calls its progress hooks for every block it receives: thousands of
+times per file on a fast link. Redrawing a Streamlit element or writing to
+the terminal on each of them costs more than the transfer itself. Wrapping
+the hook in a ProgressThrottle forwards at most max_per_second "downloading"
+updates per job. Callbacks in between are coalesced and only the latest is
+kept. Status changes ("finished", "error") always go through at once, and
+flush() delivers whatever is still pending when a download ends without one.
+"""
+
+import threading
+import time
+from typing import Any, Callable
+
+DEFAULT_UPDATES_PER_SECOND = 4.0
+
+
+class ProgressThrottle:
+    """Rate-limited wrapper around one job's progress hook."""
+
+    def __init__(
+        self,
+        hook: Callable[[dict[str, Any]], None],
+        max_per_second: float = DEFAULT_UPDATES_PER_SECOND,
+    ) -> None:
+        self.hook = hook
+        # 0 or less disables throttling.
+        self.interval = 1.0 / max_per_second if max_per_second > 0 else 0.0
+        self.received = 0
+        self.emitted = 0
+        self._pending: dict[str, Any] | None = None
+        self._last_emit = float("-inf")
+        # Segmented downloads report from several threads.
+        self._lock = threading.Lock()
+
+    def __call__(self, data: dict[str, Any]) -> None:
+        with self._lock:
+            self.received += 1
+            if data.get("status") != "downloading":
+                # Supersedes any pending update: it carries the final counts.
+                self._pending = None
+                self._emit(data)
+                return
+            now = time.monotonic()
+            if now - self._last_emit >= self.interval:
+                self._pending = None
+                self._last_emit = now
+                self._emit(data)
+            else:
+                self._pending = data
+
+    def flush(self) -> None:
+        """Deliver the latest coalesced update, if one is still pending."""
+        with self._lock:
+            if self._pending is not None:
+                data, self._pending = self._pending, None
+                self._last_emit = time.monotonic()
+                self._emit(data)
+
+    def _emit(self, data: dict[str, Any]) -> None:
+        # Called with self._lock held, so updates arrive in order.
+        self.emitted += 1
+        self.hook(data)
+
+    def __enter__(self) -> "ProgressThrottle":
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.flush()
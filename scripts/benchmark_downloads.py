@@ -0,0 +1,605 @@
+#!/usr/bin/env python3
+"""Offline benchmark of the download pipeline against a local media server.
+
+A throttled HTTP server on 127.0.0.1 serves synthetic media with Range
+support, and a stub extractor seeds the info cache with info dicts whose
+formats point at it, so no request ever leaves the machine. Each scenario
+runs its jobs through the same download_batch_item path the CLI uses (info
+cache, progress hooks, segmented downloads, yt-dlp merging and the ffmpeg
+transcodes) and reports MB/s, jobs/min and latency percentiles.
+
+    python scripts/benchmark_downloads.py --json baseline.json
+    python scripts/benchmark_downloads.py --compare baseline.json
+
+With --compare, the exit status is 1 if any scenario regressed by more than
+--tolerance, so the script can gate a deploy.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import youtube_downloader  # noqa: E402
+from info_cache import InfoCache  # noqa: E402
+from instrumentation import STAGES  # noqa: E402
+from speed_test import percentile  # noqa: E402
+from throughput import BandwidthEstimator  # noqa: E402
+from transcode_pipeline import run_transcode  # noqa: E402
+
+DEFAULT_JOBS = 8
+DEFAULT_WORKERS = 4
+DEFAULT_SIZE_MB = 8.0
+# Per-connection cap, so results don't depend on how fast loopback is.
+DEFAULT_RATE_MBPS = 100.0
+DEFAULT_LATENCY_MS = 20.0
+DEFAULT_TOLERANCE = 0.15
+MEDIA_DURATION_SECONDS = 30
+SEND_CHUNK_SIZE = 64 * 1024
+
+_RANGE_RE = re.compile(r"bytes=(\d*)-(\d*)$")
+_CONTENT_TYPES = {".mp4": "video/mp4", ".m4a": "audio/mp4"}
+
+
+class MediaServer(ThreadingHTTPServer):
+    """Serves in-memory files by path, throttled per connection."""
+
+    daemon_threads = True
+
+    def __init__(self, rate_mbps: float, latency_seconds: float) -> None:
+        super().__init__(("127.0.0.1", 0), _MediaHandler)
+        self.files: dict[str, bytes] = {}
+        self.rate_bytes = rate_mbps * 1e6 / 8 if rate_mbps > 0 else None
+        self.latency_seconds = latency_seconds
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def add(self, path: str, data: bytes) -> str:
+        self.files[path] = data
+        return self.base_url + path
+
+    def __enter__(self) -> "MediaServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+class _MediaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: MediaServer
+
+    def do_HEAD(self) -> None:
+        self._serve(send_body=False)
+
+    def do_GET(self) -> None:
+        self._serve(send_body=True)
+
+    def _serve(self, send_body: bool) -> None:
+        data = self.server.files.get(self.path.split("?", 1)[0])
+        if data is None:
+            self.send_error(404)
+            return
+        size = len(data)
+        start, end, status = 0, size - 1, 200
+        range_header = self.headers.get("Range")
+        if range_header:
+            match = _RANGE_RE.match(range_header.strip())
+            if not match or not (match.group(1) or match.group(2)):
+                self.send_error(416)
+                return
+            if match.group(1):
+                start = int(match.group(1))
+                if match.group(2):
+                    end = min(int(match.group(2)), size - 1)
+            else:
+                start = max(size - int(match.group(2)), 0)
+            if start > end:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            status = 206
+
+        self.send_response(status)
+        extension = os.path.splitext(self.path.split("?", 1)[0])[1]
+        self.send_header(
+            "Content-Type", _CONTENT_TYPES.get(extension, "application/octet-stream")
+        )
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", f'"{size:x}-{hash(self.path) & 0xFFFFFFFF:x}"')
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+        if not send_body:
+            return
+
+        time.sleep(self.server.latency_seconds)
+        began = time.perf_counter()
+        sent = 0
+        try:
+            for offset in range(start, end + 1, SEND_CHUNK_SIZE):
+                chunk = data[offset : min(offset + SEND_CHUNK_SIZE, end + 1)]
+                self.wfile.write(chunk)
+                sent += len(chunk)
+                if self.server.rate_bytes:
+                    ahead = sent / self.server.rate_bytes - (
+                        time.perf_counter() - began
+                    )
+                    if ahead > 0:
+                        time.sleep(ahead)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+@dataclass
+class SyntheticMedia:
+    combined: bytes
+    video: bytes
+    audio: bytes
+    playable: bool
+
+
+def _ffmpeg_media(
+    ffmpeg_path: str, workdir: str, size_bytes: int
+) -> SyntheticMedia | None:
+    seconds = MEDIA_DURATION_SECONDS
+    video_kbps = max(int(size_bytes * 8 / seconds / 1000) - 128, 100)
+    video = ["-f", "lavfi", "-i", f"testsrc=size=1280x720:rate=25:duration={seconds}"]
+    audio = ["-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}"]
+    video_codec = ["-c:v", "mpeg4", "-b:v", f"{video_kbps}k"]
+    audio_codec = ["-c:a", "aac", "-b:a", "128k"]
+    outputs = {
+        "combined": (video + audio + video_codec + audio_codec, "combined.mp4"),
+        "video": (video + video_codec + ["-an"], "video.mp4"),
+        "audio": (audio + audio_codec + ["-vn"], "audio.m4a"),
+    }
+    media = {}
+    for name, (args, filename) in outputs.items():
+        path = os.path.join(workdir, filename)
+        completed = subprocess.run(
+            [ffmpeg_path, "-y", "-loglevel", "error", *args, path],
+            capture_output=True,
+            text=True,
+        )
+        if completed.returncode != 0:
+            return None
+        with open(path, "rb") as handle:
+            media[name] = handle.read()
+    return SyntheticMedia(media["combined"], media["video"], media["audio"], True)
+
+
+def make_media(size_bytes: int, workdir: str, seed: int = 0) -> SyntheticMedia:
+    """Real media when ffmpeg is available (needed to merge or transcode),
+    otherwise seeded random bytes of the requested size."""
+    ffmpeg_path = shutil.which("ffmpeg")
+    if ffmpeg_path:
+        media = _ffmpeg_media(ffmpeg_path, workdir, size_bytes)
+        if media:
+            return media
+    rng = random.Random(seed)
+    audio_bytes = max(size_bytes // 16, 64 * 1024)
+    return SyntheticMedia(
+        rng.randbytes(size_bytes),
+        rng.randbytes(size_bytes - audio_bytes),
+        rng.randbytes(audio_bytes),
+        False,
+    )
+
+
+def stub_info(server: MediaServer, video_id: str) -> dict[str, Any]:
+    """What an extractor would return for video_id: one combined format
+    (18), one video-only (137) and one audio-only (140), all on server."""
+    files = server.files
+    duration = MEDIA_DURATION_SECONDS
+    page_url = f"{server.base_url}/watch/{video_id}"
+
+    def fmt(format_id: str, path: str, ext: str, **fields: Any) -> dict[str, Any]:
+        size = len(files[path])
+        return {
+            "format_id": format_id,
+            "url": server.base_url + path,
+            "ext": ext,
+            "protocol": "http",
+            "filesize": size,
+            "tbr": size * 8 / duration / 1000,
+            **fields,
+        }
+
+    return {
+        "_type": "video",
+        "id": video_id,
+        "title": f"Benchmark {video_id}",
+        "duration": duration,
+        "webpage_url": page_url,
+        "original_url": page_url,
+        "webpage_url_basename": video_id,
+        "webpage_url_domain": "127.0.0.1",
+        "extractor": "generic",
+        "extractor_key": "Generic",
+        "formats": [
+            fmt(
+                "140",
+                "/media/audio.m4a",
+                "m4a",
+                vcodec="none",
+                acodec="mp4a.40.2",
+                abr=128,
+            ),
+            fmt(
+                "137",
+                "/media/video.mp4",
+                "mp4",
+                vcodec="mp4v",
+                acodec="none",
+                width=1280,
+                height=720,
+            ),
+            fmt(
+                "18",
+                "/media/combined.mp4",
+                "mp4",
+                vcodec="mp4v",
+                acodec="mp4a.40.2",
+                width=1280,
+                height=720,
+            ),
+        ],
+    }
+
+
+@dataclass
+class Scenario:
+    name: str
+    description: str
+    format_selector: str
+    download_type: str = "video"
+    connections: int = 1
+    transcode: str | None = None
+    # "stub": seeded info cache; "direct": plain file URLs, extracted by
+    # yt-dlp's generic extractor on every run with an empty cache.
+    source: str = "stub"
+    warm_cache: bool = False
+    needs_ffmpeg: bool = False
+
+
+SCENARIOS = [
+    Scenario("single", "combined format, one connection", "18"),
+    Scenario("segmented", "combined format, 4 range connections", "18", connections=4),
+    Scenario(
+        "merge",
+        "video-only + audio-only, merged by yt-dlp",
+        "137+140",
+        needs_ffmpeg=True,
+    ),
+    Scenario(
+        "mp3",
+        "audio-only download, then MP3 transcode",
+        "140",
+        download_type="audio",
+        transcode="mp3",
+        needs_ffmpeg=True,
+    ),
+    Scenario(
+        "direct-cold", "direct file URL, empty info cache", "best", source="direct"
+    ),
+    Scenario(
+        "direct-warm",
+        "direct file URL, info cache filled by a first pass",
+        "best",
+        source="direct",
+        warm_cache=True,
+    ),
+]
+
+
+@dataclass
+class ScenarioResult:
+    name: str
+    jobs: int
+    failures: int
+    seconds: float
+    bytes: int
+    mb_per_s: float
+    jobs_per_min: float
+    p50_seconds: float
+    p95_seconds: float
+    skipped: str | None = None
+
+
+def _job_urls(
+    server: MediaServer, scenario: Scenario, jobs: int, tag: str
+) -> list[str]:
+    urls = []
+    for index in range(jobs):
+        video_id = f"{tag}{index:03d}"
+        if scenario.source == "direct":
+            urls.append(
+                server.add(
+                    f"/direct/{video_id}.mp4", server.files["/media/combined.mp4"]
+                )
+            )
+        else:
+            urls.append(f"{server.base_url}/watch/{video_id}")
+            youtube_downloader.INFO_CACHE.put(urls[-1], stub_info(server, video_id))
+    return urls
+
+
+def _run_job(
+    index: int, url: str, scenario: Scenario, output_dir: str
+) -> tuple[float, int, str | None]:
+    """Return (seconds, output bytes, error) for one job."""
+    start = time.perf_counter()
+    result = youtube_downloader.download_batch_item(
+        index,
+        url,
+        format_selector=scenario.format_selector,
+        output_dir=output_dir,
+        retries=0,
+        connections=scenario.connections,
+        download_type=scenario.download_type,
+    )
+    if result.ok and scenario.transcode:
+        job = youtube_downloader.make_transcode_job(
+            result.file_path, scenario.transcode, keep_source=False
+        )
+        outcome = run_transcode(job)
+        if not outcome.ok:
+            return time.perf_counter() - start, 0, outcome.error
+        result.file_path = outcome.output_path
+    if not result.ok:
+        return time.perf_counter() - start, 0, result.error
+    return time.perf_counter() - start, os.path.getsize(result.file_path), None
+
+
+def run_scenario(
+    server: MediaServer,
+    scenario: Scenario,
+    workdir: str,
+    jobs: int,
+    workers: int,
+    log: Callable[[str], None],
+) -> ScenarioResult:
+    if scenario.needs_ffmpeg and not shutil.which("ffmpeg"):
+        return ScenarioResult(scenario.name, 0, 0, 0, 0, 0, 0, 0, 0, "needs ffmpeg")
+    # Fresh cache and output directory per scenario, so runs are independent.
+    youtube_downloader.INFO_CACHE = InfoCache(
+        os.path.join(workdir, scenario.name, "cache")
+    )
+    output_dir = os.path.join(workdir, scenario.name, "out")
+    urls = _job_urls(server, scenario, jobs, scenario.name.replace("-", "")[:6])
+
+    if scenario.warm_cache:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(
+                pool.map(
+                    lambda item: _run_job(item[0], item[1], scenario, output_dir),
+                    enumerate(urls, 1),
+                )
+            )
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+    os.makedirs(output_dir, exist_ok=True)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        outcomes = list(
+            pool.map(
+                lambda item: _run_job(item[0], item[1], scenario, output_dir),
+                enumerate(urls, 1),
+            )
+        )
+    seconds = time.perf_counter() - start
+    shutil.rmtree(os.path.join(workdir, scenario.name), ignore_errors=True)
+
+    for error in {error for _, _, error in outcomes if error}:
+        log(f"  {scenario.name}: {error}")
+    latencies = [elapsed for elapsed, _, error in outcomes if not error]
+    total_bytes = sum(size for _, size, _ in outcomes)
+    return ScenarioResult(
+        name=scenario.name,
+        jobs=len(outcomes),
+        failures=sum(1 for _, _, error in outcomes if error),
+        seconds=seconds,
+        bytes=total_bytes,
+        mb_per_s=total_bytes / (1024 * 1024) / seconds if seconds else 0,
+        jobs_per_min=len(latencies) * 60 / seconds if seconds else 0,
+        p50_seconds=percentile(latencies, 0.5),
+        p95_seconds=percentile(latencies, 0.95),
+    )
+
+
+def format_table(results: list[ScenarioResult]) -> str:
+    lines = [
+        f"{'scenario':<12} {'jobs':>5} {'fail':>5} {'MB/s':>8} "
+        f"{'jobs/min':>9} {'p50 s':>7} {'p95 s':>7}"
+    ]
+    for item in results:
+        if item.skipped:
+            lines.append(f"{item.name:<12} skipped ({item.skipped})")
+            continue
+        lines.append(
+            f"{item.name:<12} {item.jobs:>5} {item.failures:>5} "
+            f"{item.mb_per_s:>8.1f} {item.jobs_per_min:>9.1f} "
+            f"{item.p50_seconds:>7.2f} {item.p95_seconds:>7.2f}"
+        )
+    return "\n".join(lines)
+
+
+def find_regressions(
+    results: list[ScenarioResult], baseline: dict[str, Any], tolerance: float
+) -> list[str]:
+    """Scenarios slower than baseline by more than tolerance (a fraction)."""
+    previous = {item["name"]: item for item in baseline.get("results", [])}
+    regressions = []
+    for item in results:
+        base = previous.get(item.name)
+        if item.skipped or not base or base.get("skipped"):
+            continue
+        if item.failures > base["failures"]:
+            regressions.append(f"{item.name}: {item.failures} failed jobs")
+        for metric in ("mb_per_s", "jobs_per_min"):
+            if getattr(item, metric) < base[metric] * (1 - tolerance):
+                regressions.append(
+                    f"{item.name}: {metric} {getattr(item, metric):.1f} "
+                    f"vs baseline {base[metric]:.1f}"
+                )
+        if item.p95_seconds > base["p95_seconds"] * (1 + tolerance):
+            regressions.append(
+                f"{item.name}: p95 {item.p95_seconds:.2f}s "
+                f"vs baseline {base['p95_seconds']:.2f}s"
+            )
+    return regressions
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Benchmark the downloader against a local throttled media server."
+    )
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        choices=[scenario.name for scenario in SCENARIOS],
+        help="Scenario to run (repeatable; default: all)",
+    )
+    parser.add_argument(
+        "--jobs", type=int, default=DEFAULT_JOBS, help="Jobs per scenario"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=DEFAULT_WORKERS, help="Concurrent jobs"
+    )
+    parser.add_argument(
+        "--size-mb", type=float, default=DEFAULT_SIZE_MB, help="Size of each media file"
+    )
+    parser.add_argument(
+        "--rate-mbps",
+        type=float,
+        default=DEFAULT_RATE_MBPS,
+        help="Per-connection throttle (0 for unlimited)",
+    )
+    parser.add_argument(
+        "--latency-ms",
+        type=float,
+        default=DEFAULT_LATENCY_MS,
+        help="Delay before each response body",
+    )
+    parser.add_argument("--json", metavar="FILE", help="Write the results as JSON")
+    parser.add_argument(
+        "--compare",
+        metavar="FILE",
+        help="Fail if slower than this earlier --json output",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=DEFAULT_TOLERANCE,
+        help="Allowed slowdown against --compare, as a fraction",
+    )
+    parser.add_argument(
+        "--verbose", action="store_true", help="Show the downloader's own output"
+    )
+    return parser.parse_args(argv)
+
+
+def log_error(message: str) -> None:
+    # stdout is captured while scenarios run unless --verbose is given.
+    print(message, file=sys.stderr, flush=True)
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = parse_args(argv)
+    selected = [
+        scenario
+        for scenario in SCENARIOS
+        if not args.scenario or scenario.name in args.scenario
+    ]
+    results = []
+    with tempfile.TemporaryDirectory(prefix="ytdl-bench-") as workdir:
+        # Keep the benchmark's localhost speeds and stage timings out of the
+        # real bandwidth estimate and stage log.
+        youtube_downloader.BANDWIDTH = BandwidthEstimator(
+            os.path.join(workdir, "bandwidth.json")
+        )
+        STAGES.configure(os.path.join(workdir, "stages.jsonl"), "")
+        media = make_media(int(args.size_mb * 1024 * 1024), workdir)
+        with MediaServer(args.rate_mbps, args.latency_ms / 1000) as server:
+            server.add("/media/combined.mp4", media.combined)
+            server.add("/media/video.mp4", media.video)
+            server.add("/media/audio.m4a", media.audio)
+            print(
+                f"Serving {len(media.combined) / (1024 * 1024):.1f} MB media at "
+                f"{server.base_url}, {args.rate_mbps:g} Mbps per connection"
+                + ("" if media.playable else " (random bytes; ffmpeg not found)")
+            )
+            for scenario in selected:
+                print(f"Running {scenario.name}: {scenario.description}...", flush=True)
+                output = (
+                    contextlib.nullcontext()
+                    if args.verbose
+                    else contextlib.redirect_stdout(io.StringIO())
+                )
+                with output:
+                    result = run_scenario(
+                        server, scenario, workdir, args.jobs, args.workers, log_error
+                    )
+                results.append(result)
+    print()
+    print(format_table(results))
+    print()
+    for line in STAGES.summary_lines():
+        print(f"stage {line}")
+
+    report = {
+        "created_at": time.time(),
+        "settings": {
+            "jobs": args.jobs,
+            "workers": args.workers,
+            "size_mb": args.size_mb,
+            "rate_mbps": args.rate_mbps,
+            "latency_ms": args.latency_ms,
+        },
+        "results": [asdict(item) for item in results],
+    }
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as handle:
+            json.dump(report, handle, indent=2)
+        print(f"Results written to {args.json}")
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as handle:
+            baseline = json.load(handle)
+        regressions = find_regressions(results, baseline, args.tolerance)
+        if regressions:
+            print(f"Regressions against {args.compare}:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print(f"No regressions against {args.compare}.")
+    return 0 if all(not item.failures for item in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
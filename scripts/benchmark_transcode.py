@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""Benchmark segment-parallel transcoding against a single ffmpeg pass.
+
+A synthetic recording (tone plus noise, made with ffmpeg's lavfi sources) or
+a file given with --input is converted the way the CLI does it. That means
+MP3 for audio and the AAC re-encode for video, first in one ffmpeg process,
+then split into each --segments count. Every run reports its time, its
+speed-up over the single pass and how far the output's duration is from
+the source's. Segmented runs also say whether they passed the duration and
+packet checks or fell back to a single pass.
+
+    python scripts/benchmark_transcode.py --minutes 60 --segments 2 4 8
+    python scripts/benchmark_transcode.py --input talk.m4a --json results.json
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from instrumentation import STAGES  # noqa: E402
+from postprocess_planner import AAC_ARGS  # noqa: E402
+from segmented_transcode import ffprobe_for, probe_duration  # noqa: E402
+from transcode_pipeline import (  # noqa: E402
+    MP3_ARGS,
+    TranscodeJob,
+    aac_output_path,
+    build_aac_command,
+    build_mp3_command,
+    mp3_output_path,
+    run_transcode,
+)
+
+DEFAULT_MINUTES = 30.0
+DEFAULT_RUNS = 1
+
+
+@dataclass
+class TranscodeRun:
+    codec: str
+    segments: int
+    seconds: float
+    speedup: float
+    duration_error_ms: float
+    ok: bool
+    note: str = ""
+
+
+def make_source(ffmpeg_path: str, workdir: str, codec: str, minutes: float) -> str:
+    """Synthetic recording: M4A audio for mp3, MP4 with MP3 audio for aac."""
+    seconds = f"{minutes * 60:.0f}"
+    audio = [
+        "-f",
+        "lavfi",
+        "-i",
+        f"sine=frequency=440:sample_rate=44100:duration={seconds}",
+        "-f",
+        "lavfi",
+        "-i",
+        f"anoisesrc=sample_rate=44100:amplitude=0.05:duration={seconds}",
+    ]
+    mix = ["-filter_complex", "[0:a][1:a]amix=inputs=2,aformat=channel_layouts=stereo"]
+    if codec == "mp3":
+        path = os.path.join(workdir, "source.m4a")
+        command = [ffmpeg_path, "-y", "-v", "error", *audio, *mix, "-c:a", "aac"]
+    else:
+        # A small video stream; the AAC job copies it and re-encodes the MP3.
+        path = os.path.join(workdir, "source.mp4")
+        video = ["-f", "lavfi", "-i", f"testsrc=size=320x240:rate=5:duration={seconds}"]
+        command = [ffmpeg_path, "-y", "-v", "error", *audio, *video]
+        command += [*mix, "-map", "2:v", "-c:v", "libx264", "-preset", "ultrafast"]
+        command += ["-c:a", "libmp3lame"]
+    subprocess.run(command + [path], check=True)
+    return path
+
+
+def make_job(
+    ffmpeg_path: str, source_path: str, codec: str, segments: int
+) -> TranscodeJob:
+    if codec == "mp3":
+        output_path = mp3_output_path(source_path)
+        command = build_mp3_command(ffmpeg_path, source_path, output_path)
+        audio_args, keep_video = MP3_ARGS, False
+    else:
+        output_path = aac_output_path(source_path)
+        command = build_aac_command(ffmpeg_path, source_path, output_path)
+        audio_args, keep_video = AAC_ARGS, True
+    return TranscodeJob(
+        command,
+        source_path,
+        output_path,
+        segments=segments,
+        audio_args=audio_args,
+        keep_video=keep_video,
+    )
+
+
+def run_once(
+    ffmpeg_path: str, ffprobe_path: str, source_path: str, codec: str, segments: int
+) -> tuple[float, float, int, str]:
+    """Return (seconds, output duration, segments used, error)."""
+    job = make_job(ffmpeg_path, source_path, codec, segments)
+    start = time.perf_counter()
+    outcome = run_transcode(job)
+    seconds = time.perf_counter() - start
+    if not outcome.ok:
+        return seconds, 0.0, 0, outcome.error or "failed"
+    duration = probe_duration(ffprobe_path, outcome.output_path) or 0.0
+    os.remove(outcome.output_path)
+    return seconds, duration, outcome.segments, ""
+
+
+def format_table(runs: list[TranscodeRun]) -> str:
+    lines = [
+        f"{'codec':<6} {'segments':>8} {'seconds':>9} {'speed-up':>9} "
+        f"{'dur err ms':>10}  result"
+    ]
+    for run in runs:
+        result = "ok" if run.ok else "FAILED"
+        if run.note:
+            result += f" ({run.note})"
+        lines.append(
+            f"{run.codec:<6} {run.segments:>8} {run.seconds:>9.2f} "
+            f"{run.speedup:>8.2f}x {run.duration_error_ms:>10.1f}  {result}"
+        )
+    return "\n".join(lines)
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Compare segment-parallel transcoding with a single ffmpeg pass."
+    )
+    parser.add_argument(
+        "--codec",
+        choices=("mp3", "aac"),
+        default="mp3",
+        help="mp3: audio to MP3; aac: video's audio re-encoded to AAC",
+    )
+    parser.add_argument("--input", help="Source file (default: synthetic)")
+    parser.add_argument(
+        "--minutes",
+        type=float,
+        default=DEFAULT_MINUTES,
+        help="Length of the synthetic source",
+    )
+    parser.add_argument(
+        "--segments",
+        type=int,
+        nargs="+",
+        default=[os.cpu_count() or 2],
+        help="Segment counts to try (default: CPU count)",
+    )
+    parser.add_argument(
+        "--runs", type=int, default=DEFAULT_RUNS, help="Runs per setting (best kept)"
+    )
+    parser.add_argument("--json", metavar="FILE", help="Write the results as JSON")
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = parse_args(argv)
+    ffmpeg_path = shutil.which("ffmpeg")
+    ffprobe_path = ffprobe_for(ffmpeg_path) if ffmpeg_path else None
+    if not ffmpeg_path or not ffprobe_path:
+        print("ffmpeg and ffprobe are required for this benchmark.")
+        return 1
+    runs: list[TranscodeRun] = []
+    with tempfile.TemporaryDirectory(prefix="ytdl-transcode-") as workdir:
+        STAGES.configure(os.path.join(workdir, "stages.jsonl"), "")
+        if args.input:
+            source_path = os.path.join(workdir, os.path.basename(args.input))
+            shutil.copy(args.input, source_path)
+        else:
+            print(f"Generating a {args.minutes:g} minute source...", flush=True)
+            source_path = make_source(ffmpeg_path, workdir, args.codec, args.minutes)
+        source_duration = probe_duration(ffprobe_path, source_path) or 0.0
+        print(f"Source: {source_duration / 60:.1f} minutes")
+
+        baseline = 0.0
+        for segments in [1, *sorted(set(args.segments) - {1})]:
+            print(f"Encoding with {segments} segment(s)...", flush=True)
+            attempts = [
+                run_once(ffmpeg_path, ffprobe_path, source_path, args.codec, segments)
+                for _ in range(max(1, args.runs))
+            ]
+            seconds, duration, used, error = min(attempts)
+            baseline = baseline or seconds
+            note = error
+            if not error and segments > 1 and used < 2:
+                note = "fell back to one pass"
+            runs.append(
+                TranscodeRun(
+                    args.codec,
+                    segments,
+                    seconds,
+                    baseline / seconds if seconds else 0.0,
+                    (duration - source_duration) * 1000,
+                    not error,
+                    note,
+                )
+            )
+    print()
+    print(format_table(runs))
+    for line in STAGES.summary_lines():
+        if line.startswith("transcode_segments"):
+            print(f"stage {line}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as handle:
+            json.dump(
+                {
+                    "created_at": time.time(),
+                    "source_seconds": source_duration,
+                    "results": [asdict(run) for run in runs],
+                },
+                handle,
+                indent=2,
+            )
+        print(f"Results written to {args.json}")
+    return 0 if all(run.ok for run in runs) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
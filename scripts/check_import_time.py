@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""Fail when an entry point's import time exceeds its startup budget.
+
+Each module is imported in a fresh interpreter with `python -X importtime`,
+several times, and the median cumulative import time is compared with its
+budget. Modules that must stay deferred until first use (yt_dlp above all)
+are reported as failures if the import pulls them in anyway.
+
+    python scripts/check_import_time.py
+    python scripts/check_import_time.py --module youtube_downloader --verbose
+
+The Streamlit apps build their page when imported, so they can't be
+measured this way; they share the modules checked here.
+"""
+
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_RUNS = 5
+# Median cumulative import time allowed per module, in milliseconds.
+IMPORT_BUDGETS_MS = {
+    "youtube_downloader": 150.0,
+    "info_cache": 40.0,
+    "download_archive": 50.0,
+    "playlist_ingest": 40.0,
+    "segmented_download": 40.0,
+}
+# Imported on first use only; importing an entry point must not load these.
+DEFERRED_MODULES = ("yt_dlp", "streamlit", "asyncio", "urllib.request")
+TOP_IMPORTS_SHOWN = 10
+
+_LINE_RE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)")
+
+
+def measure_import(module: str) -> dict[str, int]:
+    """Import module in a new interpreter; cumulative microseconds by name."""
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=REPO_DIR,
+        capture_output=True,
+        text=True,
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(
+            f"import {module} failed: {completed.stderr.strip().splitlines()[-1:]}"
+        )
+    timings: dict[str, int] = {}
+    for line in completed.stderr.splitlines():
+        match = _LINE_RE.match(line)
+        if match:
+            timings[match.group(4)] = int(match.group(2))
+    return timings
+
+
+def check_module(module: str, budget_ms: float, runs: int, verbose: bool) -> list[str]:
+    """Return the problems found for module (empty if within budget)."""
+    samples = [measure_import(module) for _ in range(max(1, runs))]
+    totals = [sample.get(module, 0) / 1000 for sample in samples]
+    median_ms = statistics.median(totals)
+    print(
+        f"{module}: median {median_ms:.1f} ms over {len(totals)} runs "
+        f"(min {min(totals):.1f}, max {max(totals):.1f}, budget {budget_ms:.0f})"
+    )
+    problems = []
+    if median_ms > budget_ms:
+        problems.append(f"{module}: {median_ms:.1f} ms exceeds {budget_ms:.0f} ms")
+    loaded = [name for name in DEFERRED_MODULES if name in samples[-1]]
+    if loaded:
+        problems.append(f"{module}: imports {', '.join(loaded)} at startup")
+    if verbose or problems:
+        slowest = sorted(
+            (item for item in samples[-1].items() if item[0] != module),
+            key=lambda item: item[1],
+            reverse=True,
+        )
+        for name, micros in slowest[:TOP_IMPORTS_SHOWN]:
+            print(f"    {micros / 1000:8.1f} ms  {name}")
+    return problems
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Check entry-point import times against their budgets."
+    )
+    parser.add_argument(
+        "--module",
+        action="append",
+        choices=sorted(IMPORT_BUDGETS_MS),
+        help="Module to check (repeatable; default: all)",
+    )
+    parser.add_argument(
+        "--runs", type=int, default=DEFAULT_RUNS, help="Imports per module"
+    )
+    parser.add_argument(
+        "--budget-ms",
+        type=float,
+        help="Use this budget for every module instead of the defaults",
+    )
+    parser.add_argument(
+        "--verbose", action="store_true", help="Show the slowest imports"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = parse_args(argv)
+    problems = []
+    for module in args.module or sorted(IMPORT_BUDGETS_MS):
+        budget_ms = args.budget_ms or IMPORT_BUDGETS_MS[module]
+        problems += check_module(module, budget_ms, args.runs, args.verbose)
+    if problems:
+        print("Import time budget exceeded:")
+        for problem in problems:
+            print(f"  {problem}")
+        return 1
+    print("All imports within budget.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,296 @@
+"""Segmented multi-connection HTTP downloader with resume.
+
+A file is split into byte ranges fetched over parallel connections into one
+preallocated `.seg.part` file. Progress is persisted per segment in a
+`.segments.json` sidecar, so an interrupted job picks up where each segment
+stopped. On completion every segment's length and the total size are checked
+(against the size yt-dlp reported too, when known) before the file is moved
+into place.
+"""
+
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from typing import Any, Callable
+
+DEFAULT_CONNECTIONS = 4
+MIN_SEGMENT_BYTES = 1024 * 1024
+CHUNK_SIZE = 256 * 1024
+STATE_SAVE_INTERVAL = 1.0
+# Distinct from yt-dlp's own ".part" so a fallback never resumes our file.
+PART_SUFFIX = ".seg.part"
+STATE_SUFFIX = ".segments.json"
+
+_CONTENT_RANGE_RE = re.compile(r"bytes\s+(\d+)-(\d+)/(\d+|\*)")
+
+
+class SegmentedDownloadError(RuntimeError):
+    pass
+
+
+class RangeNotSupportedError(SegmentedDownloadError):
+    """The server ignores Range headers; use a single-stream download instead."""
+
+
+@dataclass
+class Segment:
+    index: int
+    start: int
+    end: int
+    downloaded: int = 0
+
+    @property
+    def length(self) -> int:
+        return self.end - self.start + 1
+
+    @property
+    def done(self) -> bool:
+        return self.downloaded >= self.length
+
+
+@dataclass
+class RemoteFile:
+    size: int | None
+    accepts_ranges: bool
+    validator: str | None
+
+
+def probe_remote(url: str, headers: dict[str, str] | None = None) -> RemoteFile:
+    """Ask for the first byte to learn the size and whether ranges work.
+
+    A one-byte GET is used instead of HEAD because some media hosts answer
+    HEAD differently from GET.
+    """
+    import urllib.request
+
+    request = urllib.request.Request(
+        url, headers={**(headers or {}), "Range": "bytes=0-0"}
+    )
+    with urllib.request.urlopen(request, timeout=20) as response:
+        validator = response.headers.get("ETag") or response.headers.get(
+            "Last-Modified"
+        )
+        match = _CONTENT_RANGE_RE.match(response.headers.get("Content-Range", ""))
+        if response.status == 206 and match and match.group(3) != "*":
+            return RemoteFile(int(match.group(3)), True, validator)
+        length = response.headers.get("Content-Length")
+        return RemoteFile(int(length) if length else None, False, validator)
+
+
+def plan_segments(size: int, connections: int) -> list[Segment]:
+    count = max(1, min(connections, size // MIN_SEGMENT_BYTES or 1))
+    step = -(-size // count)
+    return [
+        Segment(index, start, min(start + step, size) - 1)
+        for index, start in enumerate(range(0, size, step))
+    ]
+
+
+class SegmentedDownload:
+    """Download url to dest_path over up to `connections` range requests."""
+
+    def __init__(
+        self,
+        url: str,
+        dest_path: str,
+        connections: int = DEFAULT_CONNECTIONS,
+        headers: dict[str, str] | None = None,
+        progress_hook: Callable[[dict[str, Any]], None] | None = None,
+        expected_size: int | None = None,
+        throttle: Callable[[int], None] | None = None,
+    ) -> None:
+        self.url = url
+        self.throttle = throttle
+        self.expected_size = expected_size
+        self.dest_path = dest_path
+        self.connections = max(1, connections)
+        self.headers = dict(headers or {})
+        self.progress_hook = progress_hook
+        self.part_path = dest_path + PART_SUFFIX
+        self.state_path = dest_path + STATE_SUFFIX
+        self.segments: list[Segment] = []
+        self.size = 0
+        self._validator: str | None = None
+        self._lock = threading.Lock()
+        self._report_lock = threading.Lock()
+        self._last_save = 0.0
+
+    def run(self) -> str:
+        remote = probe_remote(self.url, self.headers)
+        if not remote.accepts_ranges or not remote.size:
+            raise RangeNotSupportedError("Server does not support range requests.")
+        if self.expected_size and self.expected_size != remote.size:
+            raise SegmentedDownloadError(
+                f"Server reports {remote.size} bytes, expected {self.expected_size}."
+            )
+        self.size = remote.size
+        self._validator = remote.validator
+
+        resumed = self._load_state(remote)
+        if not resumed:
+            self.segments = plan_segments(self.size, self.connections)
+            os.makedirs(os.path.dirname(os.path.abspath(self.dest_path)), exist_ok=True)
+            with open(self.part_path, "wb") as handle:
+                handle.truncate(self.size)
+            self._save_state(force=True)
+
+        pending = [segment for segment in self.segments if not segment.done]
+        with ThreadPoolExecutor(max_workers=len(pending) or 1) as executor:
+            for future in [executor.submit(self._fetch, seg) for seg in pending]:
+                future.result()
+        self._save_state(force=True)
+
+        self._verify()
+        os.replace(self.part_path, self.dest_path)
+        try:
+            os.remove(self.state_path)
+        except OSError:
+            pass
+        self._report("finished")
+        return self.dest_path
+
+    @property
+    def downloaded_bytes(self) -> int:
+        return sum(segment.downloaded for segment in self.segments)
+
+    def _fetch(self, segment: Segment) -> None:
+        import urllib.request
+
+        start = segment.start + segment.downloaded
+        headers = {**self.headers, "Range": f"bytes={start}-{segment.end}"}
+        request = urllib.request.Request(self.url, headers=headers)
+        with (
+            urllib.request.urlopen(request, timeout=30) as response,
+            open(self.part_path, "r+b") as handle,
+        ):
+            if response.status != 206:
+                raise RangeNotSupportedError(
+                    f"Segment {segment.index}: expected 206, got {response.status}."
+                )
+            handle.seek(start)
+            while not segment.done:
+                chunk = response.read(
+                    min(CHUNK_SIZE, segment.length - segment.downloaded)
+                )
+                if not chunk:
+                    break
+                handle.write(chunk)
+                # Flush before counting the bytes so saved state never runs
+                # ahead of what is actually in the file.
+                handle.flush()
+                with self._lock:
+                    segment.downloaded += len(chunk)
+                if self.throttle:
+                    # Outside the report lock, so only this segment waits.
+                    self.throttle(len(chunk))
+                self._report("downloading")
+                self._save_state()
+        if not segment.done:
+            raise SegmentedDownloadError(
+                f"Segment {segment.index} ended early at "
+                f"{segment.downloaded}/{segment.length} bytes."
+            )
+
+    def _verify(self) -> None:
+        for segment in self.segments:
+            if segment.downloaded != segment.length:
+                raise SegmentedDownloadError(
+                    f"Segment {segment.index} has {segment.downloaded} of "
+                    f"{segment.length} bytes."
+                )
+        covered = sum(segment.length for segment in self.segments)
+        actual = os.path.getsize(self.part_path)
+        if covered != self.size or actual != self.size:
+            raise SegmentedDownloadError(
+                f"Size mismatch: expected {self.size}, segments cover {covered}, "
+                f"file has {actual}."
+            )
+
+    def _load_state(self, remote: RemoteFile) -> bool:
+        """Reuse saved segments if they describe the same remote file."""
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as handle:
+                state = json.load(handle)
+            if state["size"] != remote.size or state["validator"] != remote.validator:
+                return False
+            if os.path.getsize(self.part_path) != remote.size:
+                return False
+            self.segments = [Segment(**item) for item in state["segments"]]
+        except (OSError, KeyError, TypeError, ValueError):
+            return False
+        return True
+
+    def _save_state(self, force: bool = False) -> None:
+        now = time.monotonic()
+        with self._lock:
+            if not force and now - self._last_save < STATE_SAVE_INTERVAL:
+                return
+            self._last_save = now
+            state = {
+                "size": self.size,
+                "validator": self._validator,
+                "segments": [asdict(segment) for segment in self.segments],
+            }
+            directory = os.path.dirname(os.path.abspath(self.state_path))
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as handle:
+                json.dump(state, handle)
+            os.replace(tmp_path, self.state_path)
+
+    def _report(self, status: str) -> None:
+        if not self.progress_hook:
+            return
+        # Serialized so hooks always see downloaded_bytes grow monotonically.
+        with self._report_lock:
+            self._call_hook(status)
+
+    def _call_hook(self, status: str) -> None:
+        self.progress_hook(
+            {
+                "status": status,
+                "downloaded_bytes": self.downloaded_bytes,
+                "total_bytes": self.size,
+                "filename": self.dest_path,
+                "info_dict": {"url": self.url},
+            }
+        )
+
+
+def download_selected_format(
+    ydl: Any,
+    selected_info: dict[str, Any],
+    connections: int,
+    progress_hook: Callable[[dict[str, Any]], None] | None = None,
+    throttle: Callable[[int], None] | None = None,
+) -> str | None:
+    """Fetch a single already-selected http(s) format with SegmentedDownload.
+
+    Returns the output path, or None when the format isn't a plain HTTP file
+    (merged formats, DASH/HLS) or the server ignores ranges, and the caller
+    should use yt-dlp instead. Other errors propagate so a retry can resume.
+    throttle, if given, is called with each chunk's size before reading more.
+    """
+    if selected_info.get("requested_formats"):
+        return None
+    if selected_info.get("protocol") not in ("http", "https"):
+        return None
+    if not selected_info.get("url"):
+        return None
+    dest_path = ydl.prepare_filename(selected_info)
+    try:
+        return SegmentedDownload(
+            selected_info["url"],
+            dest_path,
+            connections=connections,
+            headers=selected_info.get("http_headers"),
+            progress_hook=progress_hook,
+            expected_size=selected_info.get("filesize"),
+            throttle=throttle,
+        ).run()
+    except RangeNotSupportedError:
+        return None
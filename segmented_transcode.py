@@ -0,0 +1,433 @@
+"""Encode long audio as parallel segments and join them without re-encoding.
+
+libmp3lame and ffmpeg's AAC encoder use one core each, so a three-hour
+recording converts on a single core for minutes. Here the audio is split
+into a few spans, each encoded by its own ffmpeg process, and the encoded
+spans are joined by stream copy. That pass also copies the video back from
+the source when the job keeps it (the AAC re-encode).
+
+A naive split leaves a gap at every join: each encoder starts with its own
+priming samples and pads its last frame. So every span starts and ends on
+the frame grid of a single-pass encode, and its encoder is started
+PREROLL_FRAMES frames early and stopped as many frames late, reading the
+input cut to the exact sample with atrim. The noise bitstream filter then
+drops the pre- and post-roll packets, leaving exactly the frames a single
+pass would write for that span. MP3 spans are encoded without the bit
+reservoir, which would otherwise let a frame borrow bits from a dropped
+one. The spans are raw MP3 or ADTS streams that join byte for byte (the
+concat protocol); only the first span's priming is kept, and the join
+records it in the output (the LAME header, an MP4 edit list) so players
+skip it as they do for a single pass.
+
+The result is checked before it is used:
+
+- every span must hold exactly its frames
+- the output must hold exactly the packets and bytes of the spans (less
+  the ADTS headers, which a join into MP4 drops)
+- the output must have as many frames as a single pass would write for
+  the source's length (within one frame, as the container may round it)
+
+A failed check raises SegmentedTranscodeError, and the caller falls back
+to a single ffmpeg pass.
+"""
+
+import math
+import os
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+# Inputs shorter than this are encoded in one pass; splitting them costs
+# more in process start-up than it saves.
+MIN_SEGMENTED_SECONDS = 10 * 60
+MIN_SEGMENT_SECONDS = 2 * 60
+# Frames each encoder runs before and after its span so its output has
+# settled by the boundary (an AAC encoder needs more than the one frame of
+# MDCT overlap; 16 frames is about 0.4 s).
+PREROLL_FRAMES = 16
+PROBE_TIMEOUT_SECONDS = 120
+
+
+class SegmentedTranscodeError(RuntimeError):
+    """A segment failed or the joined output didn't match its segments."""
+
+
+@dataclass(frozen=True)
+class SegmentCodec:
+    """How one encoder's output is framed and written between passes."""
+
+    muxer: str
+    ext: str
+    frame_samples: int
+    # Samples of encoder delay ahead of the first input sample.
+    priming_samples: int
+    # Added to the job's encoder options for every span.
+    encoder_args: tuple[str, ...] = ()
+    # Muxer options for every span, and for the spans after the first.
+    muxer_args: tuple[str, ...] = ()
+    later_muxer_args: tuple[str, ...] = ()
+    # Sample rates the spans may be cut at; empty for any.
+    sample_rates: tuple[int, ...] = ()
+    # Framing bytes in each span packet that a join into another container
+    # drops.
+    header_bytes: int = 0
+
+
+SEGMENT_CODECS = {
+    # MPEG-1 layer III frames; libmp3lame only writes those at 32 kHz and
+    # up, so other rates run as a single pass. The first span keeps its
+    # Xing/LAME header, which carries the encoder delay into the join.
+    "libmp3lame": SegmentCodec(
+        "mp3",
+        "mp3",
+        1152,
+        1105,
+        encoder_args=("-reservoir", "0"),
+        muxer_args=("-id3v2_version", "0"),
+        later_muxer_args=("-write_xing", "0"),
+        sample_rates=(32000, 44100, 48000),
+    ),
+    # ffmpeg writes ADTS headers without a CRC, 7 bytes each.
+    "aac": SegmentCodec("adts", "aac", 1024, 1024, header_bytes=7),
+}
+
+
+@dataclass
+class AudioProbe:
+    packets: int
+    bytes: int
+
+
+@dataclass
+class Segment:
+    # The span's first frame, counted on the single-pass frame grid.
+    first_frame: int
+    # None for the last segment, which runs to the end of the input.
+    frames: int | None
+    path: str
+
+
+def ffprobe_for(ffmpeg_path: str) -> str | None:
+    """ffprobe next to ffmpeg_path, else the one on PATH."""
+    sibling = os.path.join(
+        os.path.dirname(ffmpeg_path),
+        os.path.basename(ffmpeg_path).replace("ffmpeg", "ffprobe"),
+    )
+    if os.path.dirname(ffmpeg_path) and os.path.isfile(sibling):
+        return sibling
+    return shutil.which("ffprobe")
+
+
+def probe_duration(ffprobe_path: str, path: str) -> float | None:
+    """Container duration in seconds, or None if ffprobe can't tell."""
+    try:
+        completed = subprocess.run(
+            [
+                ffprobe_path,
+                "-v",
+                "error",
+                "-show_entries",
+                "format=duration",
+                "-of",
+                "csv=p=0",
+                path,
+            ],
+            capture_output=True,
+            text=True,
+            timeout=PROBE_TIMEOUT_SECONDS,
+        )
+        return float(completed.stdout.strip())
+    except (OSError, subprocess.TimeoutExpired, ValueError):
+        return None
+
+
+def probe_sample_rate(ffprobe_path: str, path: str) -> int | None:
+    """Sample rate of the first audio stream, or None if there is none."""
+    try:
+        completed = subprocess.run(
+            [
+                ffprobe_path,
+                "-v",
+                "error",
+                "-select_streams",
+                "a:0",
+                "-show_entries",
+                "stream=sample_rate",
+                "-of",
+                "csv=p=0",
+                path,
+            ],
+            capture_output=True,
+            text=True,
+            timeout=PROBE_TIMEOUT_SECONDS,
+        )
+        return int(completed.stdout.strip())
+    except (OSError, subprocess.TimeoutExpired, ValueError):
+        return None
+
+
+def probe_audio_packets(ffprobe_path: str, path: str) -> AudioProbe:
+    """Packet count and packet bytes of the first audio stream."""
+    try:
+        completed = subprocess.run(
+            [
+                ffprobe_path,
+                "-v",
+                "error",
+                "-select_streams",
+                "a:0",
+                "-show_entries",
+                "packet=size",
+                "-of",
+                "csv=p=0",
+                path,
+            ],
+            capture_output=True,
+            text=True,
+            timeout=PROBE_TIMEOUT_SECONDS,
+        )
+    except (OSError, subprocess.TimeoutExpired) as exc:
+        raise SegmentedTranscodeError(f"ffprobe failed on {path}: {exc}") from exc
+    if completed.returncode != 0:
+        raise SegmentedTranscodeError(
+            f"ffprobe failed on {path}: {completed.stderr.strip()[-300:]}"
+        )
+    packets = 0
+    total = 0
+    for line in completed.stdout.splitlines():
+        # Packets with side data (e.g. the encoder's trailing padding) have
+        # further fields after the size; blank lines separate them.
+        size = line.split(",", 1)[0]
+        if size:
+            packets += 1
+            total += int(size)
+    return AudioProbe(packets, total)
+
+
+def audio_encoder(audio_args: list[str]) -> str | None:
+    """The encoder named in audio_args (-c:a, -acodec or -codec:a)."""
+    for option, value in zip(audio_args, audio_args[1:]):
+        if option in ("-c:a", "-acodec", "-codec:a"):
+            return value
+    return None
+
+
+def plan_segments(
+    duration: float,
+    sample_rate: int,
+    frame_samples: int,
+    segments: int,
+    workdir: str,
+    ext: str,
+) -> list[Segment]:
+    """Spans of whole frames for up to segments workers.
+
+    Empty if the input isn't worth splitting.
+    """
+    if duration < MIN_SEGMENTED_SECONDS:
+        return []
+    count = min(segments, int(duration // MIN_SEGMENT_SECONDS))
+    if count < 2:
+        return []
+    frames = duration * sample_rate / frame_samples
+    starts = [round(index * frames / count) for index in range(count)]
+    return [
+        Segment(
+            first,
+            following - first if following is not None else None,
+            os.path.join(workdir, f"segment{index:03d}.{ext}"),
+        )
+        for index, (first, following) in enumerate(zip(starts, [*starts[1:], None]))
+    ]
+
+
+def build_segment_command(
+    ffmpeg_path: str,
+    source_path: str,
+    segment: Segment,
+    audio_args: list[str],
+    codec: SegmentCodec,
+    sample_rate: int,
+) -> list[str]:
+    """Encode segment's frames, with pre- and post-roll, and keep only them."""
+    preroll = min(PREROLL_FRAMES, segment.first_frame)
+    start = (segment.first_frame - preroll) * codec.frame_samples
+    # Seek to a whole second before the span (exact in any time base), then
+    # cut to the sample with atrim.
+    seek = max(start // sample_rate - 1, 0)
+    trim = f"atrim=start_sample={start - seek * sample_rate}"
+    drop = f"lt(n\\,{preroll})"
+    if segment.frames is not None:
+        end = (segment.first_frame + segment.frames + PREROLL_FRAMES) * (
+            codec.frame_samples
+        )
+        trim += f":end_sample={end - seek * sample_rate}"
+        drop += f"+gte(n\\,{preroll + segment.frames})"
+    command = [ffmpeg_path, "-y", "-v", "error"]
+    if seek:
+        command += ["-ss", str(seek)]
+    command += [
+        "-i",
+        source_path,
+        "-map",
+        "0:a:0",
+        "-af",
+        f"{trim},asetpts=PTS-STARTPTS",
+        *audio_args,
+        *codec.encoder_args,
+        "-ar",
+        str(sample_rate),
+        "-bsf:a",
+        f"noise=drop={drop}",
+        "-f",
+        codec.muxer,
+        *codec.muxer_args,
+    ]
+    if segment.first_frame:
+        command += codec.later_muxer_args
+    return command + [segment.path]
+
+
+def build_join_command(
+    ffmpeg_path: str,
+    segment_names: list[str],
+    output_path: str,
+    codec: SegmentCodec,
+    sample_rate: int,
+    source_path: str,
+    keep_video: bool = False,
+) -> list[str]:
+    """Concatenate the segments byte for byte and remux them by stream copy.
+
+    segment_names are relative to the working directory the command runs in
+    (the concat protocol splits its list on "|"). The tags come from
+    source_path, as in a single pass, and so does the video with keep_video.
+    """
+    command = [ffmpeg_path, "-y", "-v", "error"]
+    if codec.muxer == "adts":
+        # ADTS has no room for the encoder delay; shift the stream back by
+        # it so the MP4 edit list hides the priming again.
+        command += ["-itsoffset", f"-{codec.priming_samples / sample_rate:.9f}"]
+    command += ["-i", "concat:" + "|".join(segment_names), "-i", source_path]
+    if keep_video:
+        command += ["-map", "1:v?"]
+    return command + ["-map", "0:a", "-map_metadata", "1", "-c", "copy", output_path]
+
+
+def _run(command: list[str], timeout: float | None, cwd: str | None = None) -> None:
+    try:
+        completed = subprocess.run(
+            command, capture_output=True, text=True, timeout=timeout, cwd=cwd
+        )
+    except subprocess.TimeoutExpired as exc:
+        raise SegmentedTranscodeError(f"ffmpeg timed out after {timeout:.0f}s") from exc
+    except OSError as exc:
+        raise SegmentedTranscodeError(str(exc)) from exc
+    if completed.returncode != 0:
+        raise SegmentedTranscodeError(
+            completed.stderr.strip()[-500:] or "(no stderr output)"
+        )
+
+
+def transcode_in_segments(
+    ffmpeg_path: str,
+    source_path: str,
+    output_path: str,
+    audio_args: list[str],
+    segments: int,
+    keep_video: bool = False,
+    timeout: float | None = None,
+) -> int:
+    """Encode source_path's audio with audio_args in parallel segments.
+
+    Returns the number of segments written to output_path. Returns 0 when the
+    input is too short to split, its length or sample rate is unknown, or
+    the encoder isn't one in SEGMENT_CODECS, leaving the encode to the
+    caller. Raises SegmentedTranscodeError on failure, leaving output_path
+    untouched. timeout, if set, applies to each ffmpeg run.
+    """
+    ffprobe_path = ffprobe_for(ffmpeg_path)
+    codec = SEGMENT_CODECS.get(audio_encoder(audio_args) or "")
+    if not ffprobe_path or not codec or segments < 2:
+        return 0
+    duration = probe_duration(ffprobe_path, source_path)
+    sample_rate = probe_sample_rate(ffprobe_path, source_path)
+    if not duration or not sample_rate:
+        return 0
+    if codec.sample_rates and sample_rate not in codec.sample_rates:
+        return 0
+    source_path = os.path.abspath(source_path)
+    output_dir = os.path.dirname(os.path.abspath(output_path))
+    workdir = tempfile.mkdtemp(prefix=".segments-", dir=output_dir)
+    try:
+        plan = plan_segments(
+            duration, sample_rate, codec.frame_samples, segments, workdir, codec.ext
+        )
+        if not plan:
+            return 0
+        with ThreadPoolExecutor(max_workers=len(plan)) as pool:
+            # Each worker just waits on its own ffmpeg process.
+            runs = [
+                pool.submit(
+                    _run,
+                    build_segment_command(
+                        ffmpeg_path, source_path, seg, audio_args, codec, sample_rate
+                    ),
+                    timeout,
+                )
+                for seg in plan
+            ]
+            for run in runs:
+                run.result()
+
+        probes = [probe_audio_packets(ffprobe_path, seg.path) for seg in plan]
+        for seg, probe in zip(plan, probes):
+            if seg.frames is not None and probe.packets != seg.frames:
+                raise SegmentedTranscodeError(
+                    f"segment at frame {seg.first_frame} has {probe.packets} "
+                    f"frames, expected {seg.frames}"
+                )
+
+        # Join into the work directory first so a bad result never replaces
+        # anything.
+        joined_path = os.path.join(workdir, "joined" + os.path.splitext(output_path)[1])
+        _run(
+            build_join_command(
+                ffmpeg_path,
+                [os.path.basename(seg.path) for seg in plan],
+                joined_path,
+                codec,
+                sample_rate,
+                source_path,
+                keep_video,
+            ),
+            timeout,
+            cwd=workdir,
+        )
+
+        joined = probe_audio_packets(ffprobe_path, joined_path)
+        packets = sum(probe.packets for probe in probes)
+        total = sum(probe.bytes for probe in probes)
+        if os.path.splitext(output_path)[1].lower() != "." + codec.ext:
+            total -= packets * codec.header_bytes
+        if (joined.packets, joined.bytes) != (packets, total):
+            raise SegmentedTranscodeError(
+                f"joined audio has {joined.packets} packets / {joined.bytes} bytes, "
+                f"segments have {packets} / {total}"
+            )
+        # A single pass writes ceil((samples + priming) / frame) frames.
+        source_samples = round(duration * sample_rate)
+        expected = math.ceil(
+            (source_samples + codec.priming_samples) / codec.frame_samples
+        )
+        if abs(packets - expected) > 1:
+            raise SegmentedTranscodeError(
+                f"joined audio has {packets} frames, a single pass would "
+                f"write {expected}"
+            )
+        os.replace(joined_path, output_path)
+        return len(plan)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
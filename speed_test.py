@@ -0,0 +1,225 @@
+"""Multi-stream download speed test with a persisted, smoothed history.
+
+One TCP stream underestimates a fast link and a single sample is noisy, so the
+test opens several parallel streams for a fixed time budget, samples the
+combined throughput at short intervals and reports percentiles. Every run is
+appended to a JSON history file (under a lock, written atomically) and time
+estimates use an EWMA over recent runs instead of the last one.
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+from dataclasses import asdict, dataclass
+
+DEFAULT_SPEED_TEST_URL = "http://ipv4.download.thinkbroadband.com/10MB.zip"
+DEFAULT_STREAMS = 4
+DEFAULT_DURATION_SECONDS = 5.0
+SAMPLE_INTERVAL_SECONDS = 0.25
+SPEED_HISTORY_PATH = os.path.join("downloads", ".speed_history.json")
+HISTORY_MAX_SAMPLES = 200
+SMOOTHING_ALPHA = 0.3
+SMOOTHING_WINDOW = 20
+LOCK_TIMEOUT_SECONDS = 10.0
+# A lock file older than this is assumed to belong to a crashed process.
+LOCK_STALE_SECONDS = 60.0
+
+
+@dataclass
+class SpeedTestResult:
+    mbps: float
+    median_mbps: float
+    p10_mbps: float
+    p90_mbps: float
+    streams: int
+    seconds: float
+    bytes: int
+    timestamp: float
+    source: str = "speed_test"
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    """Linear-interpolated percentile; fraction is in [0, 1]."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    position = fraction * (len(ordered) - 1)
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def run_speed_test(
+    test_url: str = DEFAULT_SPEED_TEST_URL,
+    streams: int = DEFAULT_STREAMS,
+    duration: float = DEFAULT_DURATION_SECONDS,
+) -> SpeedTestResult:
+    """Download test_url over `streams` parallel connections for `duration` s.
+
+    Each stream reopens the URL when it reaches the end, so small test files
+    still fill the time budget. The first sampling interval is dropped to
+    leave out TCP slow start.
+    """
+    import urllib.request
+
+    streams = max(1, streams)
+    lock = threading.Lock()
+    total = 0
+    errors: list[Exception] = []
+    stop = threading.Event()
+
+    def reader() -> None:
+        nonlocal total
+        try:
+            while not stop.is_set():
+                with urllib.request.urlopen(test_url, timeout=20) as response:
+                    while not stop.is_set():
+                        chunk = response.read(256 * 1024)
+                        if not chunk:
+                            break
+                        with lock:
+                            total += len(chunk)
+        except Exception as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=reader, daemon=True) for _ in range(streams)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+
+    samples: list[float] = []
+    last_bytes = 0
+    last_time = start
+    while time.perf_counter() - start < duration:
+        time.sleep(SAMPLE_INTERVAL_SECONDS)
+        now = time.perf_counter()
+        with lock:
+            current = total
+        if now > last_time:
+            samples.append((current - last_bytes) * 8 / ((now - last_time) * 1e6))
+        last_bytes, last_time = current, now
+        if len(errors) == streams:
+            break
+    stop.set()
+    elapsed = time.perf_counter() - start
+
+    if total <= 0 or elapsed <= 0:
+        reason = f": {errors[0]}" if errors else "."
+        raise RuntimeError(f"Speed test failed{reason}")
+    samples = samples[1:] or samples
+    return SpeedTestResult(
+        mbps=total * 8 / (elapsed * 1e6),
+        median_mbps=percentile(samples, 0.5),
+        p10_mbps=percentile(samples, 0.1),
+        p90_mbps=percentile(samples, 0.9),
+        streams=streams,
+        seconds=elapsed,
+        bytes=total,
+        timestamp=time.time(),
+    )
+
+
+class FileLock:
+    """Cross-process lock built on an O_EXCL lock file (works on Windows too)."""
+
+    def __init__(self, path: str, timeout: float = LOCK_TIMEOUT_SECONDS) -> None:
+        self.lock_path = path + ".lock"
+        self.timeout = timeout
+
+    def __enter__(self) -> "FileLock":
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                fd = os.open(self.lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                os.write(fd, str(os.getpid()).encode("ascii"))
+                os.close(fd)
+                return self
+            except FileExistsError:
+                try:
+                    if (
+                        time.time() - os.path.getmtime(self.lock_path)
+                        > LOCK_STALE_SECONDS
+                    ):
+                        os.remove(self.lock_path)
+                        continue
+                except OSError:
+                    continue
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"Could not lock {self.lock_path}")
+                time.sleep(0.05)
+
+    def __exit__(self, *exc_info: object) -> None:
+        try:
+            os.remove(self.lock_path)
+        except OSError:
+            pass
+
+
+def atomic_write_json(path: str, data: object) -> None:
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as handle:
+            json.dump(data, handle)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class SpeedHistory:
+    """Timestamped speed samples stored as a capped JSON list."""
+
+    def __init__(
+        self,
+        path: str = SPEED_HISTORY_PATH,
+        max_samples: int = HISTORY_MAX_SAMPLES,
+    ) -> None:
+        self.path = path
+        self.max_samples = max_samples
+
+    def load(self) -> list[dict]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as handle:
+                samples = json.load(handle)
+        except (OSError, ValueError):
+            return []
+        return samples if isinstance(samples, list) else []
+
+    def append(self, result: SpeedTestResult) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with FileLock(self.path):
+            samples = self.load()
+            samples.append(asdict(result))
+            atomic_write_json(self.path, samples[-self.max_samples :])
+
+    def smoothed_mbps(self) -> float | None:
+        """EWMA of the recent samples' medians, oldest first."""
+        samples = sorted(self.load(), key=lambda item: item.get("timestamp", 0))
+        estimate = None
+        for sample in samples[-SMOOTHING_WINDOW:]:
+            try:
+                value = float(sample.get("median_mbps") or sample.get("mbps"))
+            except (TypeError, ValueError):
+                continue
+            if value <= 0:
+                continue
+            if estimate is None:
+                estimate = value
+            else:
+                estimate = SMOOTHING_ALPHA * value + (1 - SMOOTHING_ALPHA) * estimate
+        return estimate
+
+
+def format_result(result: SpeedTestResult) -> str:
+    return (
+        f"{result.mbps:.1f} Mbps over {result.streams} streams "
+        f"(median {result.median_mbps:.1f}, p10 {result.p10_mbps:.1f}, "
+        f"p90 {result.p90_mbps:.1f})"
+    )
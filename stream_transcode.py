@@ -0,0 +1,171 @@
+"""Stream a download straight into ffmpeg, writing only the final MP3.
+
+The usual audio path saves the original file, reads it back into ffmpeg and
+then deletes it, so every byte hits the disk twice. Here the selected
+format's bytes are piped into ffmpeg's stdin as they arrive, so encoding
+overlaps with the transfer and only the MP3 is written. That needs a single
+plain HTTP format (no merge, DASH or HLS) in a container ffmpeg can read
+without seeking: WebM/Opus and YouTube's fragmented M4A both work. When
+ffmpeg or the transfer fails anyway, the caller falls back to
+download-then-convert.
+"""
+
+import http.client
+import os
+import subprocess
+import threading
+from collections import deque
+from typing import Any, Callable
+
+from transcode_pipeline import build_mp3_command, mp3_output_path, partial_output_path
+
+STREAM_CHUNK_SIZE = 256 * 1024
+STREAM_TIMEOUT_SECONDS = 30
+# Lines of ffmpeg's stderr kept for the error message.
+STDERR_TAIL_LINES = 20
+
+
+class StreamTranscodeError(RuntimeError):
+    """The stream or ffmpeg failed part way; nothing was left on disk."""
+
+
+def is_mp3(path: str) -> bool:
+    """True for a path that is already an MP3 (e.g. one streamed here)."""
+    return os.path.splitext(path)[1].lower() == ".mp3"
+
+
+def stream_to_mp3(
+    url: str,
+    mp3_path: str,
+    ffmpeg_path: str,
+    headers: dict[str, str] | None = None,
+    total_bytes: int | None = None,
+    progress_hook: Callable[[dict[str, Any]], None] | None = None,
+    throttle: Callable[[int], None] | None = None,
+) -> str:
+    """Pipe url into ffmpeg and return mp3_path.
+
+    progress_hook gets yt-dlp style progress dicts; throttle is called with
+    each chunk's size before the next read. An exception from either (e.g.
+    a cancel hook) kills ffmpeg, removes the partial MP3 and propagates.
+    Network and pipe errors, like ffmpeg failures, raise
+    StreamTranscodeError so the caller can fall back.
+    """
+    import urllib.request
+
+    part_path = partial_output_path(mp3_path)
+    os.makedirs(os.path.dirname(os.path.abspath(mp3_path)), exist_ok=True)
+    command = build_mp3_command(ffmpeg_path, "pipe:0", part_path)
+    command[1:1] = ["-hide_banner", "-loglevel", "error"]
+    try:
+        process = subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+        )
+    except OSError as exc:
+        raise StreamTranscodeError(f"Could not start ffmpeg: {exc}") from exc
+    stderr_tail: deque[str] = deque(maxlen=STDERR_TAIL_LINES)
+
+    def drain_stderr() -> None:
+        # Read continuously so ffmpeg never blocks on a full stderr pipe.
+        for line in iter(process.stderr.readline, b""):
+            stderr_tail.append(line.decode("utf-8", "replace").rstrip())
+
+    reader = threading.Thread(target=drain_stderr, daemon=True)
+    reader.start()
+
+    def report(status: str, downloaded: int) -> None:
+        if progress_hook:
+            progress_hook(
+                {
+                    "status": status,
+                    "downloaded_bytes": downloaded,
+                    "total_bytes": total_bytes,
+                    "filename": mp3_path,
+                    "info_dict": {"url": url},
+                }
+            )
+
+    downloaded = 0
+    ok = False
+    try:
+        request = urllib.request.Request(url, headers=dict(headers or {}))
+        try:
+            with urllib.request.urlopen(
+                request, timeout=STREAM_TIMEOUT_SECONDS
+            ) as response:
+                total_bytes = total_bytes or int(
+                    response.headers.get("Content-Length") or 0
+                )
+                while True:
+                    chunk = response.read(STREAM_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    try:
+                        process.stdin.write(chunk)
+                    except BrokenPipeError:
+                        # ffmpeg gave up on the input; its stderr says why.
+                        break
+                    downloaded += len(chunk)
+                    if throttle:
+                        throttle(len(chunk))
+                    report("downloading", downloaded)
+        except (OSError, http.client.HTTPException) as exc:
+            # URLError, socket timeouts, truncated bodies, a failed write.
+            raise StreamTranscodeError(
+                f"Streaming stopped after {downloaded} bytes: {exc}"
+            ) from exc
+        try:
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+        returncode = process.wait()
+        reader.join()
+        if returncode != 0:
+            message = "\n".join(stderr_tail) or f"ffmpeg exited with {returncode}"
+            raise StreamTranscodeError(message)
+        os.replace(part_path, mp3_path)
+        ok = True
+    finally:
+        if not ok:
+            if process.poll() is None:
+                process.kill()
+            process.wait()
+            try:
+                os.remove(part_path)
+            except OSError:
+                pass
+    report("finished", downloaded)
+    return mp3_path
+
+
+def stream_selected_to_mp3(
+    ydl: Any,
+    selected_info: dict[str, Any],
+    ffmpeg_path: str,
+    progress_hook: Callable[[dict[str, Any]], None] | None = None,
+    throttle: Callable[[int], None] | None = None,
+) -> str | None:
+    """Stream an already-selected audio format to MP3 next to its usual path.
+
+    Returns None when the format can't be streamed (merged formats, DASH/HLS)
+    and the caller should download it normally.
+    """
+    if selected_info.get("requested_formats"):
+        return None
+    if selected_info.get("protocol") not in ("http", "https"):
+        return None
+    if not selected_info.get("url"):
+        return None
+    mp3_path = mp3_output_path(ydl.prepare_filename(selected_info))
+    return stream_to_mp3(
+        selected_info["url"],
+        mp3_path,
+        ffmpeg_path,
+        headers=selected_info.get("http_headers"),
+        total_bytes=selected_info.get("filesize"),
+        progress_hook=progress_hook,
+        throttle=throttle,
+    )
@@ -1,24 +1,147 @@
-import json
+import functools
 import os
 import shutil
-import subprocess
-import time
-import urllib.request
+from concurrent.futures import Future
+from dataclasses import dataclass
 from typing import Any, Callable
 
 import streamlit as st
-from yt_dlp import YoutubeDL
+
+from bandwidth_scheduler import PRIORITY_INTERACTIVE, SCHEDULER
+from download_archive import (
+    EVICT_LRU,
+    EVICTION_POLICIES,
+    DownloadArchive,
+    archive_kind,
+)
+from file_server import FileServer, shared_file_server
+from format_selector import describe_plan, select_format
+from info_cache import DEFAULT_TTL_SECONDS, InfoCache, cache_key, extract_info_cached
+from instrumentation import STAGES, StageHooks
+from job_queue import (
+    JOB_QUEUED,
+    JobQueue,
+    ProgressReport,
+    QueuedJob,
+    coalesce_key,
+)
+from postprocess_planner import (
+    PostprocessPlan,
+    plan_aac_postprocessing,
+    plan_from_probe,
+    probe_media,
+)
+from progress_reporter import ProgressThrottle
+from segmented_download import download_selected_format
+from segmented_transcode import ffprobe_for
+from speed_test import (
+    DEFAULT_SPEED_TEST_URL,
+    DEFAULT_STREAMS,
+    SpeedHistory,
+    SpeedTestResult,
+    format_result,
+    run_speed_test,
+)
+from stream_transcode import StreamTranscodeError, is_mp3, stream_selected_to_mp3
+from throughput import BandwidthEstimator, ThroughputMonitor, format_eta
+from transcode_pipeline import (
+    TranscodeJob,
+    TranscodePipeline,
+    TranscodeResult,
+    aac_output_path,
+    build_aac_command,
+    build_mp3_command,
+    mp3_output_path,
+)
+from ydl_pool import YoutubeDLPool
 
 DOWNLOAD_DIR = "downloads"
-DEFAULT_SPEED_TEST_URL = "http://ipv4.download.thinkbroadband.com/10MB.zip"
-MAX_TEST_BYTES = 5 * 1024 * 1024
-SPEED_CACHE_PATH = os.path.join(DOWNLOAD_DIR, ".speed_cache.json")
+# How long the smoothed speed is trusted before the history is re-read, so
+# results saved by the CLI show up without restarting the app.
+SPEED_CACHE_TTL_SECONDS = 300
+# How often a session re-reads its queued job's progress.
+JOB_POLL_SECONDS = 0.5
+# Progress updates a download publishes per second; polling twice a second
+# would never show more.
+PROGRESS_UPDATES_PER_SECOND = 2.0
+# Request fields that change how a file is fetched but not the file itself,
+# so requests differing only in these share one job.
+JOB_TRANSPORT_FIELDS = ("connections", "stream_mp3")
+
+
+# Long-lived resources: resolved once per server process and shared by every
+# session and rerun. Cleared by the "Clear cached data" button.
+@st.cache_resource(show_spinner=False)
+def get_info_cache() -> InfoCache:
+    return InfoCache()
+
+
+@st.cache_resource(show_spinner=False)
+def get_ydl_pool() -> YoutubeDLPool:
+    # Warm YoutubeDL instances, shared by everyone using the server.
+    return YoutubeDLPool()
+
+
+@st.cache_resource(show_spinner=False)
+def get_download_archive() -> DownloadArchive:
+    return DownloadArchive()
+
+
+def archive_download(
+    archive: DownloadArchive,
+    url: str,
+    kind: str,
+    format_id: str,
+    path: str,
+    note: Callable[[str, str], None],
+) -> None:
+    try:
+        archive.record(url, kind, format_id, path)
+    except Exception as exc:
+        note("warning", f"Could not record the download in the archive: {exc}")
 
 
+def get_file_server() -> FileServer | None:
+    # Serves DOWNLOAD_DIR with sendfile and Range support, so finished files
+    # stream to the browser without passing through Streamlit. Not a cached
+    # resource: it must outlive "Clear cached data", or links already shown
+    # would break.
+    try:
+        return shared_file_server(DOWNLOAD_DIR)
+    except OSError:
+        return None
+
+
+def show_file_links(path: str) -> None:
+    """Play and save links for a finished file inside DOWNLOAD_DIR."""
+    server = get_file_server()
+    if server is None:
+        st.caption(
+            "File links unavailable: the file server could not bind its port "
+            "(YTDL_FILE_SERVER_PORT)."
+        )
+        return
+    play_url = server.url_for(path)
+    if not play_url or not os.path.isfile(path):
+        return
+    play_column, save_column = st.columns(2)
+    play_column.link_button("Open in browser", play_url)
+    save_column.link_button("Save file", server.url_for(path, download=True))
+
+
+@st.cache_resource(show_spinner=False)
+def get_transcode_pipeline() -> TranscodePipeline:
+    # One ffmpeg pool for the whole server, so concurrent sessions queue for
+    # the CPU instead of each starting its own encoder.
+    return TranscodePipeline()
+
+
+@st.cache_resource(show_spinner=False)
 def resolve_ffmpeg_path() -> str | None:
     return shutil.which("ffmpeg")
 
 
+@st.cache_resource(show_spinner=False)
 def resolve_js_runtime() -> str | None:
     for runtime in ("node", "deno"):
         runtime_path = shutil.which(runtime)
@@ -28,8 +151,9 @@ def resolve_js_runtime() -> str | None:
 
 
 def create_ytdlp_config(js_runtime_path: str | None) -> None:
+    # Not a cached resource: it checks the file on every download, so a
+    # deleted or edited config is written again.
     config_dir = os.path.expanduser("~/.config/yt-dlp")
-    os.makedirs(config_dir, exist_ok=True)
     config_file = os.path.join(config_dir, "config.txt")
 
     if js_runtime_path:
@@ -38,48 +162,43 @@ def create_ytdlp_config(js_runtime_path: str | None) -> None:
         config_content = ""
 
     try:
+        with open(config_file, "r", encoding="utf-8") as handle:
+            if handle.read() == config_content:
+                return
+    except OSError:
+        pass
+    try:
+        os.makedirs(config_dir, exist_ok=True)
         with open(config_file, "w", encoding="utf-8") as handle:
             handle.write(config_content)
     except OSError:
         pass
 
 
-def measure_download_speed(test_url: str, max_bytes: int) -> float:
-    start = time.perf_counter()
-    downloaded = 0
-    with urllib.request.urlopen(test_url, timeout=20) as response:
-        while downloaded < max_bytes:
-            chunk = response.read(min(256 * 1024, max_bytes - downloaded))
-            if not chunk:
-                break
-            downloaded += len(chunk)
-    elapsed = time.perf_counter() - start
-    if elapsed <= 0 or downloaded <= 0:
-        raise RuntimeError("Speed test failed.")
-    return (downloaded * 8) / (elapsed * 1_000_000)
+@st.cache_resource(show_spinner=False)
+def get_speed_history() -> SpeedHistory:
+    return SpeedHistory()
+
 
+@st.cache_resource(show_spinner=False)
+def get_bandwidth_estimator() -> BandwidthEstimator:
+    return BandwidthEstimator()
 
+
+@st.cache_data(ttl=SPEED_CACHE_TTL_SECONDS, show_spinner=False)
 def load_cached_speed() -> float | None:
-    if not os.path.exists(SPEED_CACHE_PATH):
-        return None
-    try:
-        with open(SPEED_CACHE_PATH, "r", encoding="utf-8") as handle:
-            data = json.load(handle)
-        speed = float(data.get("speed_mbps"))
-        if speed <= 0:
-            return None
-        return speed
-    except (OSError, ValueError, TypeError, json.JSONDecodeError):
-        return None
+    """Throughput measured from real downloads, else the speed-test history.
 
+    Cleared after each download and each speed test.
+    """
+    return (
+        get_bandwidth_estimator().estimate_mbps() or get_speed_history().smoothed_mbps()
+    )
 
-def save_cached_speed(speed_mbps: float) -> None:
-    os.makedirs(os.path.dirname(SPEED_CACHE_PATH), exist_ok=True)
-    try:
-        with open(SPEED_CACHE_PATH, "w", encoding="utf-8") as handle:
-            json.dump({"speed_mbps": speed_mbps}, handle)
-    except OSError:
-        pass
+
+def record_speed_test(result: SpeedTestResult) -> None:
+    get_speed_history().append(result)
+    load_cached_speed.clear()
 
 
 def extract_info_with_ytdlp_api(url: str) -> dict:
@@ -87,11 +206,13 @@ def extract_info_with_ytdlp_api(url: str) -> dict:
         "noplaylist": True,
         "quiet": True,
     }
-    try:
-        with YoutubeDL(ydl_opts) as ydl:
-            return ydl.extract_info(url, download=False)
-    except Exception:
-        return {}
+    with STAGES.stage("extract", url=url) as span:
+        try:
+            with get_ydl_pool().session(ydl_opts) as ydl:
+                return extract_info_cached(ydl, url, get_info_cache())
+        except Exception as exc:
+            span.fail(str(exc))
+            return {}
 
 
 def build_video_format_choices(info: dict) -> list[dict[str, Any]]:
@@ -145,45 +266,339 @@ def build_audio_format_choices(info: dict) -> list[dict[str, Any]]:
     return choices
 
 
+# The choice builders are pure, so their results are cached per video. The info
+# dict is passed unhashed (leading underscore) and info_key identifies it, which
+# keeps a cache hit from hashing the whole format list on every rerun.
+@st.cache_data(ttl=DEFAULT_TTL_SECONDS, max_entries=64, show_spinner=False)
+def cached_video_format_choices(info_key: str, _info: dict) -> list[dict[str, Any]]:
+    return build_video_format_choices(_info)
+
+
+@st.cache_data(ttl=DEFAULT_TTL_SECONDS, max_entries=64, show_spinner=False)
+def cached_audio_format_choices(info_key: str, _info: dict) -> list[dict[str, Any]]:
+    return build_audio_format_choices(_info)
+
+
+def clear_app_caches() -> None:
+    """Drop every cached value and resource, including on-disk video info."""
+    get_info_cache().clear()
+    get_ydl_pool().clear()
+    # The next queue picks up whatever this one leaves queued.
+    get_job_queue().shutdown()
+    st.cache_data.clear()
+    st.cache_resource.clear()
+
+
+def plan_aac_reencode(url: str, format_id: str) -> PostprocessPlan:
+    """Plan the AAC step from the formats format_id picks, using cached info."""
+    ydl_opts = {"format": format_id, "noplaylist": True, "quiet": True}
+    try:
+        with get_ydl_pool().session(ydl_opts) as ydl:
+            selected = extract_info_cached(ydl, url, get_info_cache())
+    except Exception:
+        return PostprocessPlan("probe", "could not resolve the selected formats")
+    return plan_aac_postprocessing(selected, resolve_ffmpeg_path())
+
+
+@dataclass(frozen=True)
+class JobResources:
+    """The shared resources a job queue worker uses.
+
+    Resolved on the script thread when the queue is created: cache_resource
+    getters need Streamlit's script context, which worker threads lack.
+    """
+
+    info_cache: InfoCache
+    ydl_pool: YoutubeDLPool
+    archive: DownloadArchive
+    transcode_pipeline: TranscodePipeline
+    bandwidth_estimator: BandwidthEstimator
+    ffmpeg_path: str | None
+
+
 def download_with_progress(
+    resources: JobResources,
     url: str,
     format_id: str,
     outtmpl: str,
-    log_callback: Callable[[str], None] | None = None,
+    report: ProgressReport,
+    note: Callable[[str, str], None],
+    extra_opts: dict[str, Any] | None = None,
+    connections: int = 1,
+    priority: str = PRIORITY_INTERACTIVE,
+    stream_mp3_ffmpeg: str | None = None,
 ) -> str:
-    status = st.empty()
-    progress = st.progress(0)
+    """Download url and return the file path.
+
+    Runs on a job queue worker, so progress goes to report and messages for
+    the user to note(level, text) rather than to Streamlit elements. With
+    stream_mp3_ffmpeg, a plain HTTP audio format is piped into ffmpeg and
+    the MP3 path is returned instead.
+    """
+    monitor = ThroughputMonitor(resources.bandwidth_estimator)
+    stage_hooks = StageHooks(url)
+    # Every session shares the server's bandwidth limits.
+    bandwidth_job = SCHEDULER.job(priority)
 
     def hook(data: dict[str, Any]) -> None:
         if data.get("status") == "downloading":
             total = data.get("total_bytes") or data.get("total_bytes_estimate")
-            downloaded = data.get("downloaded_bytes")
-            if total and downloaded:
-                progress.progress(min(int(downloaded / total * 100), 100))
-            status.write("Downloading...")
+            rate = f"{monitor.live_mbps:.1f} Mbps, " if monitor.live_mbps else ""
+            report(
+                f"Downloading... ({rate}{format_eta(monitor.eta_seconds)})",
+                data.get("downloaded_bytes") or 0,
+                total,
+            )
         elif data.get("status") == "finished":
-            progress.progress(100)
-            status.write("Download finished. Processing...")
-            if log_callback:
-                log_callback("Download finished. Processing...")
+            report("Download finished. Processing...", None, None)
 
+    throttled_hook = ProgressThrottle(hook, PROGRESS_UPDATES_PER_SECOND)
     ydl_opts = {
         "format": format_id,
         "outtmpl": outtmpl,
         "noplaylist": True,
         "quiet": True,
-        "progress_hooks": [hook],
+        "progress_hooks": [
+            monitor,
+            stage_hooks.progress_hook,
+            throttled_hook,
+            bandwidth_job.progress_hook,
+        ],
+        "postprocessor_hooks": [stage_hooks.postprocessor_hook],
     }
     # Only enable merge if format selector requests multiple formats
     if "+" in format_id:
         ydl_opts["merge_output_format"] = "mp4"
+    if connections > 1:
+        ydl_opts["concurrent_fragment_downloads"] = connections
+    if extra_opts:
+        ydl_opts.update(extra_opts)
 
-    with YoutubeDL(ydl_opts) as ydl:
-        result = ydl.extract_info(url, download=True)
-        file_path = ydl.prepare_filename(result)
+    pool = resources.ydl_pool
+    with bandwidth_job, throttled_hook, pool.session(ydl_opts) as ydl:
+        with STAGES.stage("extract", stage_hooks.job, url):
+            selected = extract_info_cached(ydl, url, resources.info_cache)
+
+        def forward_hook(data: dict[str, Any]) -> None:
+            # Bandwidth is charged per chunk by our own transfers.
+            for progress_hook in (monitor, stage_hooks.progress_hook, throttled_hook):
+                progress_hook(data)
+
+        if stream_mp3_ffmpeg and "postprocessors" not in ydl_opts:
+            try:
+                file_path = stream_selected_to_mp3(
+                    ydl,
+                    selected,
+                    stream_mp3_ffmpeg,
+                    forward_hook,
+                    bandwidth_job.consume,
+                )
+            except StreamTranscodeError as exc:
+                note("warning", f"Streaming to MP3 failed, downloading first: {exc}")
+                file_path = None
+            if file_path:
+                load_cached_speed.clear()
+                return file_path
+        if connections > 1 and "postprocessors" not in ydl_opts:
+            file_path = download_selected_format(
+                ydl, selected, connections, forward_hook, bandwidth_job.consume
+            )
+            if file_path:
+                load_cached_speed.clear()
+                return file_path
+        result = extract_info_cached(ydl, url, resources.info_cache, download=True)
+        # Postprocessors (e.g. a remux) may have changed the final path.
+        downloads = result.get("requested_downloads") or [{}]
+        file_path = downloads[-1].get("filepath") or ydl.prepare_filename(result)
+    load_cached_speed.clear()
     return file_path
 
 
+def after_transcode(
+    future: Future[TranscodeResult], finish: Callable[[TranscodeResult], dict]
+) -> Future[dict]:
+    """A future of finish(outcome), run once the transcode future resolves."""
+    chained: Future[dict] = Future()
+
+    def resolve(done: Future[TranscodeResult]) -> None:
+        try:
+            chained.set_result(finish(done.result()))
+        except Exception as exc:
+            chained.set_exception(exc)
+
+    future.add_done_callback(resolve)
+    return chained
+
+
+def run_download_job(
+    resources: JobResources, payload: dict[str, Any], report: ProgressReport
+) -> dict | Future[dict]:
+    """Job queue runner: download, post-process and archive one request.
+
+    get_job_queue binds resources, so the queue calls this with the payload
+    and report only. Returns the final path and the messages to show, as
+    [level, text] pairs where level names a Streamlit element (e.g. "success"
+    or "warning"). When ffmpeg has work to do, that result comes as a future
+    instead, so the queue worker goes on to the next download while the
+    transcode pipeline encodes.
+    """
+    notes: list[list[str]] = []
+
+    def note(level: str, text: str) -> None:
+        notes.append([level, text])
+
+    url = payload["url"]
+    kind = payload["kind"]
+    format_id = payload["format_id"]
+    stream_ffmpeg = None
+    if payload["mode"] == "audio" and payload["convert_to_mp3"]:
+        if payload["stream_mp3"] and not payload["keep_source"]:
+            stream_ffmpeg = resources.ffmpeg_path
+    file_path = download_with_progress(
+        resources,
+        url,
+        format_id,
+        payload["outtmpl"],
+        report,
+        note,
+        extra_opts=payload["extra_opts"],
+        connections=payload["connections"],
+        stream_mp3_ffmpeg=stream_ffmpeg,
+    )
+
+    if payload["mode"] == "video":
+        note("success", f"Downloaded: {file_path}")
+        note("caption", f"Saved to: {os.path.abspath(file_path)}")
+        aac_action = payload["aac_action"]
+        if aac_action == "reencode":
+            note("success", "AAC re-encode completed.")
+        elif aac_action == "probe":
+            ffmpeg_path = resources.ffmpeg_path
+            probe_plan = None
+            if ffmpeg_path:
+                probe = probe_media(file_path, ffprobe_for(ffmpeg_path))
+                probe_plan = plan_from_probe(probe)
+            if not ffmpeg_path:
+                note("warning", "ffmpeg not found. Skipping AAC re-encode.")
+            elif probe_plan.action != "reencode":
+                note("caption", f"AAC audio: {probe_plan.reason}")
+            elif os.path.isfile(file_path):
+                aac_path = aac_output_path(file_path)
+                job = TranscodeJob(
+                    build_aac_command(ffmpeg_path, file_path, aac_path),
+                    file_path,
+                    aac_path,
+                    replace_source=True,
+                )
+                report("Re-encoding audio to AAC...", None, None)
+
+                def finish_aac(outcome: TranscodeResult) -> dict:
+                    if not outcome.ok:
+                        note("error", f"AAC re-encode failed: {outcome.error}")
+                    else:
+                        note("success", "AAC re-encode completed.")
+                    archive_download(
+                        resources.archive, url, kind, format_id, file_path, note
+                    )
+                    return {"path": file_path, "notes": notes}
+
+                return after_transcode(
+                    resources.transcode_pipeline.submit(job), finish_aac
+                )
+        archive_download(resources.archive, url, kind, format_id, file_path, note)
+        return {"path": file_path, "notes": notes}
+
+    if payload["convert_to_mp3"] and is_mp3(file_path):
+        note("success", f"MP3 saved: {file_path}")
+        archive_download(resources.archive, url, kind, format_id, file_path, note)
+        return {"path": file_path, "notes": notes}
+    note("success", f"Audio saved: {file_path}")
+    if not payload["convert_to_mp3"]:
+        archive_download(resources.archive, url, kind, format_id, file_path, note)
+        return {"path": file_path, "notes": notes}
+    ffmpeg_path = resources.ffmpeg_path
+    if not ffmpeg_path:
+        note("warning", "ffmpeg not found. Audio saved in original format.")
+        return {"path": file_path, "notes": notes}
+
+    mp3_path = mp3_output_path(file_path)
+    job = TranscodeJob(
+        build_mp3_command(ffmpeg_path, file_path, mp3_path),
+        file_path,
+        mp3_path,
+        remove_source=not payload["keep_source"],
+    )
+    report("Converting to MP3...", None, None)
+
+    def finish_mp3(outcome: TranscodeResult) -> dict:
+        if not outcome.ok:
+            note("error", f"MP3 conversion failed: {outcome.error}")
+            note("info", f"Original audio saved: {file_path}")
+            return {"path": file_path, "notes": notes}
+        note("success", f"MP3 saved: {mp3_path}")
+        archive_download(resources.archive, url, kind, format_id, mp3_path, note)
+        return {"path": mp3_path, "notes": notes}
+
+    return after_transcode(resources.transcode_pipeline.submit(job), finish_mp3)
+
+
+@st.cache_resource(show_spinner=False)
+def get_job_queue() -> JobQueue:
+    # One queue and worker pool for the whole server: identical requests from
+    # different sessions share a job, and at most DEFAULT_QUEUE_WORKERS
+    # downloads run at once. Runs on the script thread, so the resources the
+    # workers need are resolved here.
+    resources = JobResources(
+        info_cache=get_info_cache(),
+        ydl_pool=get_ydl_pool(),
+        archive=get_download_archive(),
+        transcode_pipeline=get_transcode_pipeline(),
+        bandwidth_estimator=get_bandwidth_estimator(),
+        ffmpeg_path=resolve_ffmpeg_path(),
+    )
+    return JobQueue(functools.partial(run_download_job, resources))
+
+
+def render_job(job: QueuedJob) -> None:
+    """Progress of a running job, or the messages of a finished one."""
+    label = f"{job.payload['mode'].capitalize()}: {job.payload['url']}"
+    if job.status == JOB_QUEUED:
+        st.write(f"{label} - waiting for a free download slot...")
+        st.progress(0)
+    elif not job.finished:
+        st.write(f"{label} - {job.message or 'Starting...'}")
+        st.progress(int((job.fraction or 0) * 100))
+    elif not job.ok:
+        st.error(f"{label} - download failed: {job.error}")
+    else:
+        for level, text in job.result["notes"]:
+            getattr(st, level)(text)
+        show_file_links(job.result["path"])
+
+
+def show_download_jobs() -> bool:
+    """Render this session's jobs; return whether any is still in flight."""
+    job_ids = st.session_state.get("download_jobs", [])
+    jobs = get_job_queue().get_many(job_ids)
+    # Jobs deleted from the queue (e.g. expired) are forgotten.
+    st.session_state["download_jobs"] = [job.id for job in jobs]
+    for job in jobs:
+        render_job(job)
+    if any(job.finished for job in jobs) and st.button("Clear finished"):
+        st.session_state["download_jobs"] = [job.id for job in jobs if not job.finished]
+        st.rerun()
+    return not all(job.finished for job in jobs)
+
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def poll_download_jobs() -> None:
+    # Only this fragment reruns while downloads are in flight, so polling
+    # costs one SQLite query and never interrupts the rest of the page.
+    if not show_download_jobs():
+        # Everything finished: rerun the page once to stop polling.
+        st.rerun()
+
+
 st.set_page_config(page_title="YouTube Downloader", page_icon="▶", layout="centered")
 
 st.title("YouTube Downloader")
@@ -209,6 +624,27 @@ with basic_tab:
 with format_tab:
     manual_select = st.checkbox("Choose format manually", value=False)
     st.session_state["manual_select"] = manual_select
+    auto_select = False
+    if not manual_select:
+        auto_select = st.checkbox(
+            "Pick the best format that fits a time or size limit",
+            value=False,
+            help="Uses the measured download speed from the Speed tab.",
+        )
+    st.session_state["auto_select"] = auto_select
+    if auto_select:
+        st.session_state["deadline_minutes"] = st.number_input(
+            "Finish within (minutes, 0 for no limit)",
+            min_value=0.0,
+            value=5.0,
+            step=1.0,
+        )
+        st.session_state["max_mb"] = st.number_input(
+            "Largest file (MB, 0 for no limit)",
+            min_value=0.0,
+            value=0.0,
+            step=50.0,
+        )
     if manual_select:
         if st.button("Load formats"):
             if not url.strip():
@@ -218,11 +654,14 @@ with format_tab:
                     st.session_state["format_info"] = extract_info_with_ytdlp_api(
                         url.strip()
                     )
+                    st.session_state["format_key"] = cache_key(url.strip())
 
         format_info = st.session_state.get("format_info")
         if format_info:
             if mode == "video":
-                video_choices = build_video_format_choices(format_info)
+                video_choices = cached_video_format_choices(
+                    st.session_state.get("format_key", ""), format_info
+                )
                 if not video_choices:
                     st.warning("No MP4 video formats found.")
                 else:
@@ -231,7 +670,9 @@ with format_tab:
                     selected_index = labels.index(selected_label)
                     st.session_state["selected_format"] = video_choices[selected_index]
             else:
-                audio_choices = build_audio_format_choices(format_info)
+                audio_choices = cached_audio_format_choices(
+                    st.session_state.get("format_key", ""), format_info
+                )
                 if not audio_choices:
                     st.warning("No audio-only formats found.")
                 else:
@@ -248,21 +689,48 @@ with speed_tab:
         use_cached = False
         if cached_speed:
             use_cached = st.checkbox(
-                f"Use cached speed ({cached_speed:.1f} Mbps)", value=True
+                f"Use measured speed ({cached_speed:.1f} Mbps)",
+                value=True,
+                help="Measured passively from recent downloads, or from speed "
+                "test history if nothing has been downloaded yet.",
             )
         st.session_state["use_cached_speed"] = use_cached
         st.session_state["cached_speed"] = cached_speed
+        host_stats = get_bandwidth_estimator().host_stats()
+        if host_stats:
+            with st.expander("Throughput by host"):
+                st.table(
+                    [
+                        {
+                            "host": host,
+                            "downloads": item["downloads"],
+                            "MB": round(item["bytes"] / (1024 * 1024), 1),
+                            "avg Mbps": round(item["avg_mbps"], 1),
+                            "recent Mbps": round(item["ewma_mbps"] or 0, 1),
+                        }
+                        for host, item in host_stats.items()
+                    ]
+                )
         auto_test = st.checkbox("Run speed test", value=False)
         test_url = st.text_input(
             "Speed test URL",
             value=DEFAULT_SPEED_TEST_URL,
         )
+        test_streams = st.number_input(
+            "Parallel streams",
+            min_value=1,
+            max_value=16,
+            value=DEFAULT_STREAMS,
+        )
         if auto_test and st.button("Start speed test"):
             try:
-                speed_mbps = measure_download_speed(test_url, MAX_TEST_BYTES)
-                save_cached_speed(speed_mbps)
+                with st.spinner("Measuring download speed..."):
+                    result = run_speed_test(test_url, streams=int(test_streams))
+                record_speed_test(result)
+                speed_mbps = load_cached_speed() or result.median_mbps
                 st.session_state["speed_mbps_test"] = speed_mbps
-                st.success(f"Estimated speed: {speed_mbps:.1f} Mbps")
+                st.success(f"Measured: {format_result(result)}")
+                st.caption(f"Smoothed estimate: {speed_mbps:.1f} Mbps")
             except Exception as exc:
                 st.error(f"Speed test failed: {exc}")
         manual_speed = st.number_input(
@@ -285,7 +753,142 @@ with advanced_tab:
     )
     convert_to_mp3 = st.checkbox("Convert audio to MP3 (ffmpeg)", value=True)
     keep_source_audio = st.checkbox("Keep original audio after MP3", value=False)
+    stream_mp3 = st.checkbox(
+        "Stream audio straight into the MP3 encoder",
+        value=False,
+        help="Writes only the MP3 and converts while downloading. Not used "
+        "when keeping the original audio.",
+    )
     reencode_aac = st.checkbox("Re-encode video audio to AAC", value=False)
+    skip_archived = st.checkbox(
+        "Skip videos already downloaded",
+        value=True,
+        help="Checks the download archive before fetching anything.",
+    )
+    connections = st.slider(
+        "Parallel connections per file",
+        min_value=1,
+        max_value=16,
+        value=1,
+        help="More than 1 downloads byte ranges in parallel and can resume.",
+    )
+    with st.expander("Server bandwidth limits"):
+        st.caption(
+            "Shared by every session on this server. Downloads started here "
+            "are served before background batch jobs."
+        )
+        total_limit = st.number_input(
+            "Total limit (Mbps, 0 for none)",
+            min_value=0.0,
+            value=float(SCHEDULER.total_mbps or 0),
+            step=10.0,
+        )
+        job_limit = st.number_input(
+            "Per-download limit (Mbps, 0 for none)",
+            min_value=0.0,
+            value=float(SCHEDULER.job_mbps or 0),
+            step=10.0,
+        )
+        if st.button("Apply limits"):
+            SCHEDULER.configure(total_limit, job_limit)
+            st.success("Bandwidth limits updated.")
+        active = SCHEDULER.snapshot()
+        if active:
+            st.table(
+                [
+                    {
+                        "priority": priority,
+                        "active downloads": item["jobs"],
+                        "MB": round(item["bytes"] / (1024 * 1024), 1),
+                        "waited s": round(item["waited_seconds"], 1),
+                    }
+                    for priority, item in sorted(active.items())
+                ]
+            )
+    with st.expander("Download cache"):
+        st.caption(
+            "Finished downloads in the downloads folder are served again "
+            "without fetching them. Over the budget, the coldest files are "
+            "deleted to make room."
+        )
+        archive = get_download_archive()
+        cache_budget = st.number_input(
+            "Cache budget (GB, 0 for no limit)",
+            min_value=0.0,
+            value=(archive.max_bytes or 0) / 1024**3,
+            step=1.0,
+        )
+        cache_policy = st.selectbox(
+            "Delete first",
+            EVICTION_POLICIES,
+            index=EVICTION_POLICIES.index(archive.policy),
+            format_func=lambda policy: {
+                EVICT_LRU: "least recently used",
+            }.get(policy, "least often used"),
+        )
+        if st.button("Apply cache budget"):
+            evicted = archive.configure(int(cache_budget * 1024**3), cache_policy)
+            st.success(f"Cache budget updated; {len(evicted)} files removed.")
+        cache_stats = archive.stats()
+        st.table(
+            [
+                {
+                    "files": cache_stats["files"],
+                    "MB": round(cache_stats["bytes"] / (1024 * 1024), 1),
+                    "hits": cache_stats["hits"],
+                    "misses": cache_stats["misses"],
+                    "hit rate": (
+                        f"{cache_stats['hit_rate']:.0%}"
+                        if cache_stats["hit_rate"] is not None
+                        else "-"
+                    ),
+                    "evicted": cache_stats["evictions"],
+                }
+            ]
+        )
+    with st.expander("Shared download queue"):
+        st.caption(
+            "Downloads from every session run here, a few at a time. Asking "
+            "for something already in progress joins that download."
+        )
+        queued_jobs = get_job_queue().active()
+        if queued_jobs:
+            st.table(
+                [
+                    {
+                        "url": item.payload["url"],
+                        "kind": item.payload["kind"],
+                        "status": item.status,
+                        "sessions": item.subscribers,
+                        "done %": (
+                            round(item.fraction * 100) if item.fraction else None
+                        ),
+                    }
+                    for item in queued_jobs
+                ]
+            )
+        else:
+            st.caption("Nothing queued.")
+    if st.button("Clear cached data"):
+        clear_app_caches()
+        st.session_state.pop("format_info", None)
+        st.success("Cached formats, speed and tool paths cleared.")
+    stage_summary = STAGES.summary()
+    if stage_summary:
+        with st.expander("Stage timings (this server process)"):
+            st.table(
+                [
+                    {
+                        "stage": stage,
+                        "runs": item["runs"],
+                        "failed": item["failures"],
+                        "avg s": round(item["avg_seconds"], 2),
+                        "total s": round(item["seconds"], 1),
+                        "MB": round(item["bytes"] / (1024 * 1024), 1),
+                    }
+                    for stage, item in sorted(stage_summary.items())
+                ]
+            )
 
 if st.button("Download", use_container_width=True):
     if not url.strip():
@@ -304,6 +907,58 @@ if st.button("Download", use_container_width=True):
     if manual_select_state and selected_format:
         selected_size = selected_format.get("size_bytes") or 0
 
+    if mode == "video":
+        kind = archive_kind("video", "aac" if reencode_aac else None)
+    else:
+        kind = archive_kind("audio", "mp3" if convert_to_mp3 else None)
+    auto_plan = None
+    if st.session_state.get("auto_select", False):
+        deadline_minutes = st.session_state.get("deadline_minutes") or 0.0
+        max_mb = st.session_state.get("max_mb") or 0.0
+        speed_estimate = load_cached_speed()
+        if deadline_minutes and not speed_estimate:
+            st.warning("No measured speed yet; run a speed test for the time limit.")
+        with st.spinner("Choosing a format..."):
+            auto_plan = select_format(
+                extract_info_with_ytdlp_api(url.strip()),
+                mode,
+                speed_estimate,
+                deadline_minutes * 60 if deadline_minutes else None,
+                int(max_mb * 1024 * 1024) if max_mb else None,
+            )
+        if auto_plan:
+            st.info(f"Auto-selected: {describe_plan(auto_plan)}")
+            selected_size = auto_plan.size_bytes or 0
+
+    if mode == "video":
+        format_id = "best"
+        if manual_select_state and selected_format:
+            if selected_format.get("has_audio"):
+                format_id = selected_format.get("format_id") or "best"
+            elif merge_video_audio:
+                video_id = selected_format.get("format_id")
+                format_id = f"{video_id}+bestaudio/best" if video_id else "best"
+            else:
+                st.warning("Selected format is video-only; using best with audio.")
+        elif prefer_bestvideo_audio:
+            format_id = "bestvideo+bestaudio/best"
+    else:
+        format_id = "bestaudio/best"
+        if manual_select_state and selected_format:
+            format_id = selected_format.get("format_id") or format_id
+    if auto_plan:
+        format_id = auto_plan.format_selector
+
+    if skip_archived:
+        # Matched on the format too: another user's 360p copy is not an
+        # answer to a 1080p request.
+        archived = get_download_archive().find(url.strip(), kind, format_id)
+        if archived:
+            st.success(f"Already downloaded: {archived.path}")
+            show_file_links(archived.path)
+            st.caption("Untick 'Skip videos already downloaded' to fetch it again.")
+            st.stop()
+
     if st.session_state.get("estimate_time", False):
         speed_mbps = None
         manual_speed = st.session_state.get("manual_speed") or 0.0
@@ -334,104 +989,43 @@ if st.button("Download", use_container_width=True):
             else:
                 st.warning("No JS runtime found; continuing without it.")
 
-        if mode == "video":
-            format_id = "best"
-            if manual_select_state and selected_format:
-                if selected_format.get("has_audio"):
-                    format_id = selected_format.get("format_id") or "best"
-                elif merge_video_audio:
-                    video_id = selected_format.get("format_id")
-                    format_id = f"{video_id}+bestaudio/best" if video_id else "best"
-                else:
-                    st.warning("Selected format is video-only; using best with audio.")
-            elif prefer_bestvideo_audio:
-                format_id = "bestvideo+bestaudio/best"
-            st.info("Downloading video (may take a moment)...")
-            file_path = download_with_progress(
-                url.strip(),
-                format_id,
-                outtmpl,
-            )
-            st.success(f"Downloaded: {file_path}")
-            st.caption(f"Saved to: {os.path.abspath(file_path)}")
-
-            if reencode_aac:
-                ffmpeg_path = resolve_ffmpeg_path()
-                if not ffmpeg_path:
-                    st.warning("ffmpeg not found. Skipping AAC re-encode.")
-                elif file_path and os.path.isfile(file_path):
-                    root, ext = os.path.splitext(file_path)
-                    aac_path = f"{root}_aac{ext}"
-                    result = subprocess.run(
-                        [
-                            ffmpeg_path,
-                            "-y",
-                            "-i",
-                            file_path,
-                            "-c:v",
-                            "copy",
-                            "-c:a",
-                            "aac",
-                            "-b:a",
-                            "192k",
-                            aac_path,
-                        ],
-                        capture_output=True,
-                        text=True,
-                        timeout=300,
-                    )
-                    if result.returncode != 0:
-                        st.error(f"AAC re-encode failed: {result.stderr[:500]}")
-                    else:
-                        os.replace(aac_path, file_path)
-                        st.success("AAC re-encode completed.")
-        else:
-            format_id = "bestaudio/best"
-            if manual_select_state and selected_format:
-                format_id = selected_format.get("format_id") or format_id
-            file_path = download_with_progress(
-                url.strip(),
-                format_id,
-                outtmpl,
-            )
-            st.success(f"Audio saved: {file_path}")
-            if convert_to_mp3:
-                ffmpeg_path = resolve_ffmpeg_path()
-                if not ffmpeg_path:
-                    st.warning("ffmpeg not found. Audio saved in original format.")
-                    st.stop()
-
-                mp3_path = os.path.splitext(file_path)[0] + ".mp3"
-                try:
-                    result = subprocess.run(
-                        [
-                            ffmpeg_path,
-                            "-y",
-                            "-i",
-                            file_path,
-                            "-acodec",
-                            "libmp3lame",
-                            "-q:a",
-                            "0",
-                            mp3_path,
-                        ],
-                        capture_output=True,
-                        text=True,
-                        timeout=300,
-                    )
-                    if result.returncode != 0:
-                        st.error(f"MP3 conversion failed: {result.stderr[:500]}")
-                        st.info(f"Original audio saved: {file_path}")
-                    else:
-                        st.success(f"MP3 saved: {mp3_path}")
-                        if not keep_source_audio:
-                            try:
-                                os.remove(file_path)
-                            except OSError:
-                                pass
-                except subprocess.TimeoutExpired:
-                    st.error("MP3 conversion timed out (5+ minutes)")
-                except Exception as exc:
-                    st.error(f"Conversion error: {str(exc)}")
+        aac_plan = None
+        if mode == "video" and reencode_aac:
+            aac_plan = plan_aac_reencode(url.strip(), format_id)
+            st.caption(f"AAC audio: {aac_plan.action} ({aac_plan.reason})")
+
+        payload = {
+            "url": url.strip(),
+            "mode": mode,
+            "kind": kind,
+            "format_id": format_id,
+            "outtmpl": outtmpl,
+            "extra_opts": aac_plan.ydl_opts if aac_plan else None,
+            "aac_action": aac_plan.action if aac_plan else None,
+            "convert_to_mp3": mode == "audio" and convert_to_mp3,
+            "keep_source": keep_source_audio,
+            "stream_mp3": stream_mp3,
+            "connections": connections,
+        }
+        job, joined = get_job_queue().submit(
+            coalesce_key(payload, JOB_TRANSPORT_FIELDS), payload
+        )
+        if joined:
+            st.info("This download is already in progress; following it.")
+        if job.id not in st.session_state.setdefault("download_jobs", []):
+            st.session_state["download_jobs"].append(job.id)
     except Exception as exc:
         st.error(f"Download failed: {exc}")
+
+# Downloads run on the job queue's workers, so the page stays responsive and
+# a rerun (any widget click) doesn't interrupt them; their status is polled.
+if st.session_state.get("download_jobs"):
+    active_jobs = [
+        job
+        for job in get_job_queue().get_many(st.session_state["download_jobs"])
+        if not job.finished
+    ]
+    if active_jobs:
+        poll_download_jobs()
+    else:
+        show_download_jobs()
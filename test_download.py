@@ -5,6 +5,8 @@ import os
 import json
 from yt_dlp import YoutubeDL
 
+from progress_reporter import ProgressThrottle
+
 
 def test_download():
     url = "https://www.youtube.com/watch?v=GIFaD8jGkKE"
@@ -75,6 +77,8 @@ def test_download():
     print("=" * 60)
 
     format_selector = "18"  # Combined video+audio format
+    # Rewriting the terminal line on every received block slows fast links.
+    throttled_hook = ProgressThrottle(progress_hook)
     outtmpl = os.path.join(output_dir, "test_video_combined.%(ext)s")
 
     ydl_opts_download = {
@@ -82,7 +86,7 @@ def test_download():
         "outtmpl": outtmpl,
         "noplaylist": True,
         "quiet": False,
-        "progress_hooks": [progress_hook],
+        "progress_hooks": [throttled_hook],
     }
 
     # Only enable merge_output_format if format selector contains '+' (merging requirement)
@@ -93,7 +97,7 @@ def test_download():
     print(f"Output template: {outtmpl}")
 
     try:
-        with YoutubeDL(ydl_opts_download) as ydl:
+        with throttled_hook, YoutubeDL(ydl_opts_download) as ydl:
             result = ydl.extract_info(url, download=True)
             if result:
                 filename = ydl.prepare_filename(result)
@@ -0,0 +1,65 @@
+"""Tests for the download archive's format-aware cache lookups."""
+
+import os
+
+from download_archive import DownloadArchive
+
+URL = "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+
+
+def write_file(path: str, size: int) -> str:
+    with open(path, "wb") as handle:
+        handle.write(b"x" * size)
+    return path
+
+
+def test_formats_of_one_url_are_separate_entries(tmp_path):
+    archive = DownloadArchive(os.path.join(tmp_path, ".archive.sqlite3"))
+    low = write_file(os.path.join(tmp_path, "video 360p.mp4"), 100)
+    high = write_file(os.path.join(tmp_path, "video 1080p.mp4"), 300)
+    archive.record(URL, "video", "18", low)
+    archive.record(URL, "video", "137+140/best", high)
+
+    assert archive.find(URL, "video", "18").path == os.path.abspath(low)
+    assert archive.find(URL, "video", "137+140/best").path == os.path.abspath(high)
+    # A format never downloaded is a miss, not the other formats' files.
+    assert archive.find(URL, "video", "best") is None
+    assert archive.find(URL, "audio", "18") is None
+
+    stats = archive.stats()
+    assert (stats["files"], stats["bytes"]) == (2, 400)
+    assert (stats["hits"], stats["misses"]) == (2, 2)
+    archive.close()
+
+
+def test_overwritten_file_belongs_to_the_latest_format(tmp_path):
+    archive = DownloadArchive(os.path.join(tmp_path, ".archive.sqlite3"))
+    path = write_file(os.path.join(tmp_path, "video.mp4"), 100)
+    archive.record(URL, "video", "18", path)
+    write_file(path, 100)
+    archive.record(URL, "video", "137", path)
+
+    assert archive.find(URL, "video", "18") is None
+    assert archive.find(URL, "video", "137").format == "137"
+    archive.close()
+
+
+def test_missing_files_count_neither_as_cached_nor_evicted(tmp_path):
+    archive = DownloadArchive(os.path.join(tmp_path, ".archive.sqlite3"))
+    gone = write_file(os.path.join(tmp_path, "gone.mp4"), 500)
+    kept = write_file(os.path.join(tmp_path, "kept.mp4"), 100)
+    archive.record(URL, "video", "18", gone)
+    archive.record(URL, "video", "22", kept)
+    os.remove(gone)
+
+    stats = archive.stats()
+    assert (stats["files"], stats["bytes"]) == (1, 100)
+    assert archive.configure(max_bytes=200) == []
+    newest = write_file(os.path.join(tmp_path, "newest.mp4"), 150)
+    archive.record(URL, "video", "137", newest)
+
+    stats = archive.stats()
+    assert (stats["files"], stats["bytes"]) == (1, 150)
+    assert (stats["evictions"], stats["evicted_bytes"]) == (1, 100)
+    assert not os.path.exists(kept)
+    archive.close()
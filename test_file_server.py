@@ -0,0 +1,102 @@
+"""Tests for what the download server serves and its range/ETag handling."""
+
+import urllib.error
+import urllib.request
+
+import pytest
+
+BODY = bytes(range(256)) * 40
+
+from file_server import FileServer
+
+
+@pytest.fixture
+def server(tmp_path):
+    with FileServer(str(tmp_path), host="127.0.0.1", port=0, public_url=None) as srv:
+        yield srv
+
+
+def fetch(
+    server: FileServer, name: str, headers: dict[str, str] | None = None
+) -> tuple[int, dict[str, str], bytes]:
+    """Status, headers and body of a GET, error statuses included."""
+    request = urllib.request.Request(f"{server.base_url}/{name}", headers=headers or {})
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, dict(response.headers), response.read()
+    except urllib.error.HTTPError as exc:
+        with exc:
+            return exc.code, dict(exc.headers), exc.read()
+
+
+def status_of(server: FileServer, name: str) -> int:
+    return fetch(server, name)[0]
+
+
+@pytest.fixture
+def video(tmp_path):
+    (tmp_path / "video.mp4").write_bytes(BODY)
+    return "video.mp4"
+
+
+@pytest.mark.parametrize(
+    "name",
+    [
+        "video.mp4.part",
+        "video.f137.mp4.part-Frag3",
+        "video.mp4.seg.part",
+        "video.part.mp3",
+    ],
+)
+def test_partial_files_are_not_served(tmp_path, server, name):
+    (tmp_path / name).write_bytes(b"partial")
+    assert status_of(server, name) == 404
+
+
+def test_finished_files_are_served(tmp_path, server):
+    (tmp_path / "video.mp4").write_bytes(b"finished")
+    (tmp_path / "party.mp4").write_bytes(b"finished")
+    assert status_of(server, "video.mp4") == 200
+    assert status_of(server, "party.mp4") == 200
+
+
+def test_single_range_is_a_206_with_its_content_range(server, video):
+    status, headers, body = fetch(server, video, {"Range": "bytes=100-199"})
+    assert status == 206
+    assert headers["Content-Range"] == f"bytes 100-199/{len(BODY)}"
+    assert headers["Content-Length"] == "100"
+    assert body == BODY[100:200]
+
+    size = len(BODY)
+    status, headers, body = fetch(server, video, {"Range": "bytes=-10"})
+    assert status == 206
+    assert headers["Content-Range"] == f"bytes {size - 10}-{size - 1}/{size}"
+    assert body == BODY[-10:]
+
+
+def test_unsatisfiable_range_is_a_416(server, video):
+    status, headers, body = fetch(server, video, {"Range": f"bytes={len(BODY)}-"})
+    assert status == 416
+    assert headers["Content-Range"] == f"bytes */{len(BODY)}"
+    assert body == b""
+
+
+def test_matching_if_none_match_is_a_304(server, video):
+    etag = fetch(server, video)[1]["ETag"]
+    status, headers, body = fetch(server, video, {"If-None-Match": etag})
+    assert status == 304
+    assert headers["ETag"] == etag
+    assert body == b""
+    assert fetch(server, video, {"If-None-Match": '"other"'})[0] == 200
+
+
+def test_if_range_resumes_only_the_same_version(server, video):
+    etag = fetch(server, video)[1]["ETag"]
+    status, _, body = fetch(server, video, {"Range": "bytes=10-19", "If-Range": etag})
+    assert (status, body) == (206, BODY[10:20])
+
+    stale = {"Range": "bytes=10-19", "If-Range": '"0-0"'}
+    status, headers, body = fetch(server, video, stale)
+    assert status == 200
+    assert "Content-Range" not in headers
+    assert body == BODY
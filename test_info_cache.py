@@ -0,0 +1,67 @@
+"""Tests for reusing cached info dicts across format selectors."""
+
+import os
+
+from yt_dlp import YoutubeDL
+
+from info_cache import InfoCache, extract_info_cached
+
+URL = "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+
+
+def fake_info() -> dict:
+    """An extractor result with one muxed and two split formats."""
+    return {
+        "id": "dQw4w9WgXcQ",
+        "title": "video",
+        "extractor": "youtube",
+        "extractor_key": "Youtube",
+        "webpage_url": URL,
+        "formats": [
+            {
+                "format_id": "18",
+                "url": "https://media.invalid/18",
+                "ext": "mp4",
+                "vcodec": "avc1",
+                "acodec": "mp4a.40.2",
+                "height": 360,
+            },
+            {
+                "format_id": "137",
+                "url": "https://media.invalid/137",
+                "ext": "mp4",
+                "vcodec": "avc1",
+                "acodec": "none",
+                "height": 1080,
+            },
+            {
+                "format_id": "140",
+                "url": "https://media.invalid/140",
+                "ext": "m4a",
+                "vcodec": "none",
+                "acodec": "mp4a.40.2",
+            },
+        ],
+    }
+
+
+def test_each_selector_runs_on_the_cached_entry(tmp_path, monkeypatch):
+    cache = InfoCache(os.path.join(tmp_path, "info"))
+    extractions = []
+
+    def extract_info(url, download=True, process=True, **kwargs):
+        extractions.append(url)
+        info = fake_info()
+        return ydl.process_ie_result(info, download=download) if process else info
+
+    with YoutubeDL({"format": "137+140", "quiet": True}) as ydl:
+        monkeypatch.setattr(ydl, "extract_info", extract_info)
+        merged = extract_info_cached(ydl, URL, cache)
+    assert [f["format_id"] for f in merged["requested_formats"]] == ["137", "140"]
+
+    with YoutubeDL({"format": "18", "quiet": True}) as ydl:
+        monkeypatch.setattr(ydl, "extract_info", extract_info)
+        single = extract_info_cached(ydl, URL, cache)
+    assert extractions == [URL]
+    assert single["format_id"] == "18"
+    assert "requested_formats" not in single
@@ -0,0 +1,64 @@
+"""Tests for how the shared job queue finishes jobs."""
+
+import os
+from concurrent.futures import Future
+
+from job_queue import JOB_DONE, JOB_FAILED, JOB_RUNNING, JobQueue, _pid_alive
+
+
+def runner(payload, report):
+    if payload["result"] == "unstorable":
+        return {"path": object()}
+    return {"path": payload["result"]}
+
+
+def test_unstorable_result_fails_the_job_and_the_worker_goes_on(tmp_path):
+    queue = JobQueue(runner, os.path.join(tmp_path, "jobs.sqlite3"), workers=1)
+    try:
+        bad, _ = queue.submit("bad", {"result": "unstorable"})
+        good, _ = queue.submit("good", {"result": "video.mp4"})
+
+        bad = queue.wait(bad.id, timeout=10)
+        good = queue.wait(good.id, timeout=10)
+    finally:
+        queue.shutdown()
+
+    assert bad.status == JOB_FAILED
+    assert "not JSON serializable" in bad.error
+    assert good.status == JOB_DONE
+    assert good.result == {"path": "video.mp4"}
+
+
+def test_own_process_is_alive():
+    assert _pid_alive(os.getpid())
+    assert not _pid_alive(None)
+
+
+def test_future_result_frees_the_worker_until_it_resolves(tmp_path):
+    pending: dict[str, Future] = {}
+
+    def deferred_runner(payload, report):
+        if payload["defer"]:
+            pending[payload["name"]] = Future()
+            return pending[payload["name"]]
+        return {"path": payload["name"]}
+
+    queue = JobQueue(deferred_runner, os.path.join(tmp_path, "jobs.sqlite3"), 1)
+    try:
+        slow, _ = queue.submit("slow", {"name": "slow", "defer": True})
+        broken, _ = queue.submit("broken", {"name": "broken", "defer": True})
+        quick, _ = queue.submit("quick", {"name": "quick", "defer": False})
+
+        # The single worker got past both deferred jobs.
+        assert queue.wait(quick.id, timeout=10).status == JOB_DONE
+        assert queue.get(slow.id).status == JOB_RUNNING
+
+        pending["slow"].set_result({"path": "slow.mp3"})
+        pending["broken"].set_exception(RuntimeError("ffmpeg failed"))
+        slow = queue.wait(slow.id, timeout=10)
+        broken = queue.wait(broken.id, timeout=10)
+    finally:
+        queue.shutdown()
+
+    assert (slow.status, slow.result) == (JOB_DONE, {"path": "slow.mp3"})
+    assert (broken.status, broken.error) == (JOB_FAILED, "ffmpeg failed")
@@ -0,0 +1,88 @@
+"""Tests for lazily reading playlist entries."""
+
+import gc
+import weakref
+
+import pytest
+from yt_dlp.utils import OnDemandPagedList
+
+from playlist_ingest import DUPLICATE_WINDOW, playlist_entry_urls
+
+
+class Entry(dict):
+    """A flat entry that can be tracked with a weak reference."""
+
+    __hash__ = object.__hash__
+
+
+def entries(count: int, alive: weakref.WeakSet):
+    for index in range(count):
+        entry = Entry(id=f"v{index:05d}", ie_key="Youtube", _type="url")
+        alive.add(entry)
+        yield entry
+
+
+def test_large_generator_is_not_retained():
+    alive: weakref.WeakSet = weakref.WeakSet()
+    urls = playlist_entry_urls({"entries": entries(5000, alive)}, {})
+    peak = 0
+    count = 0
+    for url in urls:
+        count += 1
+        if count % 500 == 0:
+            gc.collect()
+            peak = max(peak, len(alive))
+    assert count == 5000
+    assert url == "https://www.youtube.com/watch?v=v04999"
+    assert peak <= 2
+
+
+def test_paged_list_pages_are_not_cached():
+    pages = OnDemandPagedList(
+        lambda page: [
+            Entry(id=f"p{page}-{i}", url=f"https://media.invalid/{page}/{i}")
+            for i in range(10)
+            if page < 50
+        ],
+        10,
+    )
+    urls = list(playlist_entry_urls({"entries": pages}, {}))
+    assert len(urls) == 500
+    assert pages._cache == {}
+
+
+@pytest.mark.parametrize(
+    "params, expected",
+    [
+        ({"playlist_items": "2-4,9"}, ["v00001", "v00002", "v00003", "v00008"]),
+        ({"playlist_items": "1:10:3"}, ["v00000", "v00003", "v00006", "v00009"]),
+        ({"playliststart": 8, "playlistend": 10}, ["v00007", "v00008", "v00009"]),
+    ],
+)
+def test_item_selection_by_index(params, expected):
+    alive: weakref.WeakSet = weakref.WeakSet()
+    consumed = []
+
+    def tracked():
+        for entry in entries(1000, alive):
+            consumed.append(entry["id"])
+            yield entry
+
+    urls = list(playlist_entry_urls({"entries": tracked()}, params))
+    assert [url.rsplit("=", 1)[1] for url in urls] == expected
+    # Reading stops once no later index can be selected.
+    assert len(consumed) == int(expected[-1][1:]) + 1
+
+
+def test_negative_items_are_refused():
+    with pytest.raises(ValueError, match="count from the end"):
+        list(playlist_entry_urls({"entries": iter([])}, {"playlist_items": "-3:"}))
+
+
+def test_duplicates_are_skipped_within_the_window():
+    ids = ["a", "b", "a"] + [f"x{i}" for i in range(DUPLICATE_WINDOW)] + ["a"]
+    playlist = {"entries": [{"id": i, "ie_key": "Youtube"} for i in ids]}
+    got = [url.rsplit("=", 1)[1] for url in playlist_entry_urls(playlist, {})]
+    # The first repeat is within the window; the last has fallen out of it.
+    assert got.count("a") == 2
+    assert got.count("b") == 1
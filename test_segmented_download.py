@@ -0,0 +1,103 @@
+"""Tests for resuming segmented downloads against a local range server."""
+
+import hashlib
+import os
+
+import pytest
+
+import segmented_download
+from file_server import FileServer
+from segmented_download import PART_SUFFIX, STATE_SUFFIX, SegmentedDownload
+
+SIZE = 4 * 1024 * 1024
+
+
+class Interrupted(Exception):
+    pass
+
+
+@pytest.fixture(autouse=True)
+def save_state_every_chunk(monkeypatch):
+    monkeypatch.setattr(segmented_download, "STATE_SAVE_INTERVAL", 0.0)
+
+
+@pytest.fixture
+def served(tmp_path):
+    root = tmp_path / "remote"
+    root.mkdir()
+    with FileServer(str(root), host="127.0.0.1", port=0, public_url=None) as server:
+        yield root, server
+
+
+def write_remote(path, size: int, seed: bytes) -> str:
+    data = (hashlib.sha256(seed).digest() * (size // 32 + 1))[:size]
+    path.write_bytes(data)
+    return hashlib.sha256(data).hexdigest()
+
+
+def checksum(path: str) -> str:
+    with open(path, "rb") as handle:
+        return hashlib.sha256(handle.read()).hexdigest()
+
+
+def interrupt_after(limit: int):
+    """A throttle that stops the download once limit bytes have arrived."""
+    seen = 0
+
+    def throttle(size: int) -> None:
+        nonlocal seen
+        seen += size
+        if seen >= limit:
+            raise Interrupted
+
+    return throttle
+
+
+def test_interrupted_download_resumes_to_the_same_bytes(tmp_path, served):
+    root, server = served
+    expected = write_remote(root / "video.mp4", SIZE, b"v1")
+    url = f"{server.base_url}/video.mp4"
+    dest = str(tmp_path / "video.mp4")
+
+    with pytest.raises(Interrupted):
+        SegmentedDownload(
+            url, dest, connections=4, throttle=interrupt_after(SIZE // 2)
+        ).run()
+    assert os.path.exists(dest + STATE_SUFFIX)
+    assert not os.path.exists(dest)
+
+    transferred: list[int] = []
+    SegmentedDownload(
+        url, dest, connections=4, throttle=transferred.append
+    ).run()
+
+    assert checksum(dest) == expected
+    assert 0 < sum(transferred) < SIZE
+    assert not os.path.exists(dest + PART_SUFFIX)
+    assert not os.path.exists(dest + STATE_SUFFIX)
+
+
+@pytest.mark.parametrize("new_size", [SIZE, SIZE + 12345])
+def test_changed_remote_file_restarts_instead_of_splicing(tmp_path, served, new_size):
+    root, server = served
+    remote = root / "video.mp4"
+    write_remote(remote, SIZE, b"v1")
+    url = f"{server.base_url}/video.mp4"
+    dest = str(tmp_path / "video.mp4")
+
+    with pytest.raises(Interrupted):
+        SegmentedDownload(
+            url, dest, connections=4, throttle=interrupt_after(SIZE // 2)
+        ).run()
+
+    # The server's ETag comes from the size and mtime.
+    expected = write_remote(remote, new_size, b"v2")
+    stat = os.stat(remote)
+    os.utime(remote, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    transferred: list[int] = []
+    SegmentedDownload(
+        url, dest, connections=4, throttle=transferred.append
+    ).run()
+
+    assert checksum(dest) == expected
+    assert sum(transferred) == new_size
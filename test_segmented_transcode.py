@@ -0,0 +1,76 @@
+"""Tests for segment-parallel transcodes against a real ffmpeg."""
+
+import shutil
+import subprocess
+
+import pytest
+
+import segmented_transcode
+from segmented_transcode import (
+    ffprobe_for,
+    probe_audio_packets,
+    probe_duration,
+    transcode_in_segments,
+)
+
+FFMPEG = shutil.which("ffmpeg")
+pytestmark = pytest.mark.skipif(
+    not FFMPEG or not ffprobe_for(FFMPEG), reason="needs ffmpeg and ffprobe"
+)
+SECONDS = 60
+
+
+@pytest.fixture(autouse=True)
+def short_segments(monkeypatch):
+    # Real thresholds need ten minutes of audio; split a minute instead.
+    monkeypatch.setattr(segmented_transcode, "MIN_SEGMENTED_SECONDS", 30)
+    monkeypatch.setattr(segmented_transcode, "MIN_SEGMENT_SECONDS", 10)
+
+
+def make_source(path: str) -> str:
+    subprocess.run(
+        [
+            FFMPEG,
+            "-y",
+            "-v",
+            "error",
+            "-f",
+            "lavfi",
+            "-i",
+            f"sine=frequency=440:duration={SECONDS}:sample_rate=44100",
+            "-c:a",
+            "aac",
+            path,
+        ],
+        check=True,
+    )
+    return path
+
+
+def single_pass(source: str, output: str, audio_args: list[str]) -> str:
+    subprocess.run(
+        [FFMPEG, "-y", "-v", "error", "-i", source, "-map", "0:a", *audio_args, output],
+        check=True,
+    )
+    return output
+
+
+@pytest.mark.parametrize(
+    "audio_args, ext",
+    [
+        (["-c:a", "aac", "-b:a", "192k"], "m4a"),
+        (["-acodec", "libmp3lame", "-q:a", "0"], "mp3"),
+    ],
+)
+def test_segments_match_a_single_pass(tmp_path, audio_args, ext):
+    source = make_source(str(tmp_path / "source.m4a"))
+    output = str(tmp_path / f"segmented.{ext}")
+
+    assert transcode_in_segments(FFMPEG, source, output, audio_args, 4) == 4
+
+    ffprobe = ffprobe_for(FFMPEG)
+    reference = single_pass(source, str(tmp_path / f"single.{ext}"), audio_args)
+    joined = probe_audio_packets(ffprobe, output)
+    expected = probe_audio_packets(ffprobe, reference)
+    assert abs(joined.packets - expected.packets) <= 1
+    assert probe_duration(ffprobe, output) == pytest.approx(SECONDS, abs=0.05)
@@ -0,0 +1,64 @@
+"""Tests for streaming a download into ffmpeg."""
+
+import io
+import os
+import subprocess
+import sys
+import urllib.request
+
+import pytest
+
+from stream_transcode import StreamTranscodeError, stream_to_mp3
+
+
+class FailingResponse(io.BytesIO):
+    """A response that times out after its first chunk."""
+
+    headers: dict[str, str] = {}
+
+    def __init__(self) -> None:
+        super().__init__(b"x" * 1024)
+        self.reads = 0
+
+    def read(self, size: int = -1) -> bytes:
+        self.reads += 1
+        if self.reads > 1:
+            raise TimeoutError("The read operation timed out")
+        return super().read(size)
+
+
+def fake_ffmpeg(tmp_path) -> str:
+    """An "ffmpeg" that creates its output and then reads stdin forever."""
+    script = tmp_path / "ffmpeg"
+    script.write_text(
+        f"#!{sys.executable}\n"
+        "import sys, time\n"
+        "open(sys.argv[-1], 'wb').close()\n"
+        "while sys.stdin.buffer.read(1024):\n"
+        "    pass\n"
+        "time.sleep(60)\n"
+    )
+    script.chmod(0o755)
+    return str(script)
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="runs a script as ffmpeg")
+def test_failing_reader_kills_ffmpeg_and_raises_stream_error(tmp_path, monkeypatch):
+    processes = []
+
+    class RecordingPopen(subprocess.Popen):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            processes.append(self)
+
+    monkeypatch.setattr(subprocess, "Popen", RecordingPopen)
+    monkeypatch.setattr(
+        urllib.request, "urlopen", lambda request, timeout=None: FailingResponse()
+    )
+    ffmpeg = fake_ffmpeg(tmp_path)
+
+    with pytest.raises(StreamTranscodeError, match="timed out"):
+        stream_to_mp3("https://media.invalid/audio", str(tmp_path / "a.mp3"), ffmpeg)
+
+    assert processes and processes[0].poll() is not None
+    assert os.listdir(tmp_path) == ["ffmpeg"]
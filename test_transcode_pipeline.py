@@ -0,0 +1,72 @@
+"""Tests for how the transcode pipeline reports failures."""
+
+import sys
+
+import pytest
+
+import transcode_pipeline
+from transcode_pipeline import TranscodeJob, TranscodePipeline, run_transcode
+
+
+def copy_command(source: str, output: str) -> list[str]:
+    """A stand-in for ffmpeg that copies source to output."""
+    script = "import shutil, sys; shutil.copyfile(sys.argv[1], sys.argv[2])"
+    return [sys.executable, "-c", script, source, output]
+
+
+def test_worker_error_reaches_the_caller(monkeypatch, tmp_path):
+    def broken(job):
+        raise RuntimeError("worker bug")
+
+    monkeypatch.setattr(transcode_pipeline, "run_transcode", broken)
+    pipeline = TranscodePipeline(workers=1)
+    try:
+        job = TranscodeJob(["ffmpeg"], "in.webm", "out.mp3")
+        with pytest.raises(RuntimeError, match="worker bug"):
+            pipeline.submit(job).result(timeout=10)
+        # The worker is still there for the next job.
+        with pytest.raises(RuntimeError):
+            pipeline.submit(job).result(timeout=10)
+    finally:
+        pipeline.shutdown()
+
+
+def test_unpublishable_output_fails_the_job(tmp_path):
+    source = tmp_path / "audio.webm"
+    source.write_bytes(b"audio")
+    # ffmpeg's partial file can't replace a directory at the output path.
+    output = tmp_path / "audio.mp3"
+    (output / "taken").mkdir(parents=True)
+    job = TranscodeJob(copy_command(str(source), str(output)), str(source), str(output))
+
+    result = run_transcode(job)
+
+    assert not result.ok
+    assert "could not publish the output" in result.error
+    assert not (tmp_path / "audio.part.mp3").exists()
+
+
+def test_source_left_behind_does_not_fail_a_published_output(tmp_path, monkeypatch):
+    source = tmp_path / "audio.webm"
+    source.write_bytes(b"audio")
+    output = tmp_path / "audio.mp3"
+    job = TranscodeJob(
+        copy_command(str(source), str(output)),
+        str(source),
+        str(output),
+        remove_source=True,
+    )
+    real_remove = transcode_pipeline.os.remove
+
+    def remove(path):
+        if path == str(source):
+            raise PermissionError("file in use")
+        real_remove(path)
+
+    monkeypatch.setattr(transcode_pipeline.os, "remove", remove)
+
+    result = run_transcode(job)
+
+    assert result.ok
+    assert result.output_path == str(output)
+    assert output.read_bytes() == b"audio"
@@ -0,0 +1,155 @@
+"""Passive bandwidth estimation from yt-dlp progress hooks.
+
+Every download already reports downloaded_bytes to its progress hooks, so
+real transfers are the speed test: ThroughputMonitor turns those callbacks
+into a live rate and ETA for the running download, and feeds each finished
+transfer into a BandwidthEstimator that keeps a persisted EWMA overall and
+per host.
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Any
+from urllib.parse import urlparse
+
+from speed_test import FileLock, atomic_write_json
+
+BANDWIDTH_STATE_PATH = os.path.join("downloads", ".bandwidth.json")
+# Weight of a new finished download in the persisted estimate.
+ESTIMATE_ALPHA = 0.3
+# Half-life of the live in-download rate; short so the ETA converges quickly.
+LIVE_HALF_LIFE_SECONDS = 3.0
+MIN_SAMPLE_SECONDS = 0.5
+# Transfers smaller than this are dominated by latency, not bandwidth.
+MIN_RECORD_BYTES = 256 * 1024
+
+
+def _ewma(current: float | None, value: float, alpha: float) -> float:
+    return value if current is None else alpha * value + (1 - alpha) * current
+
+
+def _host_of(url: str | None) -> str:
+    return urlparse(url or "").hostname or "unknown"
+
+
+class BandwidthEstimator:
+    """Process-wide EWMA of download throughput, persisted to JSON."""
+
+    def __init__(self, path: str = BANDWIDTH_STATE_PATH) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._state = self._load()
+
+    def _load(self) -> dict[str, Any]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as handle:
+                state = json.load(handle)
+            if isinstance(state, dict):
+                state.setdefault("hosts", {})
+                return state
+        except (OSError, ValueError):
+            pass
+        return {"ewma_mbps": None, "hosts": {}}
+
+    def record(self, host: str, nbytes: int, seconds: float) -> None:
+        """Fold one finished transfer into the overall and per-host stats."""
+        if nbytes < MIN_RECORD_BYTES or seconds <= 0:
+            return
+        mbps = nbytes * 8 / (seconds * 1e6)
+        with self._lock:
+            # Re-read so concurrent processes don't overwrite each other.
+            with FileLock(self.path):
+                self._state = self._load()
+                self._state["ewma_mbps"] = _ewma(
+                    self._state.get("ewma_mbps"), mbps, ESTIMATE_ALPHA
+                )
+                stats = self._state["hosts"].setdefault(
+                    host,
+                    {"downloads": 0, "bytes": 0, "seconds": 0.0, "ewma_mbps": None},
+                )
+                stats["downloads"] += 1
+                stats["bytes"] += nbytes
+                stats["seconds"] += seconds
+                stats["ewma_mbps"] = _ewma(stats["ewma_mbps"], mbps, ESTIMATE_ALPHA)
+                stats["updated"] = time.time()
+                atomic_write_json(self.path, self._state)
+
+    def estimate_mbps(self, host: str | None = None) -> float | None:
+        """Host-specific estimate when known, else the overall one."""
+        with self._lock:
+            if host and host in self._state["hosts"]:
+                return self._state["hosts"][host].get("ewma_mbps")
+            return self._state.get("ewma_mbps")
+
+    def host_stats(self) -> dict[str, dict[str, Any]]:
+        """Per host: downloads, bytes, seconds, average and EWMA Mbps."""
+        with self._lock:
+            stats = {}
+            for host, item in self._state["hosts"].items():
+                stats[host] = dict(item)
+                seconds = item.get("seconds") or 0
+                stats[host]["avg_mbps"] = (
+                    item.get("bytes", 0) * 8 / (seconds * 1e6) if seconds else 0.0
+                )
+            return stats
+
+
+class ThroughputMonitor:
+    """Progress hook that measures one job's throughput and live ETA.
+
+    Add it to progress_hooks before any hook that displays live_mbps or
+    eta_seconds. Merged downloads fetch several files in turn; each is
+    recorded separately when yt-dlp reports it finished.
+    """
+
+    def __init__(self, estimator: BandwidthEstimator) -> None:
+        self.estimator = estimator
+        self.live_mbps: float | None = None
+        self.eta_seconds: float | None = None
+        self._filename: str | None = None
+        self._started = 0.0
+        self._first_bytes = 0
+        self._last_time = 0.0
+        self._last_bytes = 0
+
+    def __call__(self, data: dict[str, Any]) -> None:
+        status = data.get("status")
+        downloaded = data.get("downloaded_bytes") or 0
+        now = time.monotonic()
+        if status == "downloading":
+            filename = data.get("filename")
+            if filename != self._filename or downloaded < self._last_bytes:
+                self._filename = filename
+                self._started = self._last_time = now
+                self._first_bytes = self._last_bytes = downloaded
+                return
+            elapsed = now - self._last_time
+            if elapsed >= MIN_SAMPLE_SECONDS:
+                rate = (downloaded - self._last_bytes) * 8 / (elapsed * 1e6)
+                alpha = 1 - 0.5 ** (elapsed / LIVE_HALF_LIFE_SECONDS)
+                self.live_mbps = _ewma(self.live_mbps, rate, alpha)
+                self._last_time, self._last_bytes = now, downloaded
+            total = data.get("total_bytes") or data.get("total_bytes_estimate")
+            speed = self.live_mbps or self.estimator.estimate_mbps()
+            if total and speed:
+                self.eta_seconds = max(total - downloaded, 0) * 8 / (speed * 1e6)
+        elif status == "finished" and self._filename is not None:
+            total = data.get("total_bytes") or downloaded or self._last_bytes
+            info = data.get("info_dict") or {}
+            self.estimator.record(
+                _host_of(info.get("url")),
+                total - self._first_bytes,
+                now - self._started,
+            )
+            self._filename = None
+            self.eta_seconds = 0.0
+
+
+def format_eta(seconds: float | None) -> str:
+    if seconds is None:
+        return "ETA unknown"
+    if seconds >= 60:
+        return f"ETA {seconds / 60:.1f} min"
+    return f"ETA {seconds:.0f}s"
@@ -0,0 +1,430 @@
+"""Download -> transcode pipeline with a background pool of ffmpeg workers.
+
+Finished downloads are queued for transcoding and the caller moves straight on
+to the next download, so the network and the CPU stay busy at the same time.
+Each stage keeps queue-depth and latency metrics.
+"""
+
+import os
+import queue
+import subprocess
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any
+
+from instrumentation import STAGES, StageRecord
+from postprocess_planner import AAC_ARGS
+from segmented_transcode import SegmentedTranscodeError, transcode_in_segments
+
+# No limit: a -q:a 0 MP3 of a multi-hour recording legitimately takes many
+# minutes. Callers that want one set TranscodeJob.timeout.
+DEFAULT_TRANSCODE_TIMEOUT: float | None = None
+_LATENCY_WINDOW = 1000
+MP3_ARGS = ["-acodec", "libmp3lame", "-q:a", "0"]
+
+
+def build_mp3_command(ffmpeg_path: str, source_path: str, mp3_path: str) -> list[str]:
+    """VBR MP3 at the highest LAME quality (~245 kbps)."""
+    return [ffmpeg_path, "-y", "-i", source_path, *MP3_ARGS, mp3_path]
+
+
+def build_aac_command(ffmpeg_path: str, source_path: str, aac_path: str) -> list[str]:
+    """Copy the video stream and re-encode the audio to 192k AAC."""
+    return [ffmpeg_path, "-y", "-i", source_path, "-c:v", "copy", *AAC_ARGS, aac_path]
+
+
+def mp3_output_path(file_path: str) -> str:
+    return os.path.splitext(file_path)[0] + ".mp3"
+
+
+def aac_output_path(file_path: str) -> str:
+    root, ext = os.path.splitext(file_path)
+    return f"{root}_aac{ext}"
+
+
+def partial_output_path(output_path: str) -> str:
+    # Keep the extension so ffmpeg still picks the right muxer.
+    root, ext = os.path.splitext(output_path)
+    return f"{root}.part{ext}"
+
+
+@dataclass
+class TranscodeJob:
+    """One ffmpeg run; output replaces the source when replace_source is set.
+
+    With segments > 1 and audio_args (the encoder options in command), long
+    inputs are encoded as up to that many parallel segments instead, copying
+    the video across when keep_video is set; see segmented_transcode.
+    """
+
+    command: list[str]
+    source_path: str
+    output_path: str
+    replace_source: bool = False
+    remove_source: bool = False
+    timeout: float | None = DEFAULT_TRANSCODE_TIMEOUT
+    segments: int = 1
+    audio_args: list[str] | None = None
+    keep_video: bool = False
+
+
+def _partial_command(job: TranscodeJob) -> tuple[list[str], str | None]:
+    """job.command writing to a partial file, and that file's path.
+
+    The output only appears under its real name once ffmpeg has finished,
+    so nothing (e.g. the download cache) ever sees a half-written file.
+    """
+    if job.command[-1] != job.output_path:
+        return job.command, None
+    part_path = partial_output_path(job.output_path)
+    return [*job.command[:-1], part_path], part_path
+
+
+def _discard(part_path: str | None) -> None:
+    if part_path:
+        try:
+            os.remove(part_path)
+        except OSError:
+            pass
+
+
+@dataclass
+class TranscodeResult:
+    output_path: str | None
+    error: str | None = None
+    wait_seconds: float = 0.0
+    run_seconds: float = 0.0
+    # Parallel segments the output was encoded in (1: a single ffmpeg pass).
+    segments: int = 1
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def _percentile(values: list[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+@dataclass
+class StageMetrics:
+    """Thread-safe queue-depth and latency counters for one pipeline stage."""
+
+    name: str
+    queued: int = 0
+    active: int = 0
+    completed: int = 0
+    failed: int = 0
+    max_queue_depth: int = 0
+    wait_seconds: deque = field(default_factory=lambda: deque(maxlen=_LATENCY_WINDOW))
+    run_seconds: deque = field(default_factory=lambda: deque(maxlen=_LATENCY_WINDOW))
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def on_enqueue(self) -> None:
+        with self._lock:
+            self.queued += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.queued)
+
+    def on_start(self, wait_seconds: float) -> None:
+        with self._lock:
+            self.queued -= 1
+            self.active += 1
+            self.wait_seconds.append(wait_seconds)
+
+    def on_finish(self, run_seconds: float, ok: bool) -> None:
+        with self._lock:
+            self.active -= 1
+            self.run_seconds.append(run_seconds)
+            if ok:
+                self.completed += 1
+            else:
+                self.failed += 1
+
+    def snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            waits = list(self.wait_seconds)
+            runs = list(self.run_seconds)
+            return {
+                "stage": self.name,
+                "queue_depth": self.queued,
+                "max_queue_depth": self.max_queue_depth,
+                "active": self.active,
+                "completed": self.completed,
+                "failed": self.failed,
+                "wait_avg_s": sum(waits) / len(waits) if waits else 0.0,
+                "wait_p95_s": _percentile(waits, 0.95),
+                "run_avg_s": sum(runs) / len(runs) if runs else 0.0,
+                "run_p95_s": _percentile(runs, 0.95),
+            }
+
+    def summary(self) -> str:
+        snap = self.snapshot()
+        return (
+            f"{snap['stage']}: {snap['completed']} ok, {snap['failed']} failed, "
+            f"max queue {snap['max_queue_depth']}, "
+            f"wait avg {snap['wait_avg_s']:.1f}s / p95 {snap['wait_p95_s']:.1f}s, "
+            f"run avg {snap['run_avg_s']:.1f}s / p95 {snap['run_p95_s']:.1f}s"
+        )
+
+
+def record_transcode(job: TranscodeJob, result: TranscodeResult) -> TranscodeResult:
+    """Log a finished job as a "transcode" stage and return the result."""
+    size = 0
+    if result.output_path:
+        try:
+            size = os.path.getsize(result.output_path)
+        except OSError:
+            pass
+    STAGES.record(
+        StageRecord(
+            stage="transcode",
+            seconds=result.run_seconds,
+            ok=result.ok,
+            bytes=size,
+            detail=os.path.basename(job.output_path),
+            error=result.error,
+        )
+    )
+    return result
+
+
+def run_transcode(job: TranscodeJob) -> TranscodeResult:
+    """Run one ffmpeg job in the calling thread."""
+    return record_transcode(job, _run_transcode(job))
+
+
+def _run_transcode(job: TranscodeJob) -> TranscodeResult:
+    start = time.perf_counter()
+    if job.segments > 1 and job.audio_args:
+        segments = _run_segmented(job)
+        if segments:
+            return _finished(job, None, time.perf_counter() - start, segments)
+    command, part_path = _partial_command(job)
+    try:
+        completed = subprocess.run(
+            command,
+            capture_output=True,
+            text=True,
+            timeout=job.timeout,
+        )
+    except subprocess.TimeoutExpired:
+        _discard(part_path)
+        return TranscodeResult(
+            None,
+            error=f"ffmpeg timed out after {job.timeout:g}s",
+            run_seconds=time.perf_counter() - start,
+        )
+    except OSError as exc:
+        return TranscodeResult(
+            None, error=str(exc), run_seconds=time.perf_counter() - start
+        )
+    elapsed = time.perf_counter() - start
+    if completed.returncode != 0:
+        _discard(part_path)
+        return TranscodeResult(
+            None,
+            error=completed.stderr.strip()[-500:] or "(no stderr output)",
+            run_seconds=elapsed,
+        )
+    return _finished(job, part_path, elapsed)
+
+
+def _run_segmented(job: TranscodeJob) -> int:
+    """Segments written, or 0 to run job.command as a single pass instead."""
+    start = time.perf_counter()
+    try:
+        return transcode_in_segments(
+            job.command[0],
+            job.source_path,
+            job.output_path,
+            job.audio_args or [],
+            job.segments,
+            keep_video=job.keep_video,
+            timeout=job.timeout,
+        )
+    except SegmentedTranscodeError as exc:
+        # Logged so fallbacks show up in the stage timings.
+        STAGES.record(
+            StageRecord(
+                stage="transcode_segments",
+                seconds=time.perf_counter() - start,
+                ok=False,
+                detail=os.path.basename(job.output_path),
+                error=str(exc),
+            )
+        )
+        return 0
+
+
+async def run_transcode_async(job: TranscodeJob) -> TranscodeResult:
+    """Run one ffmpeg job as an asyncio subprocess.
+
+    On timeout or cancellation ffmpeg is killed and reaped before returning
+    (or re-raising CancelledError), so no process outlives its task.
+    """
+    return record_transcode(job, await _run_transcode_async(job))
+
+
+async def _run_transcode_async(job: TranscodeJob) -> TranscodeResult:
+    # Only the async orchestrator needs asyncio; keep it off the CLI's startup.
+    import asyncio
+
+    start = time.perf_counter()
+    command, part_path = _partial_command(job)
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *command,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+        )
+    except OSError as exc:
+        return TranscodeResult(
+            None, error=str(exc), run_seconds=time.perf_counter() - start
+        )
+    try:
+        async with asyncio.timeout(job.timeout):
+            _, stderr = await process.communicate()
+    except (TimeoutError, asyncio.CancelledError) as exc:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        _discard(part_path)
+        if isinstance(exc, asyncio.CancelledError):
+            raise
+        return TranscodeResult(
+            None,
+            error=f"ffmpeg timed out after {job.timeout:g}s",
+            run_seconds=time.perf_counter() - start,
+        )
+    elapsed = time.perf_counter() - start
+    if process.returncode != 0:
+        message = stderr.decode("utf-8", "replace").strip()[-500:]
+        _discard(part_path)
+        return TranscodeResult(
+            None, error=message or "(no stderr output)", run_seconds=elapsed
+        )
+    return _finished(job, part_path, elapsed)
+
+
+def finish_outputs(job: TranscodeJob, part_path: str | None = None) -> str:
+    """Publish the output and return the final path.
+
+    Moves part_path (if ffmpeg wrote to one) into place, then applies
+    replace_source / remove_source. Raises OSError if the output can't be
+    moved; removing the source is best-effort, as the output is already in
+    place by then.
+    """
+    if job.replace_source:
+        os.replace(part_path or job.output_path, job.source_path)
+        return job.source_path
+    if part_path:
+        os.replace(part_path, job.output_path)
+    if job.remove_source:
+        try:
+            os.remove(job.source_path)
+        except OSError as exc:
+            # Logged so a leftover source shows up in the stage timings.
+            STAGES.record(
+                StageRecord(
+                    stage="remove_source",
+                    seconds=0.0,
+                    ok=False,
+                    detail=os.path.basename(job.source_path),
+                    error=str(exc),
+                )
+            )
+    return job.output_path
+
+
+def _finished(
+    job: TranscodeJob, part_path: str | None, run_seconds: float, segments: int = 1
+) -> TranscodeResult:
+    """Result for a successful ffmpeg run, failed if its output can't be placed."""
+    try:
+        output_path = finish_outputs(job, part_path)
+    except OSError as exc:
+        _discard(part_path)
+        return TranscodeResult(
+            None,
+            error=f"could not publish the output: {exc}",
+            run_seconds=run_seconds,
+            segments=segments,
+        )
+    return TranscodeResult(output_path, run_seconds=run_seconds, segments=segments)
+
+
+class TranscodePipeline:
+    """A queue of TranscodeJobs served by a fixed pool of worker threads.
+
+    Each worker blocks on one ffmpeg subprocess at a time, so the pool size is
+    the number of concurrent ffmpeg processes; it defaults to the core count.
+    """
+
+    def __init__(self, workers: int | None = None) -> None:
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.download_metrics = StageMetrics("download")
+        self.transcode_metrics = StageMetrics("transcode")
+        self._queue: queue.Queue[tuple[TranscodeJob, Future, float] | None] = (
+            queue.Queue()
+        )
+        self._threads = [
+            threading.Thread(
+                target=self._worker, name=f"transcode-{index}", daemon=True
+            )
+            for index in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, job: TranscodeJob) -> "Future[TranscodeResult]":
+        future: Future[TranscodeResult] = Future()
+        self.transcode_metrics.on_enqueue()
+        self._queue.put((job, future, time.perf_counter()))
+        return future
+
+    def metrics(self) -> dict[str, dict[str, Any]]:
+        return {
+            "download": self.download_metrics.snapshot(),
+            "transcode": self.transcode_metrics.snapshot(),
+        }
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Finish the queued jobs, then stop the workers."""
+        for _ in self._threads:
+            self._queue.put(None)
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def _worker(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            job, future, enqueued_at = item
+            wait_seconds = time.perf_counter() - enqueued_at
+            self.transcode_metrics.on_start(wait_seconds)
+            if not future.set_running_or_notify_cancel():
+                self.transcode_metrics.on_finish(0.0, ok=False)
+                continue
+            start = time.perf_counter()
+            try:
+                result = run_transcode(job)
+            except Exception as exc:
+                # Resolve the future anyway, or its caller waits forever.
+                self.transcode_metrics.on_finish(
+                    time.perf_counter() - start, ok=False
+                )
+                future.set_exception(exc)
+                continue
+            result.wait_seconds = wait_seconds
+            self.transcode_metrics.on_finish(result.run_seconds, result.ok)
+            future.set_result(result)
@@ -0,0 +1,148 @@
+"""Pool of long-lived YoutubeDL instances, reused across jobs.
+
+Building a YoutubeDL and throwing it away after one job also throws away its
+HTTP connections, cookies and the extractors it has loaded. The pool keeps
+idle instances keyed by their options (hooks aside), so the next job with
+the same options checks out a warm one. Each instance serves one job at a
+time. The job's progress and postprocessor hooks are attached on checkout and
+removed on return. An instance whose job raised is closed instead of reused,
+because yt-dlp may have been interrupted mid-download.
+"""
+
+import json
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator
+
+# Idle instances kept across all option profiles.
+DEFAULT_MAX_IDLE = 8
+# Idle instances older than this are closed rather than reused, so stale
+# connections and cookies don't linger.
+DEFAULT_MAX_IDLE_SECONDS = 300.0
+# Options that belong to one job and are attached per checkout.
+HOOK_OPTIONS = ("progress_hooks", "postprocessor_hooks")
+
+
+def _profile(options: dict[str, Any]) -> dict[str, Any]:
+    return {name: value for name, value in options.items() if name not in HOOK_OPTIONS}
+
+
+def profile_key(options: dict[str, Any]) -> str:
+    """Stable key for options, ignoring the per-job hooks."""
+    return json.dumps(_profile(options), sort_keys=True, default=repr)
+
+
+def _attach_hooks(ydl: Any, progress_hooks: list, postprocessor_hooks: list) -> None:
+    for hook in progress_hooks:
+        ydl.add_progress_hook(hook)
+    for hook in postprocessor_hooks:
+        ydl.add_postprocessor_hook(hook)
+
+
+def _detach_hooks(ydl: Any, progress_hooks: list, postprocessor_hooks: list) -> None:
+    # yt-dlp has no public way to remove hooks. They live on the instance and
+    # on every postprocessor it has registered.
+    for hook in progress_hooks:
+        if hook in ydl._progress_hooks:
+            ydl._progress_hooks.remove(hook)
+    for hook in postprocessor_hooks:
+        if hook in ydl._postprocessor_hooks:
+            ydl._postprocessor_hooks.remove(hook)
+        for pps in ydl._pps.values():
+            for pp in pps:
+                if hook in pp._progress_hooks:
+                    pp._progress_hooks.remove(hook)
+
+
+class YoutubeDLPool:
+    """Thread-safe checkout of YoutubeDL instances by option profile."""
+
+    def __init__(
+        self,
+        max_idle: int = DEFAULT_MAX_IDLE,
+        max_idle_seconds: float = DEFAULT_MAX_IDLE_SECONDS,
+    ) -> None:
+        self.max_idle = max_idle
+        self.max_idle_seconds = max_idle_seconds
+        self.created = 0
+        self.reused = 0
+        self._lock = threading.Lock()
+        # Idle instances as (profile key, returned at, instance), oldest first.
+        self._idle: list[tuple[str, float, Any]] = []
+
+    @contextmanager
+    def session(self, options: dict[str, Any]) -> Iterator[Any]:
+        """Check out a YoutubeDL for options, with its hooks attached.
+
+        Use it like `with YoutubeDL(options) as ydl`.
+        """
+        key = profile_key(options)
+        progress_hooks = list(options.get("progress_hooks") or [])
+        postprocessor_hooks = list(options.get("postprocessor_hooks") or [])
+        ydl = self._checkout(key, options)
+        _attach_hooks(ydl, progress_hooks, postprocessor_hooks)
+        try:
+            yield ydl
+        except BaseException:
+            _close(ydl)
+            raise
+        _detach_hooks(ydl, progress_hooks, postprocessor_hooks)
+        self._return(key, ydl)
+
+    def _checkout(self, key: str, options: dict[str, Any]) -> Any:
+        expired = []
+        found = None
+        now = time.monotonic()
+        with self._lock:
+            for entry in list(self._idle):
+                if now - entry[1] > self.max_idle_seconds:
+                    self._idle.remove(entry)
+                    expired.append(entry[2])
+            # Most recently returned first: its connections are the warmest.
+            for entry in reversed(self._idle):
+                if entry[0] == key:
+                    self._idle.remove(entry)
+                    found = entry[2]
+                    self.reused += 1
+                    break
+            else:
+                self.created += 1
+        for ydl in expired:
+            _close(ydl)
+        if found is not None:
+            return found
+        from yt_dlp import YoutubeDL
+
+        return YoutubeDL(_profile(options))
+
+    def _return(self, key: str, ydl: Any) -> None:
+        evicted = []
+        with self._lock:
+            self._idle.append((key, time.monotonic(), ydl))
+            while len(self._idle) > self.max_idle:
+                evicted.append(self._idle.pop(0)[2])
+        for old in evicted:
+            _close(old)
+
+    def clear(self) -> None:
+        """Close every idle instance."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for _, _, ydl in idle:
+            _close(ydl)
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "created": self.created,
+                "reused": self.reused,
+                "idle": len(self._idle),
+            }
+
+
+def _close(ydl: Any) -> None:
+    try:
+        ydl.close()
+    except Exception:
+        pass
@@ -1,59 +1,74 @@
+import argparse
 import json
 import os
 import shutil
-import subprocess
+import sys
+import threading
 import time
-import urllib.request
+from collections.abc import Sized
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Iterable
 
-from yt_dlp import YoutubeDL
+from bandwidth_scheduler import PRIORITY_BULK, PRIORITY_INTERACTIVE, SCHEDULER
+from download_archive import (
+    EVICT_LRU,
+    EVICTION_POLICIES,
+    DownloadArchive,
+    archive_kind,
+)
+from format_selector import WindowBudget, describe_plan, select_format
+from info_cache import InfoCache, extract_info_cached
+from instrumentation import STAGES, StageHooks
+from playlist_ingest import DEFAULT_PREFETCH, PlaylistEntries
+from postprocess_planner import (
+    AAC_ARGS,
+    PostprocessPlan,
+    plan_aac_postprocessing,
+    plan_from_probe,
+    probe_media,
+)
+from progress_reporter import ProgressThrottle
+from segmented_download import download_selected_format
+from segmented_transcode import ffprobe_for
+from speed_test import (
+    DEFAULT_SPEED_TEST_URL,
+    SpeedHistory,
+    format_result,
+    run_speed_test,
+)
+from stream_transcode import StreamTranscodeError, is_mp3, stream_selected_to_mp3
+from throughput import BandwidthEstimator, ThroughputMonitor, format_eta
+from transcode_pipeline import (
+    MP3_ARGS,
+    TranscodeJob,
+    TranscodePipeline,
+    TranscodeResult,
+    aac_output_path,
+    build_aac_command,
+    build_mp3_command,
+    mp3_output_path,
+    run_transcode,
+)
+from ydl_pool import YoutubeDLPool
 
-DEFAULT_SPEED_TEST_URL = "http://ipv4.download.thinkbroadband.com/10MB.zip"
-MAX_TEST_BYTES = 5 * 1024 * 1024
-SPEED_CACHE_PATH = os.path.join("downloads", ".speed_cache.json")
+# yt_dlp (a few hundred ms to import) and other heavy modules are imported
+# where they are first used, so --help and short batch runs start quickly.
+DEFAULT_BATCH_WORKERS = 4
+DEFAULT_BATCH_RETRIES = 2
+INFO_CACHE = InfoCache()
+ARCHIVE = DownloadArchive()
+BANDWIDTH = BandwidthEstimator()
+SPEED_HISTORY = SpeedHistory()
+YDL_POOL = YoutubeDLPool()
 
+_print_lock = threading.Lock()
 
-def measure_download_speed(test_url: str, max_bytes: int) -> float:
-    start = time.perf_counter()
-    downloaded = 0
-    with urllib.request.urlopen(test_url, timeout=20) as response:
-        while downloaded < max_bytes:
-            chunk = response.read(min(256 * 1024, max_bytes - downloaded))
-            if not chunk:
-                break
-            downloaded += len(chunk)
-    elapsed = time.perf_counter() - start
-    if elapsed <= 0 or downloaded <= 0:
-        raise RuntimeError("Speed test failed.")
-    return (downloaded * 8) / (elapsed * 1_000_000)
-
-
-def load_cached_speed() -> float | None:
-    os.makedirs(os.path.dirname(SPEED_CACHE_PATH), exist_ok=True)
-    if not os.path.exists(SPEED_CACHE_PATH):
-        return None
-    try:
-        with open(SPEED_CACHE_PATH, "r", encoding="utf-8") as handle:
-            data = json.load(handle)
-        speed = float(data.get("speed_mbps"))
-        if speed <= 0:
-            return None
-        return speed
-    except (OSError, ValueError, TypeError, json.JSONDecodeError):
-        return None
 
-
-def save_cached_speed(speed_mbps: float) -> None:
-    os.makedirs(os.path.dirname(SPEED_CACHE_PATH), exist_ok=True)
-    try:
-        with open(SPEED_CACHE_PATH, "w", encoding="utf-8") as handle:
-            json.dump({"speed_mbps": speed_mbps}, handle)
-    except OSError:
-        pass
-
-
-def resolve_ffmpeg_path() -> str | None:
+def resolve_ffmpeg_path(interactive: bool = False) -> str | None:
+    """ffmpeg on PATH; if missing and interactive, ask for its location."""
     ffmpeg_path = shutil.which("ffmpeg")
-    if ffmpeg_path:
+    if ffmpeg_path or not interactive:
         return ffmpeg_path
     manual_path = input(
         "ffmpeg not found. Enter full path to ffmpeg.exe (Enter to skip): "
@@ -91,25 +106,111 @@ def create_ytdlp_config(js_runtime_path: str | None) -> None:
         print(f"Warning: Could not write yt-dlp config: {e}")
 
 
-def download_with_ytdlp_api(url: str, format_selector: str, outtmpl: str) -> str | None:
-    """Download using YoutubeDL API with merged output."""
-    ydl_opts = {
+def ydl_download(
+    url: str,
+    format_selector: str,
+    outtmpl: str,
+    progress_hooks: list[Callable[[dict[str, Any]], None]] | None = None,
+    quiet: bool = False,
+    extra_opts: dict[str, Any] | None = None,
+    connections: int = 1,
+    monitor: ThroughputMonitor | None = None,
+    priority: str = PRIORITY_INTERACTIVE,
+    stream_mp3_ffmpeg: str | None = None,
+) -> str:
+    """Download one URL with YoutubeDL and return the output path; raises on failure.
+
+    Throughput is always measured through a ThroughputMonitor (pass one in to
+    read its live rate and ETA from another hook). The transfer shares the
+    process-wide bandwidth limits at the given priority.
+
+    With connections > 1, plain HTTP formats are fetched as parallel resumable
+    byte ranges and fragmented (DASH/HLS) ones with concurrent fragments.
+
+    With stream_mp3_ffmpeg (an ffmpeg path), a plain HTTP audio format is
+    piped straight into ffmpeg and the returned path is the MP3; if that
+    isn't possible the original format is downloaded as usual.
+    """
+    monitor = monitor or ThroughputMonitor(BANDWIDTH)
+    stage_hooks = StageHooks(url)
+    hooks = [monitor, stage_hooks.progress_hook, *(progress_hooks or [])]
+    bandwidth_job = SCHEDULER.job(priority)
+    ydl_opts: dict[str, Any] = {
         "format": format_selector,
         "outtmpl": outtmpl,
         "noplaylist": True,
-        "quiet": False,
+        "quiet": quiet,
+        "progress_hooks": [*hooks, bandwidth_job.progress_hook],
+        "postprocessor_hooks": [stage_hooks.postprocessor_hook],
     }
+    if progress_hooks:
+        ydl_opts["noprogress"] = True
 
     # Only enable merge_output_format if format selector contains '+' (merging requirement)
     if "+" in format_selector:
         ydl_opts["merge_output_format"] = "mp4"
+    if connections > 1:
+        ydl_opts["concurrent_fragment_downloads"] = connections
+    if extra_opts:
+        ydl_opts.update(extra_opts)
+
+    with bandwidth_job, YDL_POOL.session(ydl_opts) as ydl:
+        # Extract first (filling the info cache) so extraction is timed on its
+        # own; the download below re-processes the cached info.
+        with STAGES.stage("extract", stage_hooks.job, url):
+            selected = extract_info_cached(ydl, url, INFO_CACHE)
+
+        def forward_hook(data: dict[str, Any]) -> None:
+            # Bandwidth is charged per chunk by our own transfers.
+            for hook in hooks:
+                hook(data)
+
+        if stream_mp3_ffmpeg and "postprocessors" not in ydl_opts:
+            try:
+                mp3_path = stream_selected_to_mp3(
+                    ydl,
+                    selected,
+                    stream_mp3_ffmpeg,
+                    forward_hook,
+                    bandwidth_job.consume,
+                )
+            except StreamTranscodeError as exc:
+                ydl.report_warning(f"Streaming to MP3 failed, downloading first: {exc}")
+                mp3_path = None
+            if mp3_path:
+                return mp3_path
+        # Segmented downloads bypass yt-dlp's postprocessors, so only use them
+        # when there are none to run.
+        if connections > 1 and "postprocessors" not in ydl_opts:
+            file_path = download_selected_format(
+                ydl, selected, connections, forward_hook, bandwidth_job.consume
+            )
+            if file_path:
+                return file_path
+        result = extract_info_cached(ydl, url, INFO_CACHE, download=True)
+        if not result:
+            raise RuntimeError("yt-dlp returned no result.")
+        # Postprocessors (e.g. a remux) may have changed the final path.
+        downloads = result.get("requested_downloads") or [{}]
+        return downloads[-1].get("filepath") or ydl.prepare_filename(result)
 
+
+def download_with_ytdlp_api(
+    url: str,
+    format_selector: str,
+    outtmpl: str,
+    extra_opts: dict[str, Any] | None = None,
+    connections: int = 1,
+) -> str | None:
+    """Download using YoutubeDL API with merged output."""
     try:
-        with YoutubeDL(ydl_opts) as ydl:
-            result = ydl.extract_info(url, download=True)
-            if result:
-                return ydl.prepare_filename(result)
-        return None
+        return ydl_download(
+            url,
+            format_selector,
+            outtmpl,
+            extra_opts=extra_opts,
+            connections=connections,
+        )
     except Exception as e:
         print(f"Download error: {e}")
         return None
@@ -122,25 +223,579 @@ def extract_info_with_ytdlp_api(url: str) -> dict:
         "quiet": True,
     }
 
+    with STAGES.stage("extract", url=url) as span:
+        try:
+            with YDL_POOL.session(ydl_opts) as ydl:
+                return extract_info_cached(ydl, url, INFO_CACHE)
+        except Exception as e:
+            span.fail(str(e))
+            print(f"Extract info error: {e}")
+            return {}
+
+
+def plan_aac_for(
+    url: str, format_selector: str, ffmpeg_path: str | None
+) -> PostprocessPlan:
+    """Plan the AAC step from the formats format_selector picks for url.
+
+    Selection runs on the cached info dict, so this costs no extra extraction.
+    """
+    ydl_opts = {"format": format_selector, "noplaylist": True, "quiet": True}
     try:
-        with YoutubeDL(ydl_opts) as ydl:
-            return ydl.extract_info(url, download=False)
-    except Exception as e:
-        print(f"Extract info error: {e}")
-        return {}
+        with YDL_POOL.session(ydl_opts) as ydl:
+            selected = extract_info_cached(ydl, url, INFO_CACHE)
+    except Exception:
+        return PostprocessPlan("probe", "could not resolve the selected formats")
+    return plan_aac_postprocessing(selected, ffmpeg_path)
 
 
-url = input("Enter the YouTube video URL: ")
+def current_bandwidth_mbps() -> float | None:
+    """Passive estimate from real downloads, else the speed-test history."""
+    return BANDWIDTH.estimate_mbps() or SPEED_HISTORY.smoothed_mbps()
 
-try:
-    download_type = (
-        input("Download type (video/audio, Enter for video): ").strip().lower()
+
+def format_cache_stats(stats: dict[str, Any]) -> str:
+    budget = (
+        f"{stats['max_bytes'] / 1024**3:.1f} GB ({stats['policy']})"
+        if stats["max_bytes"]
+        else "no limit"
+    )
+    hit_rate = f"{stats['hit_rate']:.0%}" if stats["hit_rate"] is not None else "n/a"
+    return (
+        f"Download cache: {stats['files']} files, "
+        f"{stats['bytes'] / 1024**2:.1f} MB, budget {budget}; "
+        f"{stats['hits']} hits, {stats['misses']} misses ({hit_rate}); "
+        f"{stats['evictions']} evicted ({stats['evicted_bytes'] / 1024**2:.1f} MB)"
+    )
+
+
+def archive_download(url: str, kind: str, format_selector: str, path: str) -> None:
+    try:
+        ARCHIVE.record(url, kind, format_selector, path)
+    except Exception as exc:
+        print(f"Warning: could not record {path} in the download archive: {exc}")
+
+
+def reencode_aac_after_probe(
+    file_path: str, ffmpeg_path: str, segments: int = 1
+) -> str | None:
+    """Fallback for unknown codecs: probe once, re-encode only if needed.
+
+    Returns an error message, or None on success or when nothing was needed.
+    With segments > 1, long files are encoded in that many parallel segments.
+    The ffprobe next to ffmpeg_path is used; if the probe fails, the audio is
+    re-encoded anyway.
+    """
+    plan = plan_from_probe(probe_media(file_path, ffprobe_for(ffmpeg_path)))
+    print(f"AAC audio after probe: {plan.action} ({plan.reason})")
+    if plan.action != "reencode":
+        return None
+    aac_path = aac_output_path(file_path)
+    outcome = run_transcode(
+        TranscodeJob(
+            build_aac_command(ffmpeg_path, file_path, aac_path),
+            file_path,
+            aac_path,
+            replace_source=True,
+            segments=segments,
+            audio_args=AAC_ARGS,
+            keep_video=True,
+        )
     )
-    if download_type and download_type not in {"video", "audio"}:
-        raise RuntimeError("Invalid download type. Use 'video' or 'audio'.")
-    output_dir = "downloads"
+    return outcome.error
+
+
+@dataclass
+class BatchResult:
+    """Outcome of one URL in a batch run."""
+
+    index: int
+    url: str
+    file_path: str | None = None
+    attempts: int = 0
+    elapsed: float = 0.0
+    error: str | None = None
+    postprocess: str | None = None
+    selected_format: str | None = None
+    skipped: bool = False
+    transcode_error: str | None = None
+    transcode_seconds: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.file_path is not None and self.transcode_error is None
+
+
+def log_line(message: str) -> None:
+    """Print from worker threads without interleaving lines."""
+    with _print_lock:
+        print(message, flush=True)
+
+
+def read_batch_urls(source: str) -> list[str]:
+    """Read URLs from a file, or from stdin when source is '-'.
+
+    Blank lines and lines starting with '#' are ignored.
+    """
+    if source == "-":
+        lines: Iterable[str] = sys.stdin.read().splitlines()
+    else:
+        with open(source, "r", encoding="utf-8") as handle:
+            lines = handle.read().splitlines()
+    return [
+        line.strip()
+        for line in lines
+        if line.strip() and not line.strip().startswith("#")
+    ]
+
+
+def make_batch_progress_hook(
+    index: int, monitor: ThroughputMonitor
+) -> Callable[[dict[str, Any]], None]:
+    """Return a hook that logs each job's progress and ETA in 10% steps.
+
+    Callbacks are coalesced to a few per second before the step check.
+    """
+    last_step = -1
+
+    def hook(data: dict[str, Any]) -> None:
+        nonlocal last_step
+        if data.get("status") == "downloading":
+            total = data.get("total_bytes") or data.get("total_bytes_estimate")
+            downloaded = data.get("downloaded_bytes")
+            if total and downloaded:
+                step = min(int(downloaded / total * 10), 10)
+                if step > last_step:
+                    last_step = step
+                    rate = (
+                        f"{monitor.live_mbps:.1f} Mbps, " if monitor.live_mbps else ""
+                    )
+                    log_line(
+                        f"[{index}] {step * 10}% ({rate}{format_eta(monitor.eta_seconds)})"
+                    )
+        elif data.get("status") == "finished":
+            log_line(f"[{index}] Download finished. Processing...")
+
+    return ProgressThrottle(hook)
+
+
+def make_cancel_hook(cancel: threading.Event) -> Callable[[dict[str, Any]], None]:
+    """Progress hook that aborts the download once cancel is set."""
+
+    def hook(data: dict[str, Any]) -> None:
+        if cancel.is_set():
+            from yt_dlp.utils import DownloadCancelled
+
+            raise DownloadCancelled("Download cancelled")
+
+    return hook
+
+
+def download_batch_item(
+    index: int,
+    url: str,
+    format_selector: str,
+    output_dir: str,
+    retries: int,
+    aac: bool = False,
+    connections: int = 1,
+    download_type: str = "video",
+    budget: WindowBudget | None = None,
+    max_bytes: int | None = None,
+    speed_mbps: float | None = None,
+    cancel: threading.Event | None = None,
+    stream_mp3_ffmpeg: str | None = None,
+    archive: DownloadArchive | None = None,
+    kind: str = "video",
+) -> BatchResult:
+    """Download one batch URL, retrying with exponential backoff.
+
+    With a window budget or max_bytes, the best format that fits this job's
+    share is picked instead of format_selector. With an archive, a file
+    already recorded for kind and the resulting selector is returned as a
+    skipped result. With aac set, the AAC step is planned up front and folded
+    into the download's own postprocessing where possible. Setting cancel
+    aborts the download at its next progress update and raises
+    DownloadCancelled. stream_mp3_ffmpeg is passed to ydl_download.
+    """
+    from yt_dlp.utils import DownloadCancelled
+
+    result = BatchResult(index=index, url=url)
+    outtmpl = os.path.join(output_dir, "%(title)s [%(id)s].%(ext)s")
+    start = time.perf_counter()
+    if budget or max_bytes:
+        format_plan = select_format(
+            extract_info_with_ytdlp_api(url),
+            download_type,
+            speed_mbps or current_bandwidth_mbps(),
+            budget.job_deadline() if budget else None,
+            max_bytes,
+        )
+        if format_plan:
+            format_selector = format_plan.format_selector
+            log_line(f"[{index}] Auto format: {describe_plan(format_plan)}")
+    result.selected_format = format_selector
+    entry = archive.find(url, kind, format_selector) if archive else None
+    if entry:
+        log_line(f"[{index}] Already downloaded: {entry.path}")
+        result.file_path = entry.path
+        result.skipped = True
+        result.elapsed = time.perf_counter() - start
+        return result
+    extra_opts = None
+    if aac:
+        plan = plan_aac_for(url, format_selector, shutil.which("ffmpeg"))
+        result.postprocess = plan.action
+        extra_opts = plan.ydl_opts
+    for attempt in range(1, retries + 2):
+        result.attempts = attempt
+        monitor = ThroughputMonitor(BANDWIDTH)
+        hooks = [make_batch_progress_hook(index, monitor)]
+        if cancel:
+            hooks.insert(0, make_cancel_hook(cancel))
+        try:
+            result.file_path = ydl_download(
+                url,
+                format_selector,
+                outtmpl,
+                progress_hooks=hooks,
+                monitor=monitor,
+                quiet=True,
+                extra_opts=extra_opts,
+                connections=connections,
+                priority=PRIORITY_BULK,
+                stream_mp3_ffmpeg=stream_mp3_ffmpeg,
+            )
+            result.error = None
+            break
+        except DownloadCancelled:
+            raise
+        except Exception as exc:
+            result.error = str(exc)
+            log_line(f"[{index}] Attempt {attempt} failed: {exc}")
+            if attempt <= retries:
+                delay = min(2 ** (attempt - 1), 30)
+                if cancel is None:
+                    time.sleep(delay)
+                elif cancel.wait(delay):
+                    raise DownloadCancelled(f"[{index}] Cancelled")
+    result.elapsed = time.perf_counter() - start
+    return result
+
+
+def make_transcode_job(
+    file_path: str, transcode: str, keep_source: bool, segments: int = 1
+) -> TranscodeJob | None:
+    """Build the ffmpeg job for 'mp3' or 'aac' post-processing of file_path.
+
+    AAC jobs are only needed when the codec was unknown before the download,
+    and then only if one probe shows the audio isn't AAC already. With
+    segments > 1, long files are encoded in that many parallel segments.
+    """
+    ffmpeg_path = shutil.which("ffmpeg")
+    if not ffmpeg_path:
+        return None
+    if transcode == "mp3":
+        mp3_path = mp3_output_path(file_path)
+        return TranscodeJob(
+            build_mp3_command(ffmpeg_path, file_path, mp3_path),
+            file_path,
+            mp3_path,
+            remove_source=not keep_source,
+            segments=segments,
+            audio_args=MP3_ARGS,
+        )
+    probe = probe_media(file_path, ffprobe_for(ffmpeg_path))
+    if plan_from_probe(probe).action != "reencode":
+        return None
+    aac_path = aac_output_path(file_path)
+    return TranscodeJob(
+        build_aac_command(ffmpeg_path, file_path, aac_path),
+        file_path,
+        aac_path,
+        replace_source=True,
+        segments=segments,
+        audio_args=AAC_ARGS,
+        keep_video=True,
+    )
+
+
+def run_batch(
+    urls: Iterable[str],
+    format_selector: str = "best",
+    output_dir: str = "downloads",
+    workers: int = DEFAULT_BATCH_WORKERS,
+    retries: int = DEFAULT_BATCH_RETRIES,
+    report_path: str | None = None,
+    transcode: str | None = None,
+    transcode_workers: int | None = None,
+    keep_source: bool = False,
+    connections: int = 1,
+    download_type: str = "video",
+    window_seconds: float | None = None,
+    max_bytes: int | None = None,
+    archive: DownloadArchive | None = None,
+    speed_mbps: float | None = None,
+    stream_mp3: bool = False,
+    transcode_segments: int = 1,
+) -> list[BatchResult]:
+    """Download many URLs with a bounded pool of worker threads.
+
+    With transcode set to 'mp3' or 'aac', each finished download is handed to
+    a TranscodePipeline and the download worker moves on to the next URL.
+    With window_seconds, formats are picked so the batch should finish
+    within that many seconds at the current bandwidth estimate. With
+    stream_mp3 (and mp3 without keep_source), audio is piped straight into
+    ffmpeg during the download where the format allows. transcode_segments
+    is passed to make_transcode_job.
+
+    urls may be a lazy iterable (e.g. PlaylistEntries): URLs are pulled only
+    as workers free up, so at most 2 x workers jobs are queued at a time.
+
+    With an archive, URLs already downloaded (same kind and format selector,
+    file still on disk) are skipped, and new downloads are recorded. Only
+    auto-selected formats need an extraction before the check.
+    """
     os.makedirs(output_dir, exist_ok=True)
+    budget = None
+    if isinstance(urls, Sized):
+        workers = max(1, min(workers, len(urls) or 1))
+        log_line(f"Downloading {len(urls)} URLs with {workers} workers...")
+        if window_seconds:
+            budget = WindowBudget(window_seconds, len(urls))
+    else:
+        workers = max(1, workers)
+        log_line(f"Downloading entries as they are found with {workers} workers...")
+        if window_seconds:
+            log_line("The window needs a known URL count; ignoring it.")
+    if budget and not (speed_mbps or current_bandwidth_mbps()):
+        log_line("No bandwidth estimate yet; the window can't limit format choice.")
+    pipeline = TranscodePipeline(transcode_workers)
+    if transcode and not shutil.which("ffmpeg"):
+        log_line("ffmpeg not found; skipping transcoding.")
+        transcode = None
+    kind = archive_kind(download_type, transcode)
+    stream_mp3_ffmpeg = None
+    if stream_mp3 and transcode == "mp3" and not keep_source:
+        stream_mp3_ffmpeg = shutil.which("ffmpeg")
+
+    def archive_result(result: BatchResult) -> None:
+        if not archive:
+            return
+        try:
+            archive.record(
+                result.url, kind, result.selected_format or "", result.file_path
+            )
+        except Exception as exc:
+            log_line(f"[{result.index}] Could not archive {result.file_path}: {exc}")
+
+    def tracked_download(index: int, url: str, enqueued_at: float) -> BatchResult:
+        pipeline.download_metrics.on_start(time.perf_counter() - enqueued_at)
+        result = download_batch_item(
+            index,
+            url,
+            format_selector,
+            output_dir,
+            retries,
+            aac=transcode == "aac",
+            connections=connections,
+            download_type=download_type,
+            budget=budget,
+            max_bytes=max_bytes,
+            speed_mbps=speed_mbps,
+            stream_mp3_ffmpeg=stream_mp3_ffmpeg,
+            archive=archive,
+            kind=kind,
+        )
+        if budget:
+            budget.job_done()
+        pipeline.download_metrics.on_finish(result.elapsed, result.ok)
+        if result.ok and not transcode and not result.skipped:
+            archive_result(result)
+        return result
+
+    results: list[BatchResult] = []
+    transcodes = {}
+    start = time.perf_counter()
+
+    def collect(done: set) -> None:
+        for future in done:
+            result = future.result()
+            results.append(result)
+            if result.skipped:
+                continue
+            if result.ok:
+                log_line(
+                    f"[{result.index}] Saved {result.file_path} "
+                    f"({result.elapsed:.1f}s, {result.attempts} attempt(s))"
+                )
+                needs_job = (transcode == "mp3" and not is_mp3(result.file_path)) or (
+                    transcode == "aac" and result.postprocess == "probe"
+                )
+                job = (
+                    make_transcode_job(
+                        result.file_path, transcode, keep_source, transcode_segments
+                    )
+                    if needs_job
+                    else None
+                )
+                if job:
+                    transcodes[result.index] = pipeline.submit(job)
+                elif transcode:
+                    archive_result(result)
+            else:
+                log_line(f"[{result.index}] Failed: {result.error}")
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending: set = set()
+        try:
+            for index, url in enumerate(urls, start=1):
+                pipeline.download_metrics.on_enqueue()
+                pending.add(
+                    executor.submit(tracked_download, index, url, time.perf_counter())
+                )
+                if len(pending) >= workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+        except Exception as exc:
+            # Keep what was already queued when enumeration fails part way.
+            log_line(f"Stopped reading URLs: {exc}")
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            collect(done)
+
+    for result in results:
+        if result.index not in transcodes:
+            continue
+        try:
+            outcome = transcodes[result.index].result()
+        except Exception as exc:
+            outcome = TranscodeResult(None, error=str(exc))
+        result.transcode_seconds = outcome.run_seconds
+        if outcome.ok:
+            result.file_path = outcome.output_path
+            log_line(f"[{result.index}] Transcoded to {outcome.output_path}")
+            archive_result(result)
+        else:
+            result.transcode_error = outcome.error
+            log_line(f"[{result.index}] Transcode failed: {outcome.error}")
+    pipeline.shutdown()
+    results.sort(key=lambda item: item.index)
+
+    elapsed = time.perf_counter() - start
+    succeeded = sum(1 for result in results if result.ok)
+    log_line(f"Batch complete: {succeeded}/{len(results)} succeeded in {elapsed:.1f}s")
+    skipped = sum(1 for result in results if result.skipped)
+    if skipped:
+        log_line(f"{skipped} already in the download archive")
+    log_line(pipeline.download_metrics.summary())
+    if transcodes:
+        log_line(pipeline.transcode_metrics.summary())
+    for line in STAGES.summary_lines():
+        log_line(f"stage {line}")
+    if report_path:
+        write_report(results, report_path)
+    return results
+
+
+def write_report(results: list[BatchResult], report_path: str) -> None:
+    """One JSON object per BatchResult, one per line."""
+    with open(report_path, "w", encoding="utf-8") as handle:
+        for result in results:
+            handle.write(json.dumps(asdict(result)) + "\n")
+    log_line(f"Batch report written to: {report_path}")
+
+
+@dataclass
+class SingleDownload:
+    """Options for one download, as set by CLI flags or interactive prompts.
+
+    format_selector wins over auto selection (deadline_seconds / max_bytes),
+    which wins over resolution. mp3 applies to audio, aac to video.
+    """
+
+    url: str
+    download_type: str = "video"
+    format_selector: str | None = None
+    resolution: int | None = None
+    filename: str | None = None
+    output_dir: str = "downloads"
+    speed_mbps: float | None = None
+    deadline_seconds: float | None = None
+    max_bytes: int | None = None
+    mp3: bool = False
+    keep_source: bool = True
+    aac: bool = False
+    connections: int = 1
+    skip_archived: bool = True
+    stream_mp3: bool = False
+    transcode_segments: int = 1
+
+
+def video_format_options(info: dict[str, Any]) -> list[dict[str, Any]]:
+    """MP4 video formats, combined ones when available, highest first."""
+    formats = [
+        fmt
+        for fmt in info.get("formats", [])
+        if fmt.get("vcodec") != "none" and fmt.get("ext") == "mp4"
+    ]
+    combined = [fmt for fmt in formats if fmt.get("acodec") != "none"]
+    options = combined or formats
+    options.sort(key=lambda fmt: fmt.get("height") or 0, reverse=True)
+    return options
+
+
+def audio_format_options(info: dict[str, Any]) -> list[dict[str, Any]]:
+    """Audio-only formats, highest bitrate first."""
+    formats = [fmt for fmt in info.get("formats", []) if fmt.get("vcodec") == "none"]
+    formats.sort(key=lambda fmt: fmt.get("abr") or fmt.get("tbr") or 0, reverse=True)
+    return formats
+
+
+def pick_resolution(
+    options: list[dict[str, Any]], height: int
+) -> dict[str, Any] | None:
+    """Highest option no taller than height, else the smallest there is."""
+    for fmt in options:
+        if (fmt.get("height") or 0) <= height:
+            return fmt
+    return options[-1] if options else None
+
+
+def format_size_bytes(fmt: dict[str, Any] | None) -> int:
+    if fmt is None:
+        return 0
+    return fmt.get("filesize") or fmt.get("filesize_approx") or 0
+
+
+def selector_for_format(fmt: dict[str, Any] | None, download_type: str) -> str:
+    """yt-dlp format selector for a chosen format (None means best)."""
+    if fmt is None:
+        return "best" if download_type == "video" else "bestaudio/best"
+    format_id = fmt.get("format_id")
+    if download_type == "video" and fmt.get("acodec") == "none":
+        # Video-only: merge in the best audio, or fall back to a combined format.
+        return f"{format_id}+bestaudio/best"
+    return format_id
+
+
+def selector_size_bytes(info: dict[str, Any], format_selector: str) -> int:
+    """Known size of the formats named by a selector like '137+140/best'."""
+    sizes = {
+        fmt.get("format_id"): format_size_bytes(fmt) for fmt in info.get("formats", [])
+    }
+    first_choice = format_selector.split("/")[0]
+    return sum(sizes.get(format_id) or 0 for format_id in first_choice.split("+"))
+
+
+def describe_download_time(size_bytes: int, speed_mbps: float) -> str:
+    seconds = (size_bytes * 8) / (speed_mbps * 1_000_000)
+    if seconds >= 60:
+        return f"Estimated download time: {seconds / 60:.1f} minutes"
+    return f"Estimated download time: {seconds:.0f} seconds"
+
 
+def configure_js_runtime() -> None:
     js_runtime = resolve_js_runtime()
     if not js_runtime:
         print("Info: No JS runtime found, using standard format selector.")
@@ -148,232 +803,632 @@ try:
         print(f"Using JS runtime: {js_runtime}")
         create_ytdlp_config(js_runtime)
 
-    info = extract_info_with_ytdlp_api(url)
 
-    if download_type == "audio":
-        formats = [
-            fmt for fmt in info.get("formats", []) if fmt.get("vcodec") == "none"
-        ]
-        if not formats:
-            raise RuntimeError("No audio-only streams found for this video.")
+def single_archive_kind(job: SingleDownload) -> str:
+    if job.download_type == "audio":
+        return archive_kind("audio", "mp3" if job.mp3 else None)
+    return archive_kind("video", "aac" if job.aac else None)
 
-        formats.sort(
-            key=lambda fmt: fmt.get("abr") or fmt.get("tbr") or 0, reverse=True
+
+def resolve_single_format(job: SingleDownload, info: dict[str, Any]) -> tuple[str, int]:
+    """Format selector for job and its known size in bytes (0 if unknown)."""
+    format_selector = job.format_selector
+    size_bytes = 0
+    if not format_selector and (job.deadline_seconds is not None or job.max_bytes):
+        auto_plan = select_format(
+            info,
+            job.download_type,
+            job.speed_mbps or current_bandwidth_mbps(),
+            job.deadline_seconds,
+            job.max_bytes,
         )
+        if auto_plan is None:
+            raise RuntimeError("No downloadable formats found for this video.")
+        print(f"Auto-selected format: {describe_plan(auto_plan)}")
+        format_selector = auto_plan.format_selector
+        size_bytes = auto_plan.size_bytes or 0
+    elif not format_selector:
+        chosen = None
+        if job.download_type == "video" and job.resolution:
+            chosen = pick_resolution(video_format_options(info), job.resolution)
+            if chosen is None:
+                raise RuntimeError("No compatible MP4 video stream found.")
+        elif job.download_type == "audio":
+            options = audio_format_options(info)
+            chosen = options[0] if options else None
+        format_selector = selector_for_format(chosen, job.download_type)
+    return format_selector, size_bytes or selector_size_bytes(info, format_selector)
+
+
+def find_archived(job: SingleDownload, format_selector: str) -> str | None:
+    """Path of the file job would produce with format_selector, if archived."""
+    existing = ARCHIVE.find(job.url, single_archive_kind(job), format_selector)
+    if existing:
+        print(f"Already downloaded: {existing.path}")
+        return existing.path
+    return None
+
+
+def run_single(job: SingleDownload, ffmpeg_path: str | None = None) -> str:
+    """Download one URL without prompting and return the final file path.
+
+    Raises on download failure. ffmpeg_path defaults to the one on PATH.
+    """
+    kind = single_archive_kind(job)
+    if job.skip_archived and job.format_selector:
+        # Known selector: the archive answers without a network round-trip.
+        existing = find_archived(job, job.format_selector)
+        if existing:
+            return existing
+    os.makedirs(job.output_dir, exist_ok=True)
+    info = extract_info_with_ytdlp_api(job.url)
+    format_selector, size_bytes = resolve_single_format(job, info)
+    if job.skip_archived and not job.format_selector:
+        existing = find_archived(job, format_selector)
+        if existing:
+            return existing
+
+    speed_mbps = job.speed_mbps or current_bandwidth_mbps()
+    if size_bytes and speed_mbps:
+        print(describe_download_time(size_bytes, speed_mbps))
+    elif not size_bytes:
+        print("File size unknown; skipping time estimate.")
+
+    if job.filename:
+        outtmpl = os.path.join(job.output_dir, f"{job.filename}.%(ext)s")
+    else:
+        outtmpl = os.path.join(job.output_dir, "%(title)s.%(ext)s")
+
+    ffmpeg_path = ffmpeg_path or shutil.which("ffmpeg")
+    plan = None
+    if job.download_type == "video" and job.aac:
+        plan = plan_aac_for(job.url, format_selector, ffmpeg_path)
+        print(f"AAC audio: {plan.action} ({plan.reason})")
+    stream_mp3_ffmpeg = None
+    if job.download_type == "audio" and job.mp3 and job.stream_mp3:
+        if job.keep_source:
+            print("Keeping the original audio, so converting after the download.")
+        else:
+            stream_mp3_ffmpeg = ffmpeg_path
+
+    print(f"Downloading with format: {format_selector}")
+    file_path = ydl_download(
+        job.url,
+        format_selector,
+        outtmpl,
+        extra_opts=plan.ydl_opts if plan else None,
+        connections=job.connections,
+        stream_mp3_ffmpeg=stream_mp3_ffmpeg,
+    )
+    print(f"Downloaded file path: {file_path}")
+
+    if plan and plan.action == "reencode":
+        print(f"AAC audio saved to: {file_path}")
+    elif plan and plan.action == "probe" and ffmpeg_path:
+        error = reencode_aac_after_probe(file_path, ffmpeg_path, job.transcode_segments)
+        if error:
+            print("AAC re-encode failed:")
+            print(error)
+        else:
+            print(f"AAC audio checked: {file_path}")
+
+    if job.download_type == "audio" and job.mp3 and is_mp3(file_path):
+        print(f"MP3 streamed to: {file_path} (no intermediate file)")
+    elif job.download_type == "audio" and job.mp3:
+        if job.keep_source:
+            archive_download(job.url, archive_kind("audio"), format_selector, file_path)
+        if not ffmpeg_path:
+            print("ffmpeg not found; audio saved in its original format.")
+            return file_path
+        mp3_path = mp3_output_path(file_path)
+        outcome = run_transcode(
+            TranscodeJob(
+                build_mp3_command(ffmpeg_path, file_path, mp3_path),
+                file_path,
+                mp3_path,
+                remove_source=not job.keep_source,
+                segments=job.transcode_segments,
+                audio_args=MP3_ARGS,
+            )
+        )
+        if not outcome.ok:
+            raise RuntimeError(f"MP3 conversion failed: {outcome.error}")
+        if outcome.segments > 1:
+            print(f"Encoded in {outcome.segments} parallel segments.")
+        print(f"MP3 saved to: {mp3_path} (VBR quality: ~245 kbps)")
+        file_path = mp3_path
+
+    archive_download(job.url, kind, format_selector, file_path)
+    return file_path
+
+
+def prompt_speed_mbps() -> float | None:
+    """Ask for (or measure) the download speed used for the time estimate."""
+    # Real downloads are measured passively; only fall back to a synthetic
+    # speed test when there is no history yet.
+    speed_mbps = BANDWIDTH.estimate_mbps()
+    if speed_mbps:
+        print(f"Measured throughput from recent downloads: {speed_mbps:.1f} Mbps")
+        return speed_mbps
+    auto_speed = (
+        input("Auto-detect download speed for time estimate? (y/N): ").strip().lower()
+    )
+    if auto_speed == "y":
+        cached_speed = SPEED_HISTORY.smoothed_mbps()
+        if cached_speed is not None:
+            use_cached = (
+                input(f"Use smoothed speed {cached_speed:.1f} Mbps? (Y/n): ")
+                .strip()
+                .lower()
+            )
+            if use_cached in {"", "y", "yes"}:
+                return cached_speed
+        test_url = input("Speed test URL (Enter for default): ").strip()
+        try:
+            result = run_speed_test(test_url or DEFAULT_SPEED_TEST_URL)
+            print(f"Measured: {format_result(result)}")
+            SPEED_HISTORY.append(result)
+            speed_mbps = SPEED_HISTORY.smoothed_mbps() or result.median_mbps
+            print(f"Estimated speed: {speed_mbps:.1f} Mbps")
+            return speed_mbps
+        except Exception as exc:
+            print(f"Speed test failed: {exc}")
+    speed_input = input(
+        "Enter your download speed in Mbps for time estimate (Enter to skip): "
+    ).strip()
+    if not speed_input:
+        return None
+    try:
+        speed_mbps = float(speed_input)
+        if speed_mbps <= 0:
+            raise ValueError
+    except ValueError:
+        print("Invalid speed input. Skipping time estimate.")
+        return None
+    return speed_mbps
+
+
+def prompt_format(info: dict[str, Any], download_type: str) -> dict[str, Any] | None:
+    """List the formats for download_type and return the chosen one."""
+    if download_type == "audio":
+        options = audio_format_options(info)
+        if not options:
+            raise RuntimeError("No audio-only streams found for this video.")
         print("Available audio options:")
-        for index, fmt in enumerate(formats, start=1):
-            size_bytes = fmt.get("filesize") or fmt.get("filesize_approx") or 0
-            size_mb = size_bytes / (1024 * 1024)
+        for index, fmt in enumerate(options, start=1):
+            size_mb = format_size_bytes(fmt) / (1024 * 1024)
             label = fmt.get("abr") or fmt.get("tbr")
             label_text = f"{label} kbps" if label else "unknown bitrate"
             ext = fmt.get("ext") or "unknown"
             print(f"{index}. {label_text} - {ext} - {size_mb:.1f} MB")
-
         choice = input("Choose an audio option by number (Enter for best): ").strip()
     else:
-        manual_select = (
-            input("Select resolution manually? (y/N): ").strip().lower() == "y"
+        if input("Select resolution manually? (y/N): ").strip().lower() != "y":
+            return None
+        options = video_format_options(info)
+        if not options:
+            raise RuntimeError("No compatible MP4 video stream found for this video.")
+        if options[0].get("acodec") == "none":
+            print("No combined video+audio streams found. Will merge audio if needed.")
+        print("Available resolutions:")
+        for index, fmt in enumerate(options, start=1):
+            size_mb = format_size_bytes(fmt) / (1024 * 1024)
+            height = fmt.get("height")
+            label = f"{height}p" if height else "unknown"
+            has_audio = fmt.get("acodec") != "none"
+            audio_label = "with audio" if has_audio else "video only"
+            print(f"{index}. {label} - {audio_label} - {size_mb:.1f} MB")
+        choice = input("Choose a resolution by number (Enter for highest): ").strip()
+
+    if not choice:
+        return options[0]
+    try:
+        return options[int(choice) - 1]
+    except (ValueError, IndexError) as exc:
+        raise RuntimeError("Invalid format choice.") from exc
+
+
+def run_interactive(
+    connections: int = 1,
+    deadline_seconds: float | None = None,
+    max_bytes: int | None = None,
+) -> None:
+    """Prompt for a single URL and its options, then download it.
+
+    With a deadline or byte budget, the format is picked automatically.
+    """
+    url = input("Enter the YouTube video URL: ")
+
+    try:
+        download_type = (
+            input("Download type (video/audio, Enter for video): ").strip().lower()
+        ) or "video"
+        if download_type not in {"video", "audio"}:
+            raise RuntimeError("Invalid download type. Use 'video' or 'audio'.")
+        # Video audio always goes through the AAC planner here.
+        job = SingleDownload(
+            url=url,
+            download_type=download_type,
+            aac=download_type == "video",
+            deadline_seconds=deadline_seconds,
+            max_bytes=max_bytes,
+            connections=connections,
+            skip_archived=False,
         )
-        if manual_select:
-            formats = [
-                fmt
-                for fmt in info.get("formats", [])
-                if fmt.get("vcodec") != "none" and fmt.get("ext") == "mp4"
-            ]
-            if not formats:
-                raise RuntimeError(
-                    "No compatible MP4 video stream found for this video."
-                )
+        if download_type == "audio":
+            job.mp3 = (
+                input("Convert to MP3 with ffmpeg? (y/N): ").strip().lower() == "y"
+            )
 
-            combined_formats = [fmt for fmt in formats if fmt.get("acodec") != "none"]
-            display_formats = combined_formats or formats
-            if not combined_formats:
-                print(
-                    "No combined video+audio streams found. Will merge audio if needed."
-                )
+        configure_js_runtime()
+        info = extract_info_with_ytdlp_api(url)
 
-            display_formats.sort(key=lambda fmt: fmt.get("height") or 0, reverse=True)
-            print("Available resolutions:")
-            for index, fmt in enumerate(display_formats, start=1):
-                size_bytes = fmt.get("filesize") or fmt.get("filesize_approx") or 0
-                size_mb = size_bytes / (1024 * 1024)
-                height = fmt.get("height")
-                label = f"{height}p" if height else "unknown"
-                has_audio = fmt.get("acodec") != "none"
-                audio_label = "with audio" if has_audio else "video only"
-                print(f"{index}. {label} - {audio_label} - {size_mb:.1f} MB")
-
-            choice = input(
-                "Choose a resolution by number (Enter for highest): "
-            ).strip()
+        if deadline_seconds is None and not max_bytes:
+            selected_format = prompt_format(info, download_type)
+            job.format_selector = selector_for_format(selected_format, download_type)
+            if format_size_bytes(selected_format):
+                job.speed_mbps = prompt_speed_mbps()
         else:
-            display_formats = []
-            choice = ""
+            job.format_selector, _ = resolve_single_format(job, info)
 
-    if not manual_select or not display_formats:
-        selected_format = None
-    elif choice:
-        try:
-            selected_index = int(choice) - 1
-            selected_format = display_formats[selected_index]
-        except (ValueError, IndexError) as exc:
-            raise RuntimeError("Invalid resolution choice.") from exc
-    else:
-        selected_format = display_formats[0]
+        existing = ARCHIVE.find(url, single_archive_kind(job), job.format_selector)
+        if existing:
+            again = (
+                input(f"Already downloaded to {existing.path}. Download again? (y/N): ")
+                .strip()
+                .lower()
+            )
+            if again != "y":
+                print("Skipped.")
+                return
 
-    size_bytes = 0
-    if selected_format is not None:
-        size_bytes = (
-            selected_format.get("filesize")
-            or selected_format.get("filesize_approx")
-            or 0
-        )
-    if size_bytes:
-        auto_speed = (
-            input("Auto-detect download speed for time estimate? (y/N): ")
-            .strip()
-            .lower()
+        job.filename = (
+            input("Enter filename without extension (Enter to keep default): ").strip()
+            or None
         )
-        speed_mbps = None
-        if auto_speed == "y":
-            cached_speed = load_cached_speed()
-            if cached_speed is not None:
-                use_cached = (
-                    input(f"Use cached speed {cached_speed:.1f} Mbps? (Y/n): ")
-                    .strip()
-                    .lower()
-                )
-                if use_cached in {"", "y", "yes"}:
-                    speed_mbps = cached_speed
-            test_url = input(f"Speed test URL (Enter for default): ").strip()
-            if not test_url:
-                test_url = DEFAULT_SPEED_TEST_URL
-            try:
-                if speed_mbps is None:
-                    speed_mbps = measure_download_speed(test_url, MAX_TEST_BYTES)
-                    save_cached_speed(speed_mbps)
-                    print(f"Estimated speed: {speed_mbps:.1f} Mbps")
-            except Exception as exc:
-                print(f"Speed test failed: {exc}")
-        if speed_mbps is None:
-            speed_input = input(
-                "Enter your download speed in Mbps for time estimate (Enter to skip): "
-            ).strip()
-            if speed_input:
-                try:
-                    speed_mbps = float(speed_input)
-                    if speed_mbps <= 0:
-                        raise ValueError
-                except ValueError:
-                    print("Invalid speed input. Skipping time estimate.")
-                    speed_mbps = None
-        if speed_mbps:
-            seconds = (size_bytes * 8) / (speed_mbps * 1_000_000)
-            minutes = seconds / 60
-            if minutes >= 1:
-                print(f"Estimated download time: {minutes:.1f} minutes")
-            else:
-                print(f"Estimated download time: {seconds:.0f} seconds")
-    else:
-        print("File size unknown; skipping time estimate.")
 
-    filename = input(
-        "Enter filename without extension (Enter to keep default): "
-    ).strip()
-    if filename:
-        outtmpl = os.path.join(output_dir, f"{filename}.%(ext)s")
-    else:
-        outtmpl = os.path.join(output_dir, "%(title)s.%(ext)s")
+        ffmpeg_path = None
+        if job.aac or job.mp3:
+            ffmpeg_path = resolve_ffmpeg_path(interactive=True)
+        run_single(job, ffmpeg_path)
+        print("Download completed!")
+    except Exception as exc:
+        print(f"Download failed: {exc}")
 
-    if download_type == "video":
-        if selected_format is None:
-            # Use 'best' which prefers combined formats, avoiding merge issues
-            format_selector = "best"
-        else:
-            format_id = selected_format.get("format_id")
-            if selected_format.get("acodec") == "none":
-                # Use 'best' as fallback to find combined formats
-                format_selector = "best"
-            else:
-                format_selector = format_id
+
+def parse_resolution(value: str) -> int:
+    try:
+        height = int(value.lower().rstrip("p"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid resolution: {value!r}") from None
+    if height <= 0:
+        raise argparse.ArgumentTypeError(f"invalid resolution: {value!r}")
+    return height
+
+
+def parse_speed(value: str) -> float | str:
+    if value.lower() == "auto":
+        return "auto"
+    try:
+        speed = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid speed: {value!r}") from None
+    if speed <= 0:
+        raise argparse.ArgumentTypeError(f"invalid speed: {value!r}")
+    return speed
+
+
+def measure_speed_mbps() -> float | None:
+    """Run a speed test, save it to the history and return the smoothed speed."""
+    try:
+        result = run_speed_test()
+    except Exception as exc:
+        print(f"Speed test failed: {exc}")
+        return None
+    print(f"Measured: {format_result(result)}")
+    SPEED_HISTORY.append(result)
+    return SPEED_HISTORY.smoothed_mbps() or result.median_mbps
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Download YouTube videos or audio. Without a URL, --batch "
+        "or --playlist, the options are asked for interactively."
+    )
+    parser.add_argument("url", nargs="?", help="video URL to download")
+    parser.add_argument(
+        "--batch",
+        metavar="FILE",
+        help="download every URL listed in FILE ('-' reads from stdin)",
+    )
+    parser.add_argument(
+        "--playlist",
+        metavar="URL",
+        help="download every entry of a playlist or channel, starting as "
+        "entries are found",
+    )
+    parser.add_argument(
+        "--prefetch",
+        type=int,
+        default=DEFAULT_PREFETCH,
+        help="playlist entries to read ahead of the workers "
+        f"(default: {DEFAULT_PREFETCH})",
+    )
+    parser.add_argument(
+        "--type",
+        choices=["video", "audio"],
+        default="video",
+        help="download type (default: video)",
+    )
+    parser.add_argument(
+        "--resolution",
+        type=parse_resolution,
+        metavar="HEIGHT",
+        help="highest video resolution to pick, e.g. 720 or 720p (default: best)",
+    )
+    parser.add_argument(
+        "--speed",
+        type=parse_speed,
+        metavar="MBPS",
+        help="download speed for the time estimate and --deadline; 'auto' runs "
+        "a speed test (default: measured from recent downloads)",
+    )
+    parser.add_argument(
+        "--filename", help="output name without extension (default: video title)"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_BATCH_WORKERS,
+        help=f"parallel downloads in batch mode (default: {DEFAULT_BATCH_WORKERS})",
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=DEFAULT_BATCH_RETRIES,
+        help=f"retries per URL in batch mode (default: {DEFAULT_BATCH_RETRIES})",
+    )
+    parser.add_argument(
+        "--output-dir", default="downloads", help="output folder (default: downloads)"
+    )
+    parser.add_argument(
+        "--connections",
+        type=int,
+        default=1,
+        help="parallel connections per file; >1 enables resumable segmented "
+        "downloads (default: 1)",
+    )
+    parser.add_argument(
+        "--deadline",
+        type=float,
+        metavar="SECONDS",
+        help="pick the best format that should finish within SECONDS at the "
+        "measured bandwidth; in batch mode this is the whole batch's window",
+    )
+    parser.add_argument(
+        "--max-mb",
+        type=float,
+        metavar="MB",
+        help="pick the best format no larger than MB per file",
+    )
+    parser.add_argument(
+        "--no-archive",
+        action="store_true",
+        help="download again even if the download archive has the video",
+    )
+    parser.add_argument(
+        "--cache-max-gb",
+        type=float,
+        help="keep archived downloads in downloads/ under this many GB, "
+        "deleting the coldest first (default: no limit)",
+    )
+    parser.add_argument(
+        "--cache-policy",
+        choices=EVICTION_POLICIES,
+        default=EVICT_LRU,
+        help="which downloads to delete first: least recently (lru) or least "
+        "often (lfu) used",
+    )
+    parser.add_argument(
+        "--cache-stats",
+        action="store_true",
+        help="print the download cache's size and hit rate, then exit",
+    )
+    parser.add_argument(
+        "--async",
+        dest="use_async",
+        action="store_true",
+        help="run batch jobs on an asyncio event loop (suits hundreds of URLs)",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        metavar="SECONDS",
+        help="give up on a batch URL after SECONDS (with --async)",
+    )
+    parser.add_argument(
+        "--limit-mbps",
+        type=float,
+        metavar="MBPS",
+        help="cap the combined speed of all downloads; single downloads are "
+        "served before batch jobs",
+    )
+    parser.add_argument(
+        "--job-limit-mbps",
+        type=float,
+        metavar="MBPS",
+        help="cap the speed of each download",
+    )
+    parser.add_argument(
+        "--stage-log",
+        metavar="FILE",
+        help="append per-stage timings as JSON lines to FILE; '' disables "
+        "(default: $YTDL_STAGE_LOG, else off)",
+    )
+    parser.add_argument(
+        "--prometheus-file",
+        metavar="FILE",
+        help="keep per-stage totals in FILE in Prometheus text format",
+    )
+    parser.add_argument("--report", help="write a JSON lines result report here")
+    parser.add_argument(
+        "--mp3", action="store_true", help="convert audio downloads to MP3"
+    )
+    parser.add_argument(
+        "--aac", action="store_true", help="re-encode video audio to AAC"
+    )
+    parser.add_argument(
+        "--keep-source",
+        action="store_true",
+        help="keep the original audio file after MP3 conversion",
+    )
+    parser.add_argument(
+        "--stream-mp3",
+        action="store_true",
+        help="with --mp3, pipe the download straight into ffmpeg and write "
+        "only the MP3 (ignored with --keep-source)",
+    )
+    parser.add_argument(
+        "--transcode-workers",
+        type=int,
+        help="parallel ffmpeg processes in batch mode (default: CPU count)",
+    )
+    parser.add_argument(
+        "--transcode-segments",
+        type=int,
+        default=1,
+        help="split MP3/AAC encodes of long files (10+ minutes) into up to N "
+        "parallel segments (default: 1, off; not used with --async)",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = parse_args(argv)
+    STAGES.configure(args.stage_log, args.prometheus_file)
+    SCHEDULER.configure(args.limit_mbps, args.job_limit_mbps)
+    cache_bytes = int(args.cache_max_gb * 1024**3) if args.cache_max_gb else None
+    evicted = ARCHIVE.configure(cache_bytes, args.cache_policy)
+    if evicted:
+        print(f"Download cache over budget; removed {len(evicted)} files.")
+    if args.cache_stats:
+        print(format_cache_stats(ARCHIVE.stats()))
+        return 0
+    max_bytes = int(args.max_mb * 1024 * 1024) if args.max_mb else None
+    if args.url and not args.batch and not args.playlist:
+        speed_mbps = measure_speed_mbps() if args.speed == "auto" else args.speed
+        job = SingleDownload(
+            url=args.url,
+            download_type=args.type,
+            resolution=args.resolution,
+            filename=args.filename,
+            output_dir=args.output_dir,
+            speed_mbps=speed_mbps,
+            deadline_seconds=args.deadline,
+            max_bytes=max_bytes,
+            mp3=args.mp3,
+            keep_source=args.keep_source,
+            stream_mp3=args.stream_mp3,
+            transcode_segments=max(1, args.transcode_segments),
+            aac=args.aac,
+            connections=max(1, args.connections),
+            skip_archived=not args.no_archive,
+        )
+        try:
+            run_single(job)
+        except Exception as exc:
+            print(f"Download failed: {exc}")
+            return 1
+        return 0
+    if not args.batch and not args.playlist:
+        run_interactive(
+            connections=max(1, args.connections),
+            deadline_seconds=args.deadline,
+            max_bytes=max_bytes,
+        )
+        return 0
+
+    if args.playlist:
+        urls: Iterable[str] = PlaylistEntries(args.playlist, prefetch=args.prefetch)
     else:
-        if selected_format is None:
-            format_selector = "best"
-        else:
-            format_selector = selected_format.get("format_id")
+        urls = read_batch_urls(args.batch)
+        if not urls:
+            print("No URLs to download.")
+            return 1
+    format_selector = "best" if args.type == "video" else "bestaudio/best"
+    if args.type == "video" and args.resolution:
+        height = args.resolution
+        format_selector = (
+            f"best[height<={height}]/bestvideo[height<={height}]+bestaudio/best"
+        )
+    speed_mbps = measure_speed_mbps() if args.speed == "auto" else args.speed
+    transcode = None
+    if args.type == "audio" and args.mp3:
+        transcode = "mp3"
+    elif args.type == "video" and args.aac:
+        transcode = "aac"
+    if args.use_async:
+        import asyncio
 
-    print(f"Downloading with format: {format_selector}")
-    file_path = download_with_ytdlp_api(url, format_selector, outtmpl)
+        from async_orchestrator import run_batch_async
 
-    if not file_path:
-        print("Download failed - no file path returned")
+        if args.transcode_segments > 1:
+            print("--transcode-segments is not used with --async.")
 
-    if download_type == "video":
-        ffmpeg_path = resolve_ffmpeg_path()
-        if file_path:
-            print(f"Downloaded file path: {file_path}")
-        else:
-            print("Download completed but file not found.")
-            raise RuntimeError("Downloaded file not found in downloads folder.")
-        if ffmpeg_path and file_path and os.path.isfile(file_path):
-            try:
-                probe = subprocess.run(
-                    [ffmpeg_path, "-i", file_path],
-                    capture_output=True,
-                    text=True,
-                )
-                print("ffmpeg stream info:")
-                print(probe.stderr.strip() or "(no stream info)")
-            except Exception as exc:
-                print(f"ffmpeg probe failed: {exc}")
-            root, ext = os.path.splitext(file_path)
-            aac_path = f"{root}_aac{ext}"
-            try:
-                result = subprocess.run(
-                    [
-                        ffmpeg_path,
-                        "-y",
-                        "-i",
-                        file_path,
-                        "-c:v",
-                        "copy",
-                        "-c:a",
-                        "aac",
-                        "-b:a",
-                        "192k",
-                        aac_path,
-                    ],
-                    capture_output=True,
-                    text=True,
+        try:
+            results = asyncio.run(
+                run_batch_async(
+                    urls,
+                    format_selector=format_selector,
+                    output_dir=args.output_dir,
+                    workers=args.workers,
+                    retries=max(0, args.retries),
+                    transcode=transcode,
+                    transcode_workers=args.transcode_workers,
+                    keep_source=args.keep_source,
+                    connections=max(1, args.connections),
+                    download_type=args.type,
+                    archive=None if args.no_archive else ARCHIVE,
+                    timeout=args.timeout,
+                    stream_mp3=args.stream_mp3,
+                    window_seconds=args.deadline,
+                    max_bytes=max_bytes,
+                    speed_mbps=speed_mbps,
                 )
-                if result.returncode != 0:
-                    print("AAC re-encode failed:")
-                    print(result.stderr.strip() or "(no stderr output)")
-                else:
-                    os.replace(aac_path, file_path)
-                    print(f"AAC re-encoded video saved to: {file_path}")
-            except Exception as exc:
-                print(f"AAC re-encode failed: {exc}")
+            )
+        except KeyboardInterrupt:
+            print("Cancelled.")
+            return 130
+        if args.report:
+            write_report(results, args.report)
+        return 0 if results and all(result.ok for result in results) else 1
+    results = run_batch(
+        urls,
+        format_selector=format_selector,
+        output_dir=args.output_dir,
+        workers=args.workers,
+        retries=max(0, args.retries),
+        report_path=args.report,
+        transcode=transcode,
+        transcode_workers=args.transcode_workers,
+        keep_source=args.keep_source,
+        connections=max(1, args.connections),
+        download_type=args.type,
+        window_seconds=args.deadline,
+        max_bytes=max_bytes,
+        archive=None if args.no_archive else ARCHIVE,
+        speed_mbps=speed_mbps,
+        stream_mp3=args.stream_mp3,
+        transcode_segments=max(1, args.transcode_segments),
+    )
+    if not results:
+        print("No URLs to download.")
+        return 1
+    return 0 if all(result.ok for result in results) else 1
 
-    if download_type == "audio":
-        convert = input("Convert to MP3 with ffmpeg? (y/N): ").strip().lower()
-        if convert == "y":
-            ffmpeg_path = resolve_ffmpeg_path()
-            if ffmpeg_path:
-                mp3_path = os.path.splitext(file_path)[0] + ".mp3"
-                try:
-                    subprocess.run(
-                        [ffmpeg_path, "-y", "-i", file_path, "-q:a", "0", mp3_path],
-                        check=True,
-                        stdout=subprocess.DEVNULL,
-                        stderr=subprocess.DEVNULL,
-                    )
-                    print(f"MP3 saved to: {mp3_path} (VBR quality: ~245 kbps)")
-                except Exception as exc:
-                    print(f"MP3 conversion failed: {exc}")
-    print("Download completed!")
-except Exception as exc:
-    print(f"Download failed: {exc}")
+
+if __name__ == "__main__":
+    sys.exit(main())
 
 
 # streamlit run streamlit_app.py
@@ -6,13 +6,17 @@ import subprocess
 from typing import Any
 
 import streamlit as st
-from yt_dlp import YoutubeDL
+
+from progress_reporter import ProgressThrottle
 
 DOWNLOAD_DIR = "downloads"
 
 
 def download_with_progress(url: str, format_id: str, outtmpl: str) -> str:
     """Download using yt-dlp and update Streamlit progress."""
+    # Imported on first download, so the page renders without waiting for it.
+    from yt_dlp import YoutubeDL
+
     status = st.empty()
     progress = st.progress(0)
 
@@ -27,17 +31,20 @@ def download_with_progress(url: str, format_id: str, outtmpl: str) -> str:
             progress.progress(100)
             status.write("Download finished. Processing...")
 
+    # Each redraw is a websocket message; send a few per second, not one per
+    # received block.
+    throttled_hook = ProgressThrottle(hook)
     ydl_opts = {
         "format": format_id,
         "outtmpl": outtmpl,
         "noplaylist": True,
         "quiet": True,
-        "progress_hooks": [hook],
+        "progress_hooks": [throttled_hook],
     }
     if "+" in format_id:
         ydl_opts["merge_output_format"] = "mp4"
 
-    with YoutubeDL(ydl_opts) as ydl:
+    with throttled_hook, YoutubeDL(ydl_opts) as ydl:
         result = ydl.extract_info(url, download=True)
         return ydl.prepare_filename(result)
 